@@ -1,11 +1,44 @@
+import numpy as np
 import pymongo
 import requests
 import vcf # PyVCF 庫
 import time
 import json
 import logging
+import bisect
+import gc
 import gzip
+import hashlib
+import heapq
+import html
+import io
+import itertools
+import random
+import sqlite3
+import struct
+import sys
+import threading
+import os
+import pickle
+import queue
+import re
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime # Added for report generation
+from email.utils import parsedate_to_datetime
+from pymongo import ReplaceOne, UpdateOne, WriteConcern
+from requests.adapters import HTTPAdapter
+
+try:
+    import pysam # 選用: 用於 Tabix/CSI 索引的區域隨機存取
+except ImportError:
+    pysam = None
+
+try:
+    import prometheus_client # 選用: 提供 Prometheus /metrics 端點
+except ImportError:
+    prometheus_client = None
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,6 +49,45 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 MONGO_URI = "mongodb+srv://<username>:<password>@cluster0.abcde.mongodb.net/?retryWrites=true&w=majority"
 DB_NAME = "genomic_data"
 COLLECTION_NAME = "na12878_lung_cancer_variants" # 更改 Collection 名稱以區分
+CHECKPOINT_COLLECTION_NAME = "annotation_run_checkpoints" # 記錄每次執行已寫入的 VCF 位置，供中斷後續跑
+
+# MongoDB 寫入設定
+# "full": 每份文件內嵌完整的 MyVariant.info 回應與 INFO 欄位；
+# "slim": 只保留報告與查詢需要的欄位，原始回應依變異 ID 去重後另存於 ANNOTATION_COLLECTION_NAME
+MONGO_STORAGE_MODE = "full"
+ANNOTATION_COLLECTION_NAME = "myvariant_annotations"
+SLIM_DOC_INFO_KEYS = ("DP",) # slim 模式下保留的 INFO 欄位
+# "upsert": 以 ReplaceOne 批量 upsert (可安全重跑/續跑)；"insert": insert_many(ordered=False)，已存在的 _id 視為已寫入
+MONGO_WRITE_MODE = "upsert"
+MONGO_WRITE_BATCH_SIZE = 1000 # 每次寫入 MongoDB 的文件數，與 VCF_CHUNK_SIZE 無關
+MONGO_CREATE_INDEXES = True # 啟動時建立報告查詢使用的索引
+# 大量載入時可降低寫入確認等級，例如 {"w": 1, "j": False} 或 {"w": 0} (不等待確認，錯誤不會回報)
+# None 表示使用連接字串的預設值；檢查點一律使用預設寫入確認
+MONGO_BULK_WRITE_CONCERN = None
+
+# 世代 (cohort) 模式 - 多個 VCF (或一個多樣本 VCF) 依位置 k 路合併，每個獨特位點只註釋一次。
+# 位點層級的註釋與評估寫入 SITE_COLLECTION_NAME，每個樣本的基因型另存於 GENOTYPE_COLLECTION_NAME (以 site_id 參照)
+COHORT_VCF_PATHS = [] # 非空時執行世代模式，例如 ["NA12878.vcf.gz", "NA12891.vcf.gz", "NA12892.vcf.gz"]
+SITE_COLLECTION_NAME = "cohort_variant_sites"
+GENOTYPE_COLLECTION_NAME = "cohort_genotypes"
+COHORT_GENOTYPE_INFO_KEYS = ("DP",) # 基因型文件保留的 INFO 欄位 (各 VCF 的定序深度等記錄層級資訊)
+COHORT_STORE_REF_CALLS = False # False 時不儲存同型合子參考 (0/0) 與缺失 (./.) 的基因型
+# 正規化 (左對齊/修剪) 後位點位置與原始 VCF 位置的最大差距 (bp)。合併時位點在讀取位置超過其位置這麼多之後才送出，
+# 因此跨越 chunk 邊界的同一位點只註釋與寫入一次；位於更長重複序列中的插入/缺失可能需要調高
+COHORT_SITE_MARGIN_BP = 1000
+
+# 報告輸出 - 以 MongoDB 聚合在伺服器端投影欄位並計算基因符號，逐筆從 cursor 串流寫入檔案 (記憶體用量與變異數無關)
+REPORT_OUTPUT_PATH = None # 例如 "gene_report.html" 或 "gene_report.json"；None 時輸出到控制台
+REPORT_FORMAT = None # "html" 或 "json"；None 時依副檔名判斷 (預設 html)
+REPORT_SORT = "gene" # "gene": 基因/染色體/位置；"position": 染色體/位置；"classification": 分類/基因
+REPORT_GROUP_BY_GENE = False # True 時依基因分組輸出 (以 REPORT_SORT = "gene" 的順序串流分組)
+REPORT_PAGE_SIZE = None # 每頁變異數；None 表示輸出全部
+REPORT_PAGE = 1
+REPORT_CURSOR_BATCH_SIZE = 500
+
+# 續跑設定 - RESUME_RUN 為 True 時從上次寫入成功的位置繼續，跳過已完成的變異
+RESUME_RUN = False
+RUN_ID = None # 檢查點識別碼；None 表示以 VCF 檔案的絕對路徑作為識別碼
 
 # VCF 檔案路徑
 VCF_FILE_PATH = "HG001_GRCh38_1_22_v4.2.1_benchmark.vcf.gz" # 請確保此檔案存在並可讀取
@@ -24,12 +96,70 @@ VCF_FILE_PATH = "HG001_GRCh38_1_22_v4.2.1_benchmark.vcf.gz" # 請確保此檔案
 # MyVariant.info 更多資訊: https://myvariant.info/
 MYVARIANT_INFO_API_URL = "https://myvariant.info/v1/variant/"
 
-# API 請求間的延遲 (秒) - 避免觸發 API 速率限制
-API_DELAY_SECONDS = 0.1 # MyVariant.info 通常較快，但仍建議延遲
+# MyVariant.info 查詢的註釋欄位
+MYVARIANT_INFO_FIELDS = "clinvar,gnomad,dbnsfp,dbsnp,ensembl.gene"
+
+# 註釋來源: "myvariant" (MyVariant.info API) 或 "local" (由 build_annotation_store.py 匯入 ClinVar/gnomAD/dbNSFP 的本地 SQLite 資料庫，完全離線)
+ANNOTATION_BACKEND = "myvariant"
+LOCAL_ANNOTATION_DB_PATH = "local_annotations.sqlite3"
+LOCAL_ANNOTATION_MMAP_BYTES = 4 * 1024 ** 3 # SQLite 記憶體映射讀取的上限
+
+# MyVariant.info 批次查詢設定 (POST /v1/variant 每次請求最多接受 1000 個 ID)
+MYVARIANT_INFO_USE_BATCH = True # 預設使用批次 POST 查詢；設為 False 則回到逐筆 GET 查詢
+MYVARIANT_INFO_BATCH_SIZE = 1000
+
+# API 速率限制 (token bucket) - 取代固定的請求間延遲，避免觸發 API 速率限制
+API_RATE_LIMIT_PER_SECOND = 10.0 # 每秒補充的請求額度；設為 0 或以下則不限速
+API_RATE_LIMIT_BURST = 10 # 額度上限 (允許的瞬間突發請求數)
+
+# 並行註釋引擎設定
+ANNOTATION_CONCURRENCY = 8 # 同時進行中的 HTTP 請求數 (同時也是連線池大小)
+API_REQUEST_TIMEOUT_SECONDS = 30
+API_MAX_RETRIES = 5 # 遇到 429/5xx 或連線錯誤時的最大重試次數
+API_BACKOFF_BASE_SECONDS = 0.5 # 指數退避的起始等待時間
+API_BACKOFF_MAX_SECONDS = 30.0
+API_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# 管線化工作流程 - 解析、註釋、評估與寫入 MongoDB 各自為獨立階段，以有界佇列串接
+PIPELINE_QUEUE_SIZE = 4 # 每個階段輸入佇列可容納的 chunk 數 (佇列滿時上游會被阻塞，形成背壓)
+PIPELINE_ANNOTATE_WORKERS = ANNOTATION_CONCURRENCY # 同時註釋的 chunk 數
+PIPELINE_ASSESS_WORKERS = 1
+PIPELINE_WRITE_WORKERS = 1 # 寫入階段依 VCF 順序處理，只支援單一工作執行緒
+PIPELINE_REPORT_INTERVAL_SECONDS = 30 # 定期記錄各階段佇列深度、吞吐量與進度/預估剩餘時間的間隔
+
+# 執行監控 - 各階段延遲直方圖、計數器、限速等待時間與快取命中率
+METRICS_PORT = None # 例如 9108；設定後以 prometheus_client 在 METRICS_ADDR 提供 /metrics
+METRICS_ADDR = "127.0.0.1"
+PROGRESS_COUNT_RECORDS = True # 在背景估計 VCF 總記錄數以估計剩餘時間 (面板或區域過濾模式不估計)
+PROGRESS_SAMPLE_BYTES = 8 << 20 # 估計總記錄數時解壓取樣的資料量；檔案較小時直接計算確切數量
+# 每個變異的 "正在註釋變異" 日誌為 DEBUG 等級；設為 N (> 0) 時每 N 個變異以 INFO 記錄一次抽樣
+VARIANT_LOG_SAMPLE_EVERY = 0
+
+# 本地註釋快取 (SQLite) - 重複分析重疊樣本時避免再次查詢相同變異
+ANNOTATION_CACHE_ENABLED = True
+ANNOTATION_CACHE_PATH = "myvariant_annotation_cache.sqlite3"
+ANNOTATION_CACHE_TTL_SECONDS = 30 * 24 * 3600 # 已找到註釋的有效期 (30 天)
+ANNOTATION_CACHE_NOT_FOUND_TTL_SECONDS = 7 * 24 * 3600 # not_found 負面快取的有效期 (7 天)
+ANNOTATION_CACHE_MAX_BYTES = 2 * 1024 ** 3 # 壓縮後內容的總大小上限，超過時依 LRU 淘汰
 
 # VCF 讀取分塊大小
 VCF_CHUNK_SIZE = 100 # 每批次處理 100 個變異
 
+# VCF 解析後端: "pyvcf" (PyVCF 完整物件) 或 "fast" (只解碼流程需要的欄位，INFO/GT 延遲解碼)
+VCF_PARSER_BACKEND = "pyvcf"
+# fast 後端只解碼這些 INFO 鍵；None 表示全部解碼 (與 PyVCF 的 dict(record.INFO) 輸出一致)
+FAST_PARSER_INFO_KEYS = None
+
+# 平行解析 BGZF 壓縮 VCF (.vcf.gz) - 依 BGZF 區塊邊界切分檔案，由多個行程同時解壓縮與解析
+VCF_PARSE_WORKERS = 1 # 大於 1 時啟用 (使用 fast 後端)；一般 gzip 檔案仍循序解析
+VCF_PARALLEL_SPAN_BYTES = 4 * 1024 ** 2 # 每個工作單位的壓縮資料大小
+
+# 變異正規化: 多等位基因記錄分解為雙等位基因 (每個 ALT 一份文件，基因型依 ALT 重新編碼)，
+# 修剪共同前後綴，並在提供參考基因組時左對齊，讓 HGVS ID 與 MyVariant.info 的正規化 ID 一致
+# 設為 False 則回到只處理單一 ALT 記錄、跳過多等位基因記錄的舊行為
+NORMALIZE_VARIANTS = True
+REFERENCE_FASTA_PATH = None # 例如 "GRCh38.fa" (需要 pysam 與 .fai 索引)；None 表示只修剪、不左對齊
+
 # 肺腺癌相關設定
 LUNG_ADENOCARCINOMA_GENE_PANEL = [
     "EGFR", "KRAS", "TP53", "ALK", "ROS1", "BRAF", "MET", "RET", "ERBB2", "NF1", "STK11", "KEAP1"
@@ -53,11 +183,36 @@ LUNG_ADENOCARCINOMA_HPO_TERMS = [
     "HP:0002207",  # 慢性阻塞性肺疾病 (Chronic obstructive pulmonary disease)
 ]
 
+# 基因面板區域過濾 - 在註釋前只保留面板基因區域內的變異 (panel-only 模式)
+# PANEL_REGIONS_FILE 可為 BED (第 4 欄為基因名稱) 或 GTF/GTF.gz (使用 feature 為 gene 的列)
+PANEL_ONLY_MODE = False
+PANEL_REGIONS_FILE = None # 例如 "gencode.v44.annotation.gtf.gz" 或 "lung_panel_genes.bed"
+PANEL_REGION_PADDING_BP = 0 # 每個基因區域兩側額外保留的鹼基數 (例如保留剪接位點或啟動子)
+
+# Tabix/CSI 索引區域查詢 - 只讀取指定區域所在的 BGZF 區塊，而非掃描整個 VCF
+# VCF_QUERY_REGIONS 例如 ["7:55019017-55211628", "chr12:25205246-25250929"] (1-based 閉區間)；
+# 未設定時，若啟用 PANEL_ONLY_MODE 則自動使用基因面板區域。
+VCF_QUERY_REGIONS = None
+VCF_USE_TABIX_INDEX = True # 需要 pysam；索引不存在時會自動建立 (.tbi)，無法建立時退回循序掃描
+
 # ACMG 準則頻率閾值 (簡化版，實際應用中需要更詳細的閾值和人群細分)
 # 對於顯性遺傳，如果變異頻率在一般人群中高於此閾值，則可能是良性。
 # 對於隱性遺傳，閾值可以更高。這裡作為通用閾值使用。
 GNOMAD_PATHOGENICITY_THRESHOLD_AF = 0.0001 # 0.01%
 
+# 致病性評估實作: "legacy" (逐筆呼叫 assess_pathogenicity) 或 "vectorized" (整個 chunk 以規則表與 NumPy 遮罩批次評估，
+# 評級與 legacy 相同並額外記錄證據代碼；以 benchmark_pipeline.py classify 比較吞吐量)
+PATHOGENICITY_CLASSIFIER = "vectorized"
+# vectorized 產生證據文字的範圍: "reported" 只為報告會列出的評級 (Pathogenic / Likely Pathogenic) 產生，
+# 其他文件只記錄 pathogenicity_evidence_codes；"all" 為每份文件產生 (與 legacy 相同，但較慢)
+PATHOGENICITY_EVIDENCE_TEXT = "reported"
+
+# 致病性規則版本 - 每份文件記錄評估時的 pathogenicity_ruleset，供重新分類模式只處理過時的文件。
+# 完整版本為 "<名稱>+<雜湊>"，雜湊涵蓋規則表、各閾值、基因面板與 HPO terms，修改這些設定時版本自動改變；
+# 規則條件 (lambda) 或 assess_pathogenicity 的邏輯無法可靠雜湊，修改時請遞增此名稱。
+PATHOGENICITY_RULESET_NAME = "acmg-lite-1"
+RECLASSIFY_BATCH_SIZE = 1000 # 重新分類模式每批讀取與更新的文件數
+
 # --- MongoDB 相關函數 ---
 def get_mongo_collection():
     """
@@ -73,384 +228,3655 @@ def get_mongo_collection():
         logging.error(f"無法連接到 MongoDB Atlas: {e}")
         return None
 
-# --- VCF 解析函數 (帶有分塊功能) ---
-def parse_vcf_in_chunks(file_path, chunk_size):
+def load_checkpoint(checkpoint_collection, run_id):
     """
-    解析 VCF 文件並以指定大小的列表 (chunk) 產生變異記錄。
-    支援壓縮的 VCF 文件 (.vcf.gz) by letting PyVCF handle it.
+    讀取指定執行的檢查點；不存在時回傳 None。
     """
     try:
-        # PyVCF's Reader can automatically handle .gz files when given a filename.
-        vcf_reader = vcf.Reader(filename=file_path)
-        
-        chunk = []
-        for record in vcf_reader:
-            chunk.append(record)
-            if len(chunk) >= chunk_size:
-                yield chunk
-                chunk = []
-        if chunk:  # 產生最後一個不完整的 chunk
-            yield chunk
-        logging.info(f"成功處理 VCF 檔案: {file_path}。") # Adjusted log after full processing
-    except FileNotFoundError:
-        logging.error(f"VCF 檔案未找到: {file_path}")
-        yield []  # 返回空列表
-    except gzip.BadGzipFile as e:
-        logging.error(f"VCF 檔案 '{file_path}' 不是有效的 GZIP 檔案或已損壞: {e}")
-        logging.error("這可能發生在當一個以 .gz 結尾的檔案實際上是純文字檔時 (例如，如果測試檔案生成邏輯未正確創建 GZIP 檔案)。")
-        logging.error("請檢查 VCF 檔案是否為正確的 GZIP 格式。")
-        yield []
-    except Exception as e:
-        # Log the type of exception as well for better debugging
-        logging.error(f"解析 VCF 檔案 '{file_path}' 時發生錯誤 ({type(e).__name__}): {e}")
-        yield []  # 返回空列表
+        return checkpoint_collection.find_one({"_id": run_id})
+    except pymongo.errors.PyMongoError as e:
+        logging.error(f"讀取檢查點 '{run_id}' 時發生錯誤: {e}")
+        return None
 
-# --- 註釋函數 (使用 MyVariant.info) ---
-def annotate_myvariant_info(chrom, pos, ref, alt):
+def save_checkpoint(checkpoint_collection, run_id, records_done, vcf_file_path, last_doc=None, completed=False,
+                    resume_offset=None):
     """
-    使用 MyVariant.info API 查詢變異的綜合註釋資訊。
-    使用 HGVS ID 格式: "chr7:g.55241707G>T"
+    記錄已成功寫入 MongoDB 的 VCF 位置 (通過區域過濾的記錄累計數與最後一個變異)。
+    resume_offset 為可直接定位的檔案位置 (VcfLineReader.offset)，連同檔案大小一併記錄，續跑時用於確認檔案未改變。
     """
-    # Construct the HGVS ID format for the variant
-    variant_id = f"chr{chrom}:g.{pos}{ref}>{alt}"
+    update = {
+        "vcf_file_path": vcf_file_path,
+        "records_done": records_done,
+        "completed": completed,
+        "updated_at": datetime.now(),
+        "resume_offset": resume_offset,
+    }
+    if resume_offset is not None:
+        try:
+            update["vcf_file_size"] = os.path.getsize(vcf_file_path)
+        except OSError:
+            update["resume_offset"] = None
+    if last_doc is not None:
+        update["last_chrom"] = last_doc["chrom"]
+        update["last_pos"] = last_doc["pos"]
+    try:
+        checkpoint_collection.update_one({"_id": run_id}, {"$set": update}, upsert=True)
+    except pymongo.errors.PyMongoError as e:
+        logging.error(f"更新檢查點 '{run_id}' 時發生錯誤: {e}")
 
-    url = f"{MYVARIANT_INFO_API_URL}{variant_id}?fields=clinvar,gnomad,dbnsfp,dbsnp,ensembl.gene"
+def checkpoint_resume_offset(checkpoint, vcf_file_path):
+    """
+    回傳檢查點中可直接定位的檔案位置；沒有記錄或檔案大小已改變時回傳 None，由呼叫端退回以記錄數略過。
+    """
+    offset = checkpoint.get("resume_offset")
+    if offset is None:
+        return None
     try:
-        response = requests.get(url)
-        response.raise_for_status()  # Check for HTTP errors
-        data = response.json()
-        if "_id" in data:  # If the variant is successfully found
-            return data
-        else:
-            return {"status": "not_found", "query": variant_id, "message": data.get("error", "未知錯誤")}
-    except requests.exceptions.RequestException as e:
-        logging.warning(f"MyVariant.info API 請求失敗 (變異 {variant_id}): {e}")
-        return {"status": "api_error", "query": variant_id, "message": str(e)}
-    except Exception as e:
-        logging.warning(f"MyVariant.info 註釋解析失敗 (變異 {variant_id}): {e}")
-        return {"status": "parsing_error", "query": variant_id, "message": str(e)}
-    finally:
-        time.sleep(API_DELAY_SECONDS)  # Respect API rate limits
+        if os.path.getsize(vcf_file_path) != checkpoint.get("vcf_file_size"):
+            logging.warning(f"'{vcf_file_path}' 的大小與檢查點記錄的不同，改為重新讀取並以記錄數略過。")
+            return None
+    except OSError:
+        return None
+    return offset
 
-# --- 致病性評估函數 (簡化 ACMG 準則) ---
-def assess_pathogenicity(variant_doc, gene_panel, hpo_terms):
+def ensure_variant_indexes(collection, indexes=None):
     """
-    根據簡化版的 ACMG 準則、ClinVar 評級、gnomAD 頻率以及基因面板來評估變異致病性。
-    同時提供相關臨床佐證。
+    建立報告查詢使用的索引 (已存在時 MongoDB 會直接略過)。未指定 indexes 時建立變異文件的預設索引。
     """
-    pathogenicity = "VUS (意義不明變異)"
-    evidence = []
-    
-    myvariant_anno = variant_doc.get("annotation_myvariant_info", {})
-    
-    # 1. 檢查 ClinVar 臨床意義 (PVS1_Strong / PS1_Strong)
-    clinvar_data = myvariant_anno.get("clinvar", {})
-    if clinvar_data:
-        # ClinVar 可能有多個結果，取第一個或聚合結果
-        # 修正: ClinVar rcv 字段可能是一個 dict 或 list of dicts
-        if isinstance(clinvar_data.get("rcv"), list) and clinvar_data["rcv"]:
-            clin_sig = clinvar_data["rcv"][0].get("clinical_significance", "").lower()
-        elif isinstance(clinvar_data.get("rcv"), dict):
-            clin_sig = clinvar_data["rcv"].get("clinical_significance", "").lower()
+    if indexes is None:
+        indexes = [
+            [("pathogenicity_assessment", pymongo.ASCENDING)],
+            [("relevant_to_lung_adenocarcinoma", pymongo.ASCENDING)],
+            [("chrom", pymongo.ASCENDING), ("pos", pymongo.ASCENDING)],
+        ]
+    try:
+        names = [collection.create_index(keys) for keys in indexes]
+        logging.info(f"已確認 '{collection.name}' 的索引: {', '.join(names)}")
+    except pymongo.errors.PyMongoError as e:
+        logging.error(f"建立 '{collection.name}' 索引時發生錯誤: {e}")
+
+# --- 快速 VCF 解析後端 ---
+class FastVcfRecord:
+    """
+    輕量 VCF 記錄 (__slots__)，只保留流程需要的欄位。
+    INFO 與樣本基因型保留原始字串，直到 build_variant_doc 真正需要時才解碼，
+    因此被區域過濾或多等位基因檢查丟棄的記錄不會付出解碼成本。
+    """
+    __slots__ = ("CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "_info", "_format", "_samples", "_parser")
+
+    def __init__(self, chrom, pos, vid, ref, alt, qual, filt, info, fmt, samples, parser):
+        self.CHROM = chrom
+        self.POS = pos
+        self.ID = vid
+        self.REF = ref
+        self.ALT = alt
+        self.QUAL = qual
+        self.FILTER = filt
+        self._info = info
+        self._format = fmt
+        self._samples = samples
+        self._parser = parser
+
+    @property
+    def INFO(self):
+        if self._parser is None:  # 由平行解析還原的記錄，INFO 與基因型已解碼
+            return self._info
+        return self._parser.decode_info(self._info)
+
+    def genotypes(self):
+        """
+        回傳 [(sample_id, GT 字串)]，與 PyVCF 的 sample['GT'] 相同 (缺少時為 None)。
+        """
+        if self._parser is None:
+            return self._samples
+        if self._format is None:
+            return []
+        fmt_fields = self._format.split(":")
+        if "GT" not in fmt_fields:
+            return [(name, None) for name in self._parser.sample_names]
+        gt_index = fmt_fields.index("GT")
+        genotypes = []
+        for name, sample in zip(self._parser.sample_names, self._samples):
+            values = sample.split(":")
+            genotypes.append((name, values[gt_index] if gt_index < len(values) else None))
+        return genotypes
+
+
+class FastVcfParser:
+    """
+    以 PyVCF 解析標頭 (INFO 型別與樣本名稱)，資料列則直接以 str.split 解碼，
+    跳過 PyVCF _Record/_Call 物件的建立。INFO 型別轉換規則與 PyVCF 相同。
+    """
+    def __init__(self, header_lines, info_keys=None):
+        self.header_lines = list(header_lines)
+        header_reader = vcf.Reader(fsock=io.StringIO("".join(header_lines)))
+        self.infos = header_reader.infos
+        self.sample_names = list(header_reader.samples)
+        self.info_keys = set(info_keys) if info_keys is not None else None
+        self._info_decoders = {}
+
+    @staticmethod
+    def _to_none(func, values):
+        return [func(v) if v not in (".", "", "NA") else None for v in values]
+
+    def _info_decoder(self, key, has_value):
+        decoder = self._info_decoders.get((key, has_value))
+        if decoder is not None:
+            return decoder
+        info = self.infos.get(key)
+        if info is not None:
+            type_code = info.type_code
         else:
-            clin_sig = "" # 沒有 rcv 資訊
+            type_code = vcf.parser.RESERVED_INFO_CODES.get(key, vcf.parser.STRING if has_value else vcf.parser.FLAG)
+        single = info is not None and info.num == 1
+        to_none = self._to_none
 
-        if "pathogenic" in clin_sig:
-            pathogenicity = "Pathogenic (致病性)"
-            evidence.append(f"ClinVar 報告為 '{clin_sig}'。")
-        elif "likely pathogenic" in clin_sig:
-            pathogenicity = "Likely Pathogenic (可能致病性)"
-            evidence.append(f"ClinVar 報告為 '{clin_sig}'。")
-        elif "benign" in clin_sig:
-            pathogenicity = "Benign (良性)"
-            evidence.append(f"ClinVar 報告為 '{clin_sig}'。")
-        elif "likely benign" in clin_sig:
-            pathogenicity = "Likely Benign (可能良性)"
-            evidence.append(f"ClinVar 報告為 '{clin_sig}'。")
-        elif "uncertain significance" in clin_sig:
-            evidence.append(f"ClinVar 報告為 '{clin_sig}'。") # 仍是 VUS
-            
-    # 2. 檢查 gnomAD 等位基因頻率 (PM2_Moderate / BA1_StandAlone)
-    gnomad_exome_af = myvariant_anno.get("gnomad_exome", {}).get("af")
-    gnomad_genome_af = myvariant_anno.get("gnomad_genome", {}).get("af")
+        if type_code == vcf.parser.FLAG or not has_value:
+            def decoder(raw):
+                return True
+        elif type_code == vcf.parser.INTEGER:
+            def decoder(raw):
+                values = raw.split(",")
+                try:
+                    val = to_none(int, values)
+                except ValueError:
+                    val = to_none(float, values)  # 與 PyVCF 相同：標頭型別錯誤時退回浮點數
+                return val[0] if single else val
+        elif type_code == vcf.parser.FLOAT:
+            def decoder(raw):
+                val = to_none(float, raw.split(","))
+                return val[0] if single else val
+        else:
+            def decoder(raw):
+                val = to_none(str, raw.split(","))
+                return val[0] if single else val
+        self._info_decoders[(key, has_value)] = decoder
+        return decoder
 
-    if gnomad_exome_af is not None and gnomad_exome_af > GNOMAD_PATHOGENICITY_THRESHOLD_AF:
-        evidence.append(f"gnomAD Exome 頻率 ({gnomad_exome_af:.4f}) 高於致病閾值 ({GNOMAD_PATHOGENICITY_THRESHOLD_AF:.4f})。")
-        if gnomad_exome_af > 0.05: # 簡化 BA1 (>5% in controls)
-            pathogenicity = "Benign (良性)"
-            evidence.append(f"gnomAD Exome 頻率 ({gnomad_exome_af:.4f}) 非常高，高度提示良性。")
-    elif gnomad_genome_af is not None and gnomad_genome_af > GNOMAD_PATHOGENICITY_THRESHOLD_AF:
-        evidence.append(f"gnomAD Genome 頻率 ({gnomad_genome_af:.4f}) 高於致病閾值 ({GNOMAD_PATHOGENICITY_THRESHOLD_AF:.4f})。")
-        if gnomad_genome_af > 0.05:
-            pathogenicity = "Benign (良性)"
-            evidence.append(f"gnomAD Genome 頻率 ({gnomad_genome_af:.4f}) 非常高，高度提示良性。")
-    else: # 頻率非常低 (PM2_Moderate)
-        if pathogenicity == "VUS (意義不明變異)": # 只有當 ClinVar 沒有明確指示時才考慮
-            evidence.append(f"gnomAD Exome 頻率 ({gnomad_exome_af if gnomad_exome_af is not None else 'N/A'}) 和 Genome 頻率 ({gnomad_genome_af if gnomad_genome_af is not None else 'N/A'}) 低，支持致病性。")
+    def decode_info(self, info_str):
+        if info_str == "." or not info_str:
+            return {}
+        result = {}
+        for entry in info_str.split(";"):
+            key, sep, raw = entry.partition("=")
+            if self.info_keys is not None and key not in self.info_keys:
+                continue
+            result[key] = self._info_decoder(key, bool(sep))(raw)
+        return result
 
-    # 3. 檢查變異類型和基因面板 (PVS1_Strong / PM1_Moderate)
-    # 這裡假設變異是單一基因的，MyVariant.info 的 ensembl.gene 應提供。
-    gene_symbol = None
-    if "ensembl" in myvariant_anno and myvariant_anno["ensembl"] and "gene" in myvariant_anno["ensembl"]:
-        gene_info = myvariant_anno["ensembl"]["gene"]
-        # 修正: ensembl.gene 可能是一個 dict (單個基因) 或 list (多個基因)
-        if isinstance(gene_info, list) and gene_info:
-            gene_symbol = gene_info[0].get("symbol") # 取第一個基因
-        elif isinstance(gene_info, dict):
-             gene_symbol = gene_info.get("symbol")
+    def parse_line(self, line):
+        row = line.rstrip("\r\n").split("\t")
+        qual = row[5]
+        try:
+            qual = int(qual)
+        except ValueError:
+            try:
+                qual = float(qual)
+            except ValueError:
+                qual = None
+        filt = row[6]
+        filt = None if filt == "." else [] if filt == "PASS" else filt.split(";")
+        fmt = row[8] if len(row) > 8 and row[8] != "." else None
+        return FastVcfRecord(
+            row[0], int(row[1]), row[2] if row[2] != "." else None, row[3],
+            [a if a != "." else None for a in row[4].split(",")],
+            qual, filt, row[7], fmt, row[9:], self,
+        )
 
-    if gene_symbol and gene_symbol.upper() in [g.upper() for g in gene_panel]:
-        evidence.append(f"變異位於肺腺癌相關基因面板中的 '{gene_symbol}' 基因。")
-        variant_doc["relevant_to_lung_adenocarcinoma"] = True
-        
-        # 檢查是否為截斷性變異 (nonsense, frameshift, splice site) - 模擬 PVS1
-        dbnsfp_data = myvariant_anno.get("dbnsfp", {})
-        if dbnsfp_data and isinstance(dbnsfp_data, list) and dbnsfp_data:
-            # dbnsfp 可能為列表，因為一個變異可能有多個轉錄本影響
-            consequences = []
-            for item in dbnsfp_data:
-                if "interpro_domain" in item and item["interpro_domain"] and isinstance(item["interpro_domain"], list):
-                     for domain in item["interpro_domain"]:
-                        if "description" in domain:
-                            evidence.append(f"變異影響功能性蛋白質結構域: {domain['description']}。") # PM1_Moderate
-                # 從 dbnsfp 獲取變異影響類型，通常在 `genecode` 或 `variant_effect` 等字段
-                # MyVariant.info 的 dbnsfp 字段結構可能因版本而異，這裡嘗試獲取 'consequence'
-                if "genecode" in item and item["genecode"]: 
-                    if isinstance(item["genecode"], list):
-                        for genecode_entry in item["genecode"]:
-                            if "consequence" in genecode_entry:
-                                consequences.append(genecode_entry["consequence"])
-                    elif isinstance(item["genecode"], dict): # 單個 genecode entry
-                        if "consequence" in item["genecode"]:
-                            consequences.append(item["genecode"]["consequence"])
-            
-            # 簡化判斷截斷性變異
-            is_truncating = False
-            for cons in consequences:
-                if any(c in cons.lower() for c in ["stop_gained", "frameshift_variant", "splice_acceptor_variant", "splice_donor_variant"]):
-                    is_truncating = True
-                    break
-            
-            if is_truncating:
-                evidence.append("變異為截斷性變異 (無義突變/移碼突變/剪接位點變異)，強烈支持致病性。")
-                if pathogenicity not in ["Pathogenic (致病性)", "Likely Pathogenic (可能致病性)"]:
-                    pathogenicity = "Likely Pathogenic (可能致病性)" # 提升致病性評級
-        
-    else:
-        variant_doc["relevant_to_lung_adenocarcinoma"] = False
-        if gene_symbol:
-            evidence.append(f"變異位於 '{gene_symbol}' 基因，但此基因不在肺腺癌相關基因面板中。")
+class VcfLineReader:
+    """
+    逐列讀取 VCF (純文字、BGZF 或一般 gzip) 並記錄續跑位置: 迭代產生資料列 (str)，
+    offset 為最後產生的資料列之後的位置。純文字為位元組位移，BGZF 為虛擬位移 (區塊起始位移 << 16 | 區塊內位移)；
+    一般 gzip 無法隨機存取，offset 為 None。start_offset 為先前取得的 offset 時，讀完標頭後直接從該位置繼續。
+    """
+    def __init__(self, file_path, start_offset=None):
+        self.file_path = str(file_path)
+        self.f = open(self.file_path, "rb")
+        self.offset = None
+        self.header_lines = []
+        if self.file_path.endswith(".gz"):
+            self.mode = "bgzf" if _bgzf_block_size(self.f, self.f.read(12)) is not None else "gzip"
         else:
-            evidence.append("無法識別變異所在的基因符號。")
+            self.mode = "text"
+        self.seekable = self.mode != "gzip"
+        lines = self._iter_lines(0)
+        first_line = None
+        for line, offset in lines:
+            if line.startswith(b"#"):
+                self.header_lines.append(line.decode("utf-8"))
+            elif line.strip():
+                first_line = (line, offset)
+                break
+        if start_offset is not None and self.seekable:
+            lines.close()
+            self._lines = self._iter_lines(start_offset)
+        else:
+            self._lines = itertools.chain([first_line] if first_line else [], lines)
 
-    # 4. 計算證據分數或提升評級 (這裡簡化為基於關鍵證據提升)
-    # 如果 ClinVar 已經是 Pathogenic/Likely Pathogenic，則優先採用。
-    # 否則，綜合其他證據。
+    def __enter__(self):
+        return self
 
-    # 如果是 VUS，且有低頻率和截斷性/功能影響，可以考慮提升為 Likely Pathogenic
-    if pathogenicity == "VUS (意義不明變異)" and \
-       any("低頻率" in s for s in evidence) and \
-       any("截斷性變異" in s for s in evidence) and \
-       variant_doc.get("relevant_to_lung_adenocarcinoma", False): # 確保基因與疾病相關
-        pathogenicity = "Likely Pathogenic (可能致病性)"
-        evidence.append("綜合低頻率和截斷性變異等證據，評級提升至可能致病性。")
-        
-    # 5. 添加 HPO 術語的連結 (概念性佐證)
-    # 這裡不直接用 HPO 術語篩選變異，而是強調疾病上下文
-    evidence.append(f"此分析以肺腺癌 ({', '.join(hpo_terms)}) 為主要疾病上下文進行。")
+    def __exit__(self, *exc):
+        self.close()
 
-    # 6. 整合預測工具分數 (PP3_Supporting)
-    if "dbnsfp" in myvariant_anno and myvariant_anno["dbnsfp"] and isinstance(myvariant_anno["dbnsfp"], list):
-        for item in myvariant_anno["dbnsfp"]:
-            sift_score = item.get("sift", {}).get("score")
-            polyphen_score = item.get("polyphen", {}).get("score")
-            
-            if sift_score is not None and sift_score < 0.05: # SIFT 越低越有害 (通常是 < 0.05)
-                evidence.append(f"SIFT 預測有害 (分數: {sift_score:.2f})。")
-            if polyphen_score is not None and polyphen_score > 0.9: # PolyPhen-2 越高越有害 (通常是 > 0.9)
-                evidence.append(f"PolyPhen-2 預測可能有害 (分數: {polyphen_score:.2f})。")
-            # 可以添加更多預測工具的判斷
+    def close(self):
+        self.f.close()
 
-    return pathogenicity, evidence
+    def __iter__(self):
+        for line, offset in self._lines:
+            if line.strip():
+                self.offset = offset
+                yield line.decode("utf-8")
 
-# --- 模擬 MedGemma 報告生成函數 ---
-def generate_report_with_medgemma(variants, vcf_file_name, hpo_terms_list):
+    def _iter_lines(self, offset):
+        if self.mode == "text":
+            self.f.seek(offset)
+            for line in self.f:
+                offset += len(line)
+                yield line, offset
+        elif self.mode == "gzip":
+            self.f.seek(0)
+            for line in gzip.GzipFile(fileobj=self.f):
+                yield line, None
+        else:
+            yield from self._iter_bgzf_lines(offset)
+
+    def _iter_bgzf_lines(self, virtual_offset):
+        """
+        從虛擬位移開始逐一解壓縮 BGZF 區塊，產生 (資料列, 下一列的虛擬位移)；跨越區塊的資料列會先接起來。
+        """
+        block_start, within = virtual_offset >> 16, virtual_offset & 0xFFFF
+        partial = b""
+        while True:
+            self.f.seek(block_start)
+            header = self.f.read(12)
+            if not header:
+                break
+            block_size = _bgzf_block_size(self.f, header)
+            if block_size is None:
+                raise ValueError(f"位移 {block_start} 不是有效的 BGZF 區塊")
+            self.f.seek(block_start)
+            data = gzip.decompress(self.f.read(block_size))
+            next_block = block_start + block_size
+            pos, within = within, 0
+            while True:
+                newline = data.find(b"\n", pos)
+                if newline < 0:
+                    partial += data[pos:]
+                    break
+                line, partial = partial + data[pos:newline + 1], b""
+                pos = newline + 1
+                yield line, (block_start << 16 | pos) if pos < len(data) else next_block << 16
+            block_start = next_block
+        if partial:
+            yield partial, block_start << 16
+
+class RecordChunk(list):
     """
-    模擬使用類似 MedGemma 的服務生成基因報告。
-    接收已篩選的變異列表。
+    解析函數產生的記錄 chunk；resume_offset 為最後一筆記錄之後的 VcfLineReader 位置 (無法定位時為 None)。
     """
-    report_parts = []
-    report_parts.append("<h3>Patient Gene Report (Simulated by MedGemma via Python Backend)</h3>")
-    report_parts.append(f"<p><strong>Date:</strong> {datetime.now().strftime('%Y-%m-%d')}</p>")
-    report_parts.append(f"<p><strong>Patient VCF:</strong> {vcf_file_name}</p>")
-    report_parts.append(f"<p><strong>Associated HPO Terms:</strong> {', '.join(hpo_terms_list)}</p>")
-    report_parts.append("<hr>")
-    report_parts.append("<h4>Summary of Findings:</h4>")
-    report_parts.append(
-        f"<p>Analysis of the provided VCF file in the context of HPO terms: {', '.join(hpo_terms_list)}, "
-        "has identified the following clinically significant variants. These findings should be "
-        "correlated with clinical presentation and other diagnostic information by a qualified "
-        "healthcare professional.</p>"
-    )
-    report_parts.append("<h4>Variant Details:</h4>")
+    def __init__(self, records=(), resume_offset=None):
+        super().__init__(records)
+        self.resume_offset = resume_offset
 
-    if not variants:
-        report_parts.append("<p>No significant pathogenic or likely pathogenic variants were identified for report generation based on the provided data and HPO terms in this simulation.</p>")
-    else:
-        for i, variant_doc in enumerate(variants):
-            gene_symbol = "N/A"
-            myvariant_anno = variant_doc.get("annotation_myvariant_info", {})
-            if "ensembl" in myvariant_anno and myvariant_anno["ensembl"] and "gene" in myvariant_anno["ensembl"]:
-                gene_info = myvariant_anno["ensembl"]["gene"]
-                if isinstance(gene_info, list) and gene_info:
-                    gene_symbol = gene_info[0].get("symbol", "N/A")
-                elif isinstance(gene_info, dict):
-                    gene_symbol = gene_info.get("symbol", "N/A")
-            
-            report_parts.append(f"<p><strong>Variant {i + 1}: {gene_symbol} ({variant_doc['chrom']}:{variant_doc['pos']} {variant_doc['ref']}>{variant_doc['alt']})</strong></p>")
-            report_parts.append("<ul>")
-            report_parts.append(f"    <li><strong>Classification:</strong> {variant_doc.get('pathogenicity_assessment', 'N/A')}</li>")
-            
-            evidence_html = "<ul>"
-            for ev in variant_doc.get('pathogenicity_evidence', []):
-                evidence_html += f"<li>{ev}</li>"
-            evidence_html += "</ul>"
-            report_parts.append(f"    <li><strong>Annotation & Evidence:</strong> {evidence_html}</li>")
-            
-            # Simulated MedGemma insights
-            report_parts.append(f"    <li><strong>Potential Implications (Simulated):</strong> Based on the {gene_symbol} gene's role and the nature of this variant, it is considered {variant_doc.get('pathogenicity_assessment', 'N/A').lower()}. This variant may contribute to the patient's phenotype or predisposition to conditions associated with the selected HPO terms. For example, alterations in {gene_symbol} are known to be involved in [simulated disease area, e.g., cancer development, metabolic disorders].</li>")
-            report_parts.append(f"    <li><strong>Recommendations (Conceptual):</strong> Consider confirmatory testing if not already performed. Genetic counseling is recommended. Specific therapeutic options targeting pathways involving {gene_symbol} may be relevant (e.g., [simulated therapy type]).</li>")
-            report_parts.append("</ul>")
+def open_vcf_with_fast_parser(file_path, info_keys=None):
+    """
+    開啟 VCF (支援 .gz)，讀取標頭並回傳 (FastVcfParser, 資料列迭代器, 檔案物件)。
+    """
+    f = gzip.open(file_path, "rt", encoding="utf-8") if str(file_path).endswith(".gz") else open(file_path, encoding="utf-8")
+    header_lines = []
+    first_data_line = None
+    for line in f:
+        if line.startswith("#"):
+            header_lines.append(line)
+        elif line.strip():
+            first_data_line = line
+            break
+    parser = FastVcfParser(header_lines, info_keys)
+    data_lines = itertools.chain([first_data_line] if first_data_line else [], (l for l in f if l.strip()))
+    return parser, data_lines, f
 
-    report_parts.append("<hr>")
-    report_parts.append("<h4>Disclaimer:</h4>")
-    report_parts.append("<p>This report is generated for demonstration purposes using simulated data and a conceptual MedGemma model via the Python backend. It is not a substitute for professional medical advice, diagnosis, or treatment. All interpretations and clinical decisions should be made by qualified healthcare providers.</p>")
-    
-    return "\\n".join(report_parts)
+class VcfParseError(Exception):
+    """
+    VCF 無法開啟或中途出現格式錯誤/截斷。解析函數先產生錯誤前已解析的記錄，再拋出此例外，
+    讓管線記錄來源錯誤，而不是把不完整的檔案當成已處理完畢。
+    """
 
-# --- 主註釋工作流程 ---
-def run_annotation_workflow():
+def parse_vcf_fast_in_chunks(file_path, chunk_size, start_offset=None):
     """
-    執行完整的 VCF 註釋和 MongoDB 儲存工作流程。
+    以快速後端解析 VCF 並以指定大小的 chunk (RecordChunk) 產生 FastVcfRecord。
+    start_offset 為先前 chunk 的 resume_offset 時從該位置繼續解析。
+    檔案無法讀取或資料列格式錯誤時拋出 VcfParseError。
     """
-    collection = get_mongo_collection()
-    # 修正: 檢查 Collection 物件是否為 None
-    if collection is None:
-        logging.error("無法初始化 MongoDB Collection，退出。")
-        return
+    chunk = []
+    record_count = 0
+    offset = start_offset
+    try:
+        with VcfLineReader(file_path, start_offset) as reader:
+            parse_line = FastVcfParser(reader.header_lines, FAST_PARSER_INFO_KEYS).parse_line
+            for line in reader:
+                chunk.append(parse_line(line))
+                offset = reader.offset
+                record_count += 1
+                if len(chunk) >= chunk_size:
+                    yield RecordChunk(chunk, offset)
+                    chunk = []
+        if chunk:
+            yield RecordChunk(chunk, offset)
+        logging.info(f"成功處理 VCF 檔案: {file_path}。")
+    except FileNotFoundError as e:
+        raise VcfParseError(f"VCF 檔案未找到: {file_path}") from e
+    except Exception as e:
+        if chunk:  # 先交出錯誤前已解析的記錄
+            yield RecordChunk(chunk, offset)
+        raise VcfParseError(f"解析 VCF 檔案 '{file_path}' 的第 {record_count + 1} 筆記錄時發生錯誤 "
+                            f"(檔案可能格式錯誤、損壞或截斷) ({type(e).__name__}): {e}") from e
 
-    processed_count = 0
-    inserted_count = 0
+# --- 平行 BGZF 解壓縮與解析 ---
+BGZF_EMPTY_BLOCK_SIZE = 28 # 標準 BGZF EOF 空區塊的壓縮大小
 
-    for chunk in parse_vcf_in_chunks(VCF_FILE_PATH, VCF_CHUNK_SIZE):
-        variants_to_insert = []
-        for record in chunk:
-            if len(record.ALT) != 1:
-                logging.warning(f"跳過多等位基因變異: {record.CHROM}-{record.POS}-{record.REF}-{record.ALT}")
-                continue
-            
-            chrom = str(record.CHROM)
-            pos = record.POS
-            ref = str(record.REF)
-            alt = str(record.ALT[0])  # 獲取第一個變異等位基因
-
-            variant_doc = {
-                "chrom": chrom,
-                "pos": pos,
-                "id": record.ID if record.ID else ".",
-                "ref": ref,
-                "alt": alt,
-                "qual": record.QUAL,
-                "filter": record.FILTER,
-                "info": dict(record.INFO),
-                "samples": []
-            }
-
-            for sample in record.samples:
-                sample_data = {
-                    "sample_id": sample.sample,
-                    "genotype": sample['GT']
-                }
-                variant_doc["samples"].append(sample_data)
-
-            logging.info(f"正在註釋變異: {chrom}-{pos}-{ref}-{alt} (ID: {record.ID})")
-
-            # --- 執行 MyVariant.info 註釋 ---
-            myvariant_annotation = annotate_myvariant_info(chrom, pos, ref, alt)
-            if myvariant_annotation.get("_id"):  # 確保有找到資訊
-                variant_doc["annotation_myvariant_info"] = myvariant_annotation
-
-                # --- 執行致病性評估 ---
-                pathogenicity, evidence = assess_pathogenicity(
-                    variant_doc, 
-                    LUNG_ADENOCARCINOMA_GENE_PANEL, 
-                    LUNG_ADENOCARCINOMA_HPO_TERMS
-                )
-                variant_doc["pathogenicity_assessment"] = pathogenicity
-                variant_doc["pathogenicity_evidence"] = evidence
+def scan_bgzf_blocks(file_path):
+    """
+    掃描 BGZF 檔案的區塊標頭 (不解壓縮)，回傳 [(區塊起始位移, 區塊大小)]；
+    若檔案不是 BGZF 格式 (例如一般 gzip) 則回傳 None。
+    """
+    blocks = []
+    with open(file_path, "rb") as f:
+        offset = 0
+        while True:
+            header = f.read(12)
+            if not header:
+                break
+            block_size = _bgzf_block_size(f, header)
+            if block_size is None:
+                return None
+            blocks.append((offset, block_size))
+            offset += block_size
+            f.seek(offset)
+    return blocks
 
-                variants_to_insert.append(variant_doc)
-                inserted_count += 1
-            else:
-                logging.info(f"MyVariant.info 未找到變異資訊: {chrom}-{pos}-{ref}-{alt}")
+def _bgzf_block_size(f, header):
+    """
+    由 gzip 成員標頭的前 12 個位元組與其後的 extra 欄位取得 BGZF 區塊大小；不是 BGZF 區塊時回傳 None。
+    讀取後 f 位於 extra 欄位之後。
+    """
+    if len(header) < 12 or header[:4] != b"\x1f\x8b\x08\x04":
+        return None
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = f.read(xlen)
+    i = 0
+    while i + 4 <= len(extra):
+        si1, si2, slen = extra[i], extra[i + 1], struct.unpack("<H", extra[i + 2:i + 4])[0]
+        if si1 == 66 and si2 == 67 and slen == 2:  # "BC" 子欄位記錄區塊大小
+            return struct.unpack("<H", extra[i + 4:i + 6])[0] + 1
+        i += 4 + slen
+    return None
 
-            processed_count += 1
+def plan_bgzf_spans(blocks, span_bytes):
+    """
+    將 BGZF 區塊切分為約 span_bytes 大小的工作單位，回傳 [(起始位移, 結束位移, 前一個非空區塊位移)]。
+    """
+    spans = []
+    span_start = None
+    prev_block = None
+    last_nonempty = None
+    for offset, size in blocks:
+        if span_start is None:
+            span_start, prev_block = offset, last_nonempty
+        if size != BGZF_EMPTY_BLOCK_SIZE:
+            last_nonempty = offset
+        if offset + size - span_start >= span_bytes:
+            spans.append((span_start, offset + size, prev_block))
+            span_start = None
+    if span_start is not None:
+        spans.append((span_start, blocks[-1][0] + blocks[-1][1], prev_block))
+    return spans
 
-        # 批量插入當前 chunk 的變異
-        if variants_to_insert:
-            try:
-                collection.insert_many(variants_to_insert)
-                logging.info(f"已插入 {len(variants_to_insert)} 個變異到 MongoDB。總計已處理: {processed_count}，已插入: {inserted_count}")
-            except Exception as e:
-                logging.error(f"批量插入 MongoDB 時發生錯誤: {e}")
-            variants_to_insert = []  # 清空以避免重複嘗試失敗的文檔
+_span_worker_parser = None
 
-    logging.info(f"註釋工作流程完成。總計處理了 {processed_count} 個變異，成功插入 {inserted_count} 個變異。")
-    logging.info(f"您可以透過 MongoDB Compass 或 Atlas UI 檢查 '{DB_NAME}.{COLLECTION_NAME}' Collection。")
+def _parse_bgzf_span(file_path, start, end, prev_block, header_lines, info_keys, region_intervals=None):
+    """
+    (工作行程) 解壓縮並解析 [start, end) 範圍內的 BGZF 區塊。
+    每個工作單位只負責「起始於」其範圍內的資料列：若前一個區塊不是以換行結尾，
+    開頭不完整的資料列屬於前一個工作單位；結尾不完整的資料列則繼續讀取後續區塊補齊。
+    """
+    global _span_worker_parser
+    if _span_worker_parser is None or _span_worker_parser.header_lines != list(header_lines):
+        _span_worker_parser = FastVcfParser(header_lines, info_keys)
+    parser = _span_worker_parser
 
-    # --- 產生模擬 MedGemma 報告 ---
-    if inserted_count > 0 and collection is not None:
-        logging.info("正在從 MongoDB 檢索已註釋的致病性/可能致病性變異以產生報告...")
-        try:
-            report_variants = list(collection.find({
-                "pathogenicity_assessment": {"$in": ["Pathogenic (致病性)", "Likely Pathogenic (可能致病性)"]}
-            }))
-            
-            if report_variants:
-                logging.info(f"找到 {len(report_variants)} 個變異用於報告生成。")
-                # VCF_FILE_PATH 和 LUNG_ADENOCARCINOMA_HPO_TERMS 是全域變數
-                simulated_report = generate_report_with_medgemma(report_variants, VCF_FILE_PATH, LUNG_ADENOCARCINOMA_HPO_TERMS)
-                
-                logging.info("--- SIMULATED MEDGEMMA REPORT (Python Backend) ---")
-                # 為了方便在控制台閱讀，逐行打印（或整體打印，取決於日誌配置）
-                # print 函数用於在腳本執行時直接輸出到控制台
-                print("\\n" + "="*30 + " Simulated MedGemma Report " + "="*30)
-                # simulated_report 包含 HTML 換行符，直接 print 可能不易閱讀，但日誌會保留格式
-                # 這裡我們直接 print，讓使用者看到原始的 HTML 結構報告
-                print(simulated_report.replace("\\n", "\\n")) # 確保 Python 的換行符被正確處理
-                print("="*80 + "\\n")
-                logging.info("模擬 MedGemma 報告已生成並記錄到控制台。")
-                # 你也可以將 simulated_report 寫入一個 .html 檔案
-                # with open("simulated_gene_report.html", "w", encoding="utf-8") as f_report:
-                # f_report.write(simulated_report)
-                # logging.info("模擬報告也已儲存到 simulated_gene_report.html")
+    with open(file_path, "rb") as f:
+        starts_at_line_boundary = True
+        if prev_block is not None:
+            f.seek(prev_block)
+            prev_data = gzip.decompress(f.read(start - prev_block))
+            starts_at_line_boundary = prev_data.endswith(b"\n")
+        f.seek(start)
+        data = gzip.decompress(f.read(end - start))
+        if not starts_at_line_boundary:
+            newline = data.find(b"\n")
+            data = data[newline + 1:] if newline >= 0 else b""
+        # 補齊跨越範圍結尾的最後一列
+        while data and not data.endswith(b"\n"):
+            block_start = f.tell()
+            block_size = _bgzf_block_size(f, f.read(12))
+            if block_size is None:
+                break
+            f.seek(block_start)
+            block = gzip.decompress(f.read(block_size))
+            newline = block.find(b"\n")
+            data += block[:newline + 1] if newline >= 0 else block
 
-            else:
-                logging.info("在 MongoDB 中未找到致病性/可能致病性變異以產生報告。")
-        except Exception as e:
-            logging.error(f"從 MongoDB 檢索變異或生成報告時發生錯誤: {e}")
+    records = []
+    for line in data.decode("utf-8").split("\n"):
+        if line and not line.startswith("#"):
+            records.append(parser.parse_line(line))
+    if region_intervals is not None:
+        records = filter_records_by_regions(records, GeneRegionIndex(region_intervals))
+    # 在工作行程中完成 INFO/GT 解碼，並以 tuple 形式序列化，主行程還原時成本最低
+    rows = [(r.CHROM, r.POS, r.ID, r.REF, r.ALT, r.QUAL, r.FILTER, r.INFO, r.genotypes()) for r in records]
+    return pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _load_span_records(payload):
+    """
+    還原工作行程回傳的資料列為 FastVcfRecord。
+    大量建立物件時暫停垃圾回收，避免主行程在反序列化時反覆觸發 GC 掃描。
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return [FastVcfRecord(*row[:7], row[7], None, row[8], None) for row in pickle.loads(payload)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def parse_vcf_parallel_in_chunks(file_path, chunk_size, workers, region_index=None):
+    """
+    以多個行程平行解壓縮與解析 BGZF 壓縮的 VCF，並依原始順序以 chunk 產生 FastVcfRecord。
+    同時進行中的工作單位最多為 workers * 2 個，以維持記憶體用量穩定。
+    若提供 region_index，區域過濾也在工作行程中完成。檔案不是 BGZF 格式時退回循序解析。
+    """
+    try:
+        blocks = scan_bgzf_blocks(file_path)
+    except OSError as e:
+        raise VcfParseError(f"讀取 VCF 檔案 '{file_path}' 時發生錯誤 ({type(e).__name__}): {e}") from e
+    if not blocks:
+        logging.warning(f"'{file_path}' 不是 BGZF 格式，無法平行解析，改為循序解析。")
+        for chunk in parse_vcf_fast_in_chunks(file_path, chunk_size):
+            yield filter_records_by_regions(chunk, region_index) if region_index is not None else chunk
+        return
+
+    parser, _, f = open_vcf_with_fast_parser(file_path, FAST_PARSER_INFO_KEYS)
+    f.close()
+    region_intervals = None
+    if region_index is not None:
+        region_intervals = {c: list(zip(region_index.starts[c].tolist(), region_index.ends[c].tolist())) for c in region_index.starts}
+    spans = plan_bgzf_spans(blocks, VCF_PARALLEL_SPAN_BYTES)
+    logging.info(f"平行解析 '{file_path}': {len(blocks)} 個 BGZF 區塊，{len(spans)} 個工作單位，{workers} 個行程。")
+
+    chunk = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for span in itertools.chain(spans, [None] * workers * 2):
+                if span is not None:
+                    pending.append(executor.submit(
+                        _parse_bgzf_span, file_path, *span, parser.header_lines, FAST_PARSER_INFO_KEYS, region_intervals
+                    ))
+                # 佇列已滿或已無新的工作單位時，依提交順序取回最早的結果，確保輸出順序與檔案一致
+                if pending and (span is None or len(pending) >= workers * 2):
+                    for record in _load_span_records(pending.popleft().result()):
+                        chunk.append(record)
+                        if len(chunk) >= chunk_size:
+                            yield chunk
+                            chunk = []
+            if chunk:
+                yield chunk
+        logging.info(f"成功處理 VCF 檔案: {file_path}。")
+    except Exception as e:
+        if chunk:
+            yield chunk
+        raise VcfParseError(f"平行解析 VCF 檔案 '{file_path}' 時發生錯誤 ({type(e).__name__}): {e}") from e
+
+# --- VCF 解析函數 (帶有分塊功能) ---
+def parse_vcf_in_chunks(file_path, chunk_size, start_offset=None):
+    """
+    解析 VCF 文件並以指定大小的列表 (RecordChunk) 產生變異記錄。
+    支援壓縮的 VCF 文件 (.vcf.gz)；VcfLineReader 負責解壓縮並記錄每個 chunk 結尾的位置，
+    start_offset 為先前 chunk 的 resume_offset 時從該位置繼續解析。
+    VCF_PARSER_BACKEND 為 "fast" 時改用快速後端 (產生 FastVcfRecord)。
+    """
+    if VCF_PARSER_BACKEND == "fast":
+        yield from parse_vcf_fast_in_chunks(file_path, chunk_size, start_offset)
+        return
+    chunk = []
+    offset = start_offset
+    try:
+        with VcfLineReader(file_path, start_offset) as reader:
+            # PyVCF 每筆記錄只讀取一列，因此 reader.offset 即為剛產生的記錄之後的位置
+            vcf_reader = vcf.Reader(fsock=itertools.chain(reader.header_lines, reader))
+            for record in vcf_reader:
+                chunk.append(record)
+                offset = reader.offset
+                if len(chunk) >= chunk_size:
+                    yield RecordChunk(chunk, offset)
+                    chunk = []
+        if chunk:  # 產生最後一個不完整的 chunk
+            yield RecordChunk(chunk, offset)
+        logging.info(f"成功處理 VCF 檔案: {file_path}。") # Adjusted log after full processing
+    except FileNotFoundError as e:
+        raise VcfParseError(f"VCF 檔案未找到: {file_path}") from e
+    except gzip.BadGzipFile as e:
+        # 可能是以 .gz 結尾但實際上是純文字檔，或壓縮檔已損壞
+        if chunk:
+            yield RecordChunk(chunk, offset)
+        raise VcfParseError(f"VCF 檔案 '{file_path}' 不是有效的 GZIP 檔案或已損壞: {e}") from e
+    except Exception as e:
+        # 先交出錯誤前已解析的記錄，再讓呼叫端得知檔案沒有完整讀完
+        if chunk:
+            yield RecordChunk(chunk, offset)
+        raise VcfParseError(f"解析 VCF 檔案 '{file_path}' 時發生錯誤 ({type(e).__name__}): {e}") from e
+
+# --- Tabix/CSI 索引區域查詢 ---
+def parse_region_string(region):
+    """
+    解析 "chrom:start-end" (1-based 閉區間) 或 "chrom"，回傳 (chrom, start, end) 0-based 半開區間。
+    """
+    chrom, _, span = str(region).strip().partition(":")
+    if not span:
+        return normalize_chrom(chrom), 0, None
+    start, _, end = span.replace(",", "").partition("-")
+    return normalize_chrom(chrom), int(start) - 1, int(end) if end else None
+
+def ensure_tabix_index(file_path):
+    """
+    確保 VCF 有 Tabix/CSI 索引並回傳可查詢的 bgzip 檔案路徑。
+    未壓縮的 VCF 會先以 bgzip 壓縮為 .vcf.gz (保留原檔)；無法建立索引時回傳 None。
+    """
+    file_path = str(file_path)
+    candidates = [file_path] if file_path.endswith(".gz") else [f"{file_path}.gz"]
+    for path in candidates:
+        if os.path.exists(path) and (os.path.exists(f"{path}.tbi") or os.path.exists(f"{path}.csi")):
+            return path
+    if pysam is None:
+        logging.warning("未安裝 pysam，無法使用 Tabix/CSI 索引進行區域查詢。")
+        return None
+    try:
+        indexed_path = pysam.tabix_index(file_path, preset="vcf", keep_original=True)
+        logging.info(f"已為 '{file_path}' 建立 Tabix 索引: {indexed_path}.tbi")
+        return indexed_path
+    except (OSError, ValueError) as e:
+        # 一般 gzip (非 BGZF) 壓縮的檔案無法建立索引
+        logging.warning(f"無法為 '{file_path}' 建立 Tabix 索引 ({type(e).__name__}): {e}")
+        return None
+
+def parse_vcf_regions_in_chunks(file_path, regions, chunk_size):
+    """
+    使用 Tabix/CSI 索引只讀取指定區域 ((chrom, start, end) 0-based 半開區間) 的變異，並以 chunk 產生。
+    只產生 POS 落在區域內的記錄，因此相鄰區域不會重複產生跨越邊界的缺失變異。
+    索引不可用時退回循序掃描整個檔案並以區域索引過濾。
+    """
+    regions = list(regions)
+    indexed_path = ensure_tabix_index(file_path) if pysam is not None else None
+    if indexed_path is None:
+        logging.warning(f"'{file_path}' 無法使用索引區域查詢 (需要 pysam 與 BGZF 壓縮檔)，改為循序掃描並過濾區域。")
+        intervals = {}
+        for chrom, start, end in regions:
+            intervals.setdefault(chrom, []).append((start, end if end is not None else np.iinfo(np.int64).max))
+        region_index = GeneRegionIndex(intervals)
+        for chunk in parse_vcf_in_chunks(file_path, chunk_size):
+            yield filter_records_by_regions(chunk, region_index)
+        return
+
+    chunk = []
+    try:
+        tabix_file = pysam.TabixFile(indexed_path)
+        contigs = set(tabix_file.contigs)
+        if VCF_PARSER_BACKEND == "fast":
+            fast_parser = FastVcfParser([f"{line}\n" for line in tabix_file.header], FAST_PARSER_INFO_KEYS)
+            fetch = lambda contig, start, end: map(fast_parser.parse_line, tabix_file.fetch(contig, start, end))
+        else:
+            fetch = vcf.Reader(filename=indexed_path).fetch
+        for chrom, start, end in regions:
+            # 依索引中的 contig 命名 ("7" 或 "chr7") 選擇查詢名稱
+            contig = next((c for c in (chrom, f"chr{chrom}") if c in contigs), None)
+            if contig is None:
+                continue
+            for record in fetch(contig, start, end):
+                if record.POS - 1 < start:
+                    continue
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+        logging.info(f"成功以索引查詢 VCF 檔案: {indexed_path} ({len(regions)} 個區域)。")
+    except Exception as e:
+        if chunk:
+            yield chunk
+        raise VcfParseError(f"以索引查詢 VCF 檔案 '{indexed_path}' 時發生錯誤 ({type(e).__name__}): {e}") from e
+
+# --- 基因面板區域過濾 ---
+def normalize_chrom(chrom):
+    """
+    統一染色體名稱 ("chr7" 與 "7" 視為相同)。
+    """
+    chrom = str(chrom)
+    return chrom[3:] if chrom.lower().startswith("chr") else chrom
+
+class GeneRegionIndex:
+    """
+    基因區域索引：每條染色體以排序後、已合併的 NumPy 陣列 (0-based 半開區間) 儲存，
+    以二分搜尋 (np.searchsorted) 在 O(log n) 內判斷位置是否落在任一區域中。
+    """
+    def __init__(self, intervals_by_chrom):
+        self.starts = {}
+        self.ends = {}
+        for chrom, intervals in intervals_by_chrom.items():
+            merged = []
+            for start, end in sorted(intervals):
+                if merged and start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            arr = np.array(merged, dtype=np.int64).reshape(-1, 2)
+            self.starts[chrom] = arr[:, 0]
+            self.ends[chrom] = arr[:, 1]
+
+    def __len__(self):
+        return sum(len(v) for v in self.starts.values())
+
+    def contains(self, chrom, pos):
+        """
+        判斷 VCF 位置 (1-based) 是否落在索引的區域內。
+        """
+        return bool(self.contains_many(chrom, np.array([pos]))[0])
+
+    def contains_many(self, chrom, positions):
+        """
+        向量化判斷同一染色體上多個 VCF 位置 (1-based)，回傳布林陣列。
+        """
+        chrom = normalize_chrom(chrom)
+        positions = np.asarray(positions, dtype=np.int64) - 1  # 轉為 0-based
+        starts = self.starts.get(chrom)
+        if starts is None:
+            return np.zeros(len(positions), dtype=bool)
+        idx = np.searchsorted(starts, positions, side="right") - 1
+        in_range = idx >= 0
+        result = np.zeros(len(positions), dtype=bool)
+        result[in_range] = positions[in_range] < self.ends[chrom][idx[in_range]]
+        return result
+
+    def regions(self):
+        """
+        依染色體順序產生 (chrom, start, end) 區域 (0-based 半開區間)。
+        """
+        for chrom in self.starts:
+            for start, end in zip(self.starts[chrom].tolist(), self.ends[chrom].tolist()):
+                yield chrom, start, end
+
+def _open_text(path):
+    return gzip.open(path, "rt", encoding="utf-8") if str(path).endswith(".gz") else open(path, encoding="utf-8")
+
+def load_gene_region_index(file_path, gene_panel=None, padding=0):
+    """
+    從 BED 或 GTF 檔案建立 GeneRegionIndex。
+    若提供 gene_panel，只保留名稱在面板中的基因 (BED 需有第 4 欄名稱才會套用)。
+    """
+    panel = {g.upper() for g in gene_panel} if gene_panel else None
+    is_gtf = any(str(file_path).endswith(ext) for ext in (".gtf", ".gtf.gz", ".gff", ".gff.gz", ".gff3", ".gff3.gz"))
+    intervals = {}
+    with _open_text(file_path) as f:
+        for line in f:
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if is_gtf:
+                if len(fields) < 9 or fields[2] != "gene":
+                    continue
+                attrs = fields[8]
+                name = None
+                for key in ("gene_name", "Name", "gene"):
+                    marker = f'{key} "' if '"' in attrs else f"{key}="
+                    idx = attrs.find(marker)
+                    if idx >= 0:
+                        name = attrs[idx + len(marker):].split('"' if '"' in attrs else ";")[0]
+                        break
+                start, end = int(fields[3]) - 1, int(fields[4])  # GTF 為 1-based 閉區間
+            else:
+                if len(fields) < 3:
+                    continue
+                name = fields[3] if len(fields) > 3 else None
+                start, end = int(fields[1]), int(fields[2])
+            if panel is not None and (is_gtf or name is not None) and (name or "").upper() not in panel:
+                continue
+            intervals.setdefault(normalize_chrom(fields[0]), []).append((max(0, start - padding), end + padding))
+    index = GeneRegionIndex(intervals)
+    logging.info(f"已從 '{file_path}' 載入 {len(index)} 個基因面板區域。")
+    return index
+
+def filter_records_by_regions(records, region_index):
+    """
+    以區域索引過濾一個 chunk 的 VCF 記錄 (依染色體分組後向量化判斷)，保持原始順序。
+    """
+    if not records:
+        return records
+    by_chrom = {}
+    for i, record in enumerate(records):
+        by_chrom.setdefault(record.CHROM, []).append(i)
+    keep = np.zeros(len(records), dtype=bool)
+    for chrom, indices in by_chrom.items():
+        positions = [records[i].POS for i in indices]
+        keep[indices] = region_index.contains_many(chrom, positions)
+    return [record for record, kept in zip(records, keep) if kept]
+
+# --- 變異分解與正規化 ---
+class ReferenceGenome:
+    """
+    以 pysam.FastaFile 讀取參考基因組 (需要 .fai 索引，不存在時由 pysam 建立)，染色體名稱 "chr7" 與 "7" 互通。
+    讀取時快取目標位置左側的一段序列，左對齊重複序列中的插入/刪除時不必逐鹼基查詢。
+    """
+    WINDOW_BP = 1024
+
+    def __init__(self, path):
+        if pysam is None:
+            raise ImportError("讀取參考基因組 FASTA 需要安裝 pysam")
+        self.fasta = pysam.FastaFile(path)
+        self.names = {normalize_chrom(name): name for name in self.fasta.references}
+        self.lengths = dict(zip(self.fasta.references, self.fasta.lengths))
+        self._window = (None, 0, "")
+
+    def has_chrom(self, chrom):
+        return normalize_chrom(chrom) in self.names
+
+    def fetch(self, chrom, start, end):
+        """
+        回傳 0-based 半開區間 [start, end) 的大寫序列；染色體不存在時回傳空字串。
+        """
+        name = self.names.get(normalize_chrom(chrom))
+        if name is None:
+            return ""
+        window_name, window_start, window_seq = self._window
+        if window_name != name or start < window_start or end > window_start + len(window_seq):
+            window_start = max(0, start - self.WINDOW_BP)
+            window_end = min(self.lengths[name], end + 64)
+            window_seq = self.fasta.fetch(name, window_start, window_end).upper()
+            self._window = (name, window_start, window_seq)
+        return window_seq[start - window_start:end - window_start]
+
+def is_sequence_allele(allele):
+    """
+    是否為一般鹼基序列 (排除 "."、"*"、<DEL> 等符號等位基因與斷點表示法)。
+    """
+    return bool(allele) and all(base in "ACGTNacgtn" for base in allele)
+
+def normalize_variant(chrom, pos, ref, alt, reference=None):
+    """
+    正規化單一雙等位基因變異，回傳 (pos, ref, alt)。
+    有參考基因組時依 vt normalize 的演算法反覆修剪共同後綴並向左延伸 (左對齊)；
+    沒有時只修剪共同後綴。最後修剪共同前綴，保留至少一個鹼基 (VCF 錨定鹼基)。
+    位於 POS 1 無法向左延伸時停止修剪，兩個等位基因都不會變成空字串。
+    """
+    if ref == alt or not is_sequence_allele(ref) or not is_sequence_allele(alt):
+        return pos, ref, alt
+    if reference is not None and reference.has_chrom(chrom):
+        while True:
+            if ref and alt and ref[-1].upper() == alt[-1].upper() and (pos > 1 or min(len(ref), len(alt)) > 1):
+                ref, alt = ref[:-1], alt[:-1]
+            elif (not ref or not alt) and pos > 1:
+                base = reference.fetch(chrom, pos - 2, pos - 1)
+                ref, alt, pos = base + ref, base + alt, pos - 1
+            else:
+                break
+    else:
+        while len(ref) > 1 and len(alt) > 1 and ref[-1].upper() == alt[-1].upper():
+            ref, alt = ref[:-1], alt[:-1]
+    while len(ref) > 1 and len(alt) > 1 and ref[0].upper() == alt[0].upper():
+        ref, alt, pos = ref[1:], alt[1:], pos + 1
+    return pos, ref, alt
+
+def split_genotype(genotype, allele_index):
+    """
+    將多等位基因 GT ("1/2"、"0|2") 轉為第 allele_index 個 ALT 的雙等位基因 GT:
+    該 ALT 記為 1，其他 ALT 記為 0 (與 bcftools norm -m- 相同)，缺失值與分隔符號保持不變。
+    """
+    if genotype is None:
+        return None
+    target = str(allele_index)
+    result = []
+    token = ""
+    for char in genotype + "/":
+        if char in "/|":
+            result.append("." if token == "." else "1" if token == target else "0")
+            result.append(char)
+            token = ""
+        else:
+            token += char
+    return "".join(result[:-1])
+
+def split_info(info, alt_count, allele_index):
+    """
+    取出第 allele_index 個 ALT 的 INFO 值: 長度等於 ALT 數的列表 (Number=A) 只保留該 ALT 的值，
+    長度為 ALT 數 + 1 的列表 (Number=R) 保留 REF 與該 ALT 的值，其他欄位原樣保留。
+    以長度判斷，因此 PyVCF 與 fast 後端 (包括平行解析) 的分解結果相同。
+    """
+    result = {}
+    for key, value in info.items():
+        if isinstance(value, list):
+            if len(value) == alt_count:
+                value = [value[allele_index - 1]]
+            elif len(value) == alt_count + 1:
+                value = [value[0], value[allele_index]]
+        result[key] = value
+    return result
+
+# --- 註釋函數 (使用 MyVariant.info) ---
+def myvariant_hgvs_id(chrom, pos, ref, alt):
+    """
+    由正規化的 VCF 等位基因產生 MyVariant.info 使用的 HGVS ID:
+    SNV "chr7:g.55241707G>T"、刪除 "chr7:g.55242465_55242479del"、插入 "chr7:g.55242468_55242469insG"、
+    其他 (MNV 與複合變異) "chr7:g.55242467_55242470delinsTC"。
+    """
+    if not ref or not alt:
+        raise ValueError(f"等位基因不可為空: {chrom}-{pos}-{ref}-{alt}")
+    if len(ref) == 1 and len(alt) == 1:
+        return f"chr{chrom}:g.{pos}{ref}>{alt}"
+    if len(alt) == 1 and ref[0] == alt:
+        start, end = pos + 1, pos + len(ref) - 1
+        return f"chr{chrom}:g.{start}del" if start == end else f"chr{chrom}:g.{start}_{end}del"
+    if len(ref) == 1 and alt[0] == ref:
+        return f"chr{chrom}:g.{pos}_{pos + 1}ins{alt[1:]}"
+    if ref[0] == alt[0]: # 未正規化的錨定鹼基
+        ref, alt, pos = ref[1:], alt[1:], pos + 1
+    end = pos + len(ref) - 1
+    return f"chr{chrom}:g.{pos}delins{alt}" if end == pos else f"chr{chrom}:g.{pos}_{end}delins{alt}"
+
+def myvariant_gene_symbol(myvariant_anno):
+    """
+    從 MyVariant.info 回應的 ensembl.gene 取出基因符號 (可能為 dict 或 list，取第一個)；找不到時回傳 None。
+    """
+    ensembl = myvariant_anno.get("ensembl")
+    gene_info = ensembl.get("gene") if isinstance(ensembl, dict) else None
+    if isinstance(gene_info, list) and gene_info:
+        return gene_info[0].get("symbol")
+    if isinstance(gene_info, dict):
+        return gene_info.get("symbol")
+    return None
+
+class TokenBucketRateLimiter:
+    """
+    執行緒安全的 token bucket 限速器：每秒補充 rate_per_second 個額度，最多累積 burst 個。
+    acquire() 會阻塞直到取得額度，並回傳實際等待的秒數。
+    """
+    def __init__(self, rate_per_second, burst=1):
+        self.rate = rate_per_second
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate or self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            # 預先扣除額度 (可為負值)，讓等待中的執行緒依序排隊而不會同時被喚醒
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class AnnotationCache:
+    """
+    以 SQLite 儲存的 MyVariant.info 註釋快取。
+    鍵為 HGVS ID 加上查詢欄位，內容為 zlib 壓縮的 JSON；支援 TTL、not_found 負面快取，
+    以及依最後存取時間 (LRU) 淘汰以維持總大小上限。api_error 等暫時性錯誤不會被快取。
+    內容總大小由觸發器維護在 cache_meta 的 total_bytes 列 (其他程序寫入同一快取時也正確)，開啟快取不需掃描整個資料表。
+    """
+    def __init__(self, path=None, ttl_seconds=None, not_found_ttl_seconds=None, max_bytes=None):
+        self.path = path or ANNOTATION_CACHE_PATH
+        self.ttl_seconds = ANNOTATION_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.not_found_ttl_seconds = ANNOTATION_CACHE_NOT_FOUND_TTL_SECONDS if not_found_ttl_seconds is None else not_found_ttl_seconds
+        self.max_bytes = ANNOTATION_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS annotations ("
+            " key TEXT PRIMARY KEY, payload BLOB NOT NULL, not_found INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_annotations_accessed_at ON annotations (accessed_at)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        # 寫入使用 UPSERT 而非 INSERT OR REPLACE: REPLACE 刪除舊列時不會觸發 DELETE 觸發器
+        self.conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS annotations_size_insert AFTER INSERT ON annotations BEGIN
+                UPDATE cache_meta SET value = value + LENGTH(NEW.payload) WHERE name = 'total_bytes';
+            END;
+            CREATE TRIGGER IF NOT EXISTS annotations_size_update AFTER UPDATE OF payload ON annotations BEGIN
+                UPDATE cache_meta SET value = value + LENGTH(NEW.payload) - LENGTH(OLD.payload) WHERE name = 'total_bytes';
+            END;
+            CREATE TRIGGER IF NOT EXISTS annotations_size_delete AFTER DELETE ON annotations BEGIN
+                UPDATE cache_meta SET value = value - LENGTH(OLD.payload) WHERE name = 'total_bytes';
+            END;
+        """)
+        # 舊版快取檔案沒有 total_bytes 列: 只在第一次開啟時計算一次
+        self.conn.execute("INSERT OR IGNORE INTO cache_meta SELECT 'total_bytes', COALESCE(SUM(LENGTH(payload)), 0) FROM annotations")
+        self.conn.commit()
+        self.total_bytes = self._stored_total_bytes()
+
+    def _stored_total_bytes(self):
+        return self.conn.execute("SELECT value FROM cache_meta WHERE name = 'total_bytes'").fetchone()[0]
+
+    @staticmethod
+    def _key(variant_id, fields):
+        return f"{fields}|{variant_id}"
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_many(self, variant_ids, fields):
+        """
+        查詢多個變異，回傳 {variant_id: 註釋} 字典 (只包含未過期的命中)。
+        """
+        keys = {self._key(v, fields): v for v in dict.fromkeys(variant_ids)}
+        now = time.time()
+        found = {}
+        with self.lock:
+            key_list = list(keys)
+            for start in range(0, len(key_list), 500):  # 避免超過 SQLite 參數數量上限
+                batch = key_list[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, payload, not_found FROM annotations WHERE key IN ({placeholders}) AND expires_at > ?",
+                    (*batch, now),
+                ).fetchall()
+                for key, payload, not_found in rows:
+                    found[keys[key]] = json.loads(zlib.decompress(payload))
+                    self.negative_hits += not_found
+                if rows:
+                    hit_keys = [row[0] for row in rows]
+                    self.conn.execute(
+                        f"UPDATE annotations SET accessed_at = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                        (now, *hit_keys),
+                    )
+            self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items, fields):
+        """
+        寫入多筆 (variant_id, 註釋)；只快取已找到的註釋與 not_found 結果。
+        """
+        now = time.time()
+        rows = []
+        for variant_id, annotation in items:
+            if annotation.get("_id"):
+                not_found, ttl = 0, self.ttl_seconds
+            elif annotation.get("status") == "not_found":
+                not_found, ttl = 1, self.not_found_ttl_seconds
+            else:
+                continue
+            payload = zlib.compress(json.dumps(annotation).encode("utf-8"))
+            rows.append((self._key(variant_id, fields), payload, not_found, now + ttl, now))
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO annotations VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET payload = excluded.payload,"
+                " not_found = excluded.not_found, expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+                rows,
+            )
+            self.total_bytes = self._stored_total_bytes()
+            if self.total_bytes > self.max_bytes:
+                self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now):
+        """
+        先刪除已過期的項目，再依最後存取時間淘汰最舊的項目，直到低於上限的 90%。
+        """
+        self.conn.execute("DELETE FROM annotations WHERE expires_at <= ?", (now,))
+        self.total_bytes = self._stored_total_bytes()
+        target = self.max_bytes * 0.9
+        cursor = self.conn.execute("SELECT key, LENGTH(payload) FROM annotations ORDER BY accessed_at")
+        evict_keys = []
+        for key, size in cursor:
+            if self.total_bytes <= target:
+                break
+            evict_keys.append((key,))
+            self.total_bytes -= size
+        cursor.close()
+        self.conn.executemany("DELETE FROM annotations WHERE key = ?", evict_keys)
+        self.total_bytes = self._stored_total_bytes()
+        logging.info(f"註釋快取超過大小上限，已淘汰 {len(evict_keys)} 筆最久未使用的項目。")
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_ratio = self.hits / lookups if lookups else 0.0
+        return (f"註釋快取統計: 命中 {self.hits} (其中 not_found {self.negative_hits})，"
+                f"未命中 {self.misses}，命中率 {hit_ratio:.1%}")
+
+
+class MyVariantInfoClient:
+    """
+    MyVariant.info 並行註釋引擎。
+    所有請求共用同一個 requests.Session 連線池與 token bucket 限速器，
+    遇到 429/5xx 或連線錯誤時以指數退避重試，並遵守 Retry-After 標頭。
+    批次或逐筆查詢的回傳結果皆與輸入順序一致。
+    """
+    def __init__(self, api_url=None, fields=None, concurrency=None, rate_per_second=None, burst=None,
+                 max_retries=None, timeout=None, cache=None):
+        self.api_url = api_url or MYVARIANT_INFO_API_URL
+        self.cache = cache
+        self.request_count = 0
+        self.lock = threading.Lock() # request_count 由多個工作執行緒同時累加
+        self.fields = fields or MYVARIANT_INFO_FIELDS
+        self.concurrency = concurrency or ANNOTATION_CONCURRENCY
+        self.max_retries = API_MAX_RETRIES if max_retries is None else max_retries
+        self.timeout = timeout or API_REQUEST_TIMEOUT_SECONDS
+        self.rate_limiter = TokenBucketRateLimiter(
+            API_RATE_LIMIT_PER_SECOND if rate_per_second is None else rate_per_second,
+            API_RATE_LIMIT_BURST if burst is None else burst,
+        )
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="myvariant")
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def _retry_delay(self, attempt, response=None):
+        """
+        計算重試前的等待秒數：優先使用 Retry-After 標頭，否則使用帶隨機抖動的指數退避。
+        """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(API_BACKOFF_MAX_SECONDS, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    return min(API_BACKOFF_MAX_SECONDS, max(0.0, retry_at.timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        backoff = min(API_BACKOFF_MAX_SECONDS, API_BACKOFF_BASE_SECONDS * (2 ** attempt))
+        return backoff * (0.5 + random.random() / 2)
+
+    def _request(self, method, url, **kwargs):
+        """
+        經過限速與重試的 HTTP 請求。重試用盡後拋出最後一次的 requests 例外。
+        """
+        attempt = 0
+        while True:
+            workflow_metrics.add_rate_limit_wait(self.rate_limiter.acquire())
+            with self.lock:
+                self.request_count += 1
+            workflow_metrics.inc("api_requests")
+            response = None
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                workflow_metrics.observe("api", time.perf_counter() - started)
+                if response.status_code not in API_RETRY_STATUS_CODES:
+                    return response
+                response.raise_for_status()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt, response)
+                logging.warning(f"MyVariant.info 請求失敗 ({e})，{delay:.2f} 秒後進行第 {attempt + 1} 次重試。")
+                workflow_metrics.inc("api_retries")
+                time.sleep(delay)
+                attempt += 1
+
+    def annotate(self, variant_id):
+        """
+        以 GET /v1/variant/<id> 查詢單一變異，回傳格式與 annotate_myvariant_info 相同。
+        """
+        url = f"{self.api_url}{variant_id}?fields={self.fields}"
+        try:
+            response = self._request("GET", url)
+            if response.status_code == 404:
+                return {"status": "not_found", "query": variant_id, "message": "404 Not Found"}
+            response.raise_for_status()  # Check for HTTP errors
+            data = response.json()
+            if "_id" in data:  # If the variant is successfully found
+                return data
+            else:
+                return {"status": "not_found", "query": variant_id, "message": data.get("error", "未知錯誤")}
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"MyVariant.info API 請求失敗 (變異 {variant_id}): {e}")
+            return {"status": "api_error", "query": variant_id, "message": str(e)}
+        except Exception as e:
+            logging.warning(f"MyVariant.info 註釋解析失敗 (變異 {variant_id}): {e}")
+            return {"status": "parsing_error", "query": variant_id, "message": str(e)}
+
+    def _annotate_batch(self, batch):
+        """
+        以一次 POST /v1/variant 查詢一個批次，回傳 {query: 結果} 字典。
+        """
+        results = {}
+        try:
+            response = self._request("POST", self.api_url.rstrip("/"), data={"ids": ",".join(batch), "fields": self.fields})
+            response.raise_for_status()
+            for hit in response.json():
+                query = hit.pop("query", None)
+                if query is None or query in results:
+                    continue  # 同一查詢可能對應多筆結果，與 GET 端點一樣只保留第一筆
+                if hit.get("notfound") or "_id" not in hit:
+                    results[query] = {"status": "not_found", "query": query, "message": hit.get("error", "notfound")}
+                else:
+                    results[query] = hit
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"MyVariant.info 批次 API 請求失敗 ({len(batch)} 個變異): {e}")
+            for variant_id in batch:
+                results[variant_id] = {"status": "api_error", "query": variant_id, "message": str(e)}
+        except Exception as e:
+            logging.warning(f"MyVariant.info 批次註釋解析失敗 ({len(batch)} 個變異): {e}")
+            for variant_id in batch:
+                results.setdefault(variant_id, {"status": "parsing_error", "query": variant_id, "message": str(e)})
+        return results
+
+    def annotate_batch(self, variant_ids):
+        """
+        以 POST 批次查詢多個變異；超過 MYVARIANT_INFO_BATCH_SIZE 時拆成多個請求並行送出。
+        回傳列表與 variant_ids 順序一致。
+        """
+        unique_ids = list(dict.fromkeys(variant_ids))  # 同一批次中重複的 ID 只查詢一次
+        batches = [unique_ids[i:i + MYVARIANT_INFO_BATCH_SIZE] for i in range(0, len(unique_ids), MYVARIANT_INFO_BATCH_SIZE)]
+        results = {}
+        if len(batches) == 1:
+            results.update(self._annotate_batch(batches[0]))
+        else:
+            for batch_results in self.executor.map(self._annotate_batch, batches):
+                results.update(batch_results)
+        return [
+            results.get(variant_id, {"status": "not_found", "query": variant_id, "message": "批次回應中未包含此變異"})
+            for variant_id in variant_ids
+        ]
+
+    def annotate_each(self, variant_ids):
+        """
+        以並行的逐筆 GET 查詢多個變異，回傳列表與 variant_ids 順序一致。
+        """
+        return list(self.executor.map(self.annotate, variant_ids))
+
+    def annotate_ids(self, variant_ids, fetch=None):
+        """
+        先查詢本地快取，只對未命中的變異呼叫 fetch (預設依 MYVARIANT_INFO_USE_BATCH
+        選擇批次 POST 或並行 GET)，並將結果寫回快取。回傳列表與 variant_ids 順序一致。
+        """
+        if fetch is None:
+            fetch = self.annotate_batch if MYVARIANT_INFO_USE_BATCH else self.annotate_each
+        if self.cache is None:
+            # 同一 chunk 內正規化後相同的變異 (例如分解後重疊的等位基因) 只查詢一次
+            unique_ids = list(dict.fromkeys(variant_ids))
+            if len(unique_ids) == len(variant_ids):
+                return fetch(variant_ids)
+            fetched = dict(zip(unique_ids, fetch(unique_ids)))
+            return [fetched[variant_id] for variant_id in variant_ids]
+
+        results = self.cache.get_many(variant_ids, self.fields)
+        missing = [v for v in dict.fromkeys(variant_ids) if v not in results]
+        if missing:
+            fetched = fetch(missing)
+            self.cache.put_many(zip(missing, fetched), self.fields)
+            results.update(zip(missing, fetched))
+        return [results[variant_id] for variant_id in variant_ids]
+
+    def annotate_variant_docs(self, variant_docs):
+        """
+        註釋一個 chunk 的變異文件 (經過本地快取)。
+        """
+        return self.annotate_ids([myvariant_hgvs_id(d["chrom"], d["pos"], d["ref"], d["alt"]) for d in variant_docs])
+
+
+_default_myvariant_client = None
+_default_myvariant_client_lock = threading.Lock()
+
+def get_myvariant_client():
+    """
+    取得共用的 MyVariantInfoClient (延遲建立，整個行程共用連線池與限速器)。
+    """
+    global _default_myvariant_client
+    with _default_myvariant_client_lock:
+        if _default_myvariant_client is None:
+            cache = None
+            if ANNOTATION_CACHE_ENABLED:
+                try:
+                    cache = AnnotationCache()
+                except sqlite3.Error as e:
+                    logging.warning(f"無法開啟註釋快取 '{ANNOTATION_CACHE_PATH}'，將不使用快取: {e}")
+            _default_myvariant_client = MyVariantInfoClient(cache=cache)
+        return _default_myvariant_client
+
+def annotate_myvariant_info(chrom, pos, ref, alt):
+    """
+    使用 MyVariant.info API 查詢變異的綜合註釋資訊。
+    使用 HGVS ID 格式: "chr7:g.55241707G>T"
+    """
+    client = get_myvariant_client()
+    return client.annotate_ids([myvariant_hgvs_id(chrom, pos, ref, alt)], fetch=client.annotate_each)[0]
+
+def annotate_myvariant_info_batch(variant_ids):
+    """
+    使用 MyVariant.info 的 POST /v1/variant 端點批次查詢多個變異。
+    每個請求最多送出 MYVARIANT_INFO_BATCH_SIZE 個 HGVS ID，欄位與 annotate_myvariant_info 相同。
+    回傳列表與 variant_ids 順序一致；未找到的變異 (notfound) 與請求失敗的變異
+    回傳與 annotate_myvariant_info 相同格式的狀態字典。
+    """
+    client = get_myvariant_client()
+    return client.annotate_ids(variant_ids, fetch=client.annotate_batch)
+
+# --- 本地離線註釋來源 (ClinVar / gnomAD / dbNSFP) ---
+# 合併順序: 同一個頂層欄位 (例如 ensembl.gene) 以排在前面的來源為準
+LOCAL_ANNOTATION_SOURCES = ("dbnsfp", "clinvar", "gnomad_exome", "gnomad_genome")
+
+def _first_number(values, pick=min):
+    """
+    從 dbNSFP 以 ";" 分隔的多轉錄本數值 ("0.01;.;0.2") 中挑出一個 (預設取最小值)；沒有數值時回傳 None。
+    """
+    numbers = []
+    for value in values.split(";"):
+        try:
+            numbers.append(float(value))
+        except ValueError:
+            continue
+    return pick(numbers) if numbers else None
+
+class LocalAnnotationStore:
+    """
+    以 SQLite 儲存的本地註釋資料庫，可取代 MyVariant.info API 在離線環境下註釋變異。
+    每個 (變異 HGVS ID, 來源) 存一份 JSON 片段 (主鍵索引，WITHOUT ROWID)，
+    查詢時依 LOCAL_ANNOTATION_SOURCES 的順序合併成與 MyVariant.info 回應相同的巢狀結構
+    (clinvar.rcv.clinical_significance、gnomad_exome.af、gnomad_genome.af、ensembl.gene.symbol、dbnsfp[...])，
+    因此 assess_pathogenicity 與向量化分類器不需任何修改。
+    介面與 MyVariantInfoClient 相同 (annotate_ids、annotate_variant_docs、request_count、cache)。
+    匯入的來源變異以管線相同的 normalize_variant (reference 為註釋 VCF 時使用的參考基因組) 正規化後建立鍵值，
+    查詢時直接以文件已正規化的等位基因建立鍵值，兩邊的左對齊結果一致。
+    """
+    request_count = 0 # 不會產生網路請求
+    cache = None
+
+    def __init__(self, path=None, reference=None):
+        self.path = path or LOCAL_ANNOTATION_DB_PATH
+        self.reference = reference
+        self.local = threading.local() # 每個執行緒各自的唯讀連線，可平行查詢
+        self.lookups = 0
+        self.found = 0
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS annotations ("
+            " variant_id TEXT NOT NULL, source TEXT NOT NULL, payload TEXT NOT NULL,"
+            " PRIMARY KEY (variant_id, source)) WITHOUT ROWID"
+        )
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA mmap_size={LOCAL_ANNOTATION_MMAP_BYTES}") # 以記憶體映射讀取資料庫頁面
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def variant_id(chrom, pos, ref, alt):
+        """
+        由已正規化的等位基因 (變異文件的 pos/ref/alt) 產生查詢鍵值。
+        """
+        return myvariant_hgvs_id(normalize_chrom(chrom), pos, ref, alt)
+
+    def source_variant_id(self, chrom, pos, ref, alt):
+        """
+        匯入用: 來源檔案未必修剪或左對齊，先依 NORMALIZE_VARIANTS 以與管線相同的方式正規化再產生鍵值。
+        """
+        if NORMALIZE_VARIANTS:
+            pos, ref, alt = normalize_variant(chrom, pos, ref, alt, self.reference)
+        return self.variant_id(chrom, pos, ref, alt)
+
+    # --- 匯入 ---
+    def _import_rows(self, source, rows, batch_size=50000):
+        """
+        寫入 (variant_id, 來源 JSON 片段) 列；同一變異與來源已存在時覆寫。回傳寫入筆數。
+        """
+        conn = self._connection()
+        conn.execute("PRAGMA synchronous=OFF")
+        count = 0
+        batch = []
+        for variant_id, fragment in rows:
+            batch.append((variant_id, source, json.dumps(fragment, separators=(",", ":"))))
+            if len(batch) >= batch_size:
+                conn.executemany("INSERT OR REPLACE INTO annotations VALUES (?, ?, ?)", batch)
+                count += len(batch)
+                batch = []
+        conn.executemany("INSERT OR REPLACE INTO annotations VALUES (?, ?, ?)", batch)
+        count += len(batch)
+        conn.commit()
+        conn.execute("PRAGMA synchronous=NORMAL")
+        logging.info(f"本地註釋資料庫: 已匯入 {count} 筆 {source} 記錄。")
+        return count
+
+    @staticmethod
+    def _iter_vcf_rows(path):
+        """
+        逐列產生 VCF 的 (chrom, pos, ref, [alt...], INFO dict)；只解析匯入需要的欄位。
+        """
+        with _open_text(path) as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                fields = line.rstrip("\n").split("\t", 8)
+                info = {}
+                for entry in fields[7].split(";"):
+                    key, _, value = entry.partition("=")
+                    info[key] = value
+                yield fields[0], int(fields[1]), fields[3], fields[4].split(","), info
+
+    @staticmethod
+    def _iter_tsv_rows(path):
+        """
+        逐列產生以表頭欄位名稱為鍵的 dict (表頭可用 "#" 開頭)。
+        """
+        with _open_text(path) as f:
+            header = None
+            for line in f:
+                if not line.strip():
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if header is None:
+                    header = [name.lstrip("#") for name in fields]
+                    continue
+                yield dict(zip(header, fields))
+
+    def import_clinvar_vcf(self, path):
+        """
+        匯入 ClinVar VCF (clinvar.vcf.gz): CLNSIG → clinvar.rcv.clinical_significance，GENEINFO → ensembl.gene.symbol。
+        """
+        def rows():
+            for chrom, pos, ref, alts, info in self._iter_vcf_rows(path):
+                significance = info.get("CLNSIG")
+                if not significance or alts == ["."]:
+                    continue
+                fragment = {"clinvar": {"rcv": {"clinical_significance": significance.replace("_", " ")}}}
+                if info.get("ALLELEID"):
+                    fragment["clinvar"]["allele_id"] = int(info["ALLELEID"])
+                if info.get("GENEINFO"):
+                    fragment["ensembl"] = {"gene": {"symbol": info["GENEINFO"].split(":", 1)[0]}}
+                for alt in alts:
+                    yield self.source_variant_id(chrom, pos, ref, alt), fragment
+        return self._import_rows("clinvar", rows())
+
+    def import_gnomad(self, path, kind="genome"):
+        """
+        匯入 gnomAD 位點頻率 (kind 為 "genome" 或 "exome")。
+        VCF 使用 INFO 的 AF (每個 ALT 一個值)；TSV 需要 chrom、pos、ref、alt、af 欄位。
+        """
+        if kind not in ("genome", "exome"):
+            raise ValueError(f"不支援的 gnomAD 資料類型: {kind}")
+        source = f"gnomad_{kind}"
+
+        def rows():
+            if ".vcf" in os.path.basename(path):
+                for chrom, pos, ref, alts, info in self._iter_vcf_rows(path):
+                    afs = info.get("AF", "").split(",")
+                    for alt, af in zip(alts, afs):
+                        if af not in ("", "."):
+                            yield self.source_variant_id(chrom, pos, ref, alt), {source: {"af": float(af)}}
+            else:
+                for row in self._iter_tsv_rows(path):
+                    if row.get("af") not in (None, "", "."):
+                        yield self.source_variant_id(row["chrom"], int(row["pos"]), row["ref"], row["alt"]), {source: {"af": float(row["af"])}}
+        return self._import_rows(source, rows())
+
+    def import_dbnsfp(self, path):
+        """
+        匯入 dbNSFP 萃取檔 (TSV，欄位名稱與 dbNSFP 相同: chr、pos(1-based)、ref、alt、genename、
+        SIFT_score、Polyphen2_HDIV_score、Interpro_domain、aaref、aaalt)。
+        多轉錄本分數取最有害的值 (SIFT 取最小、PolyPhen-2 取最大)；可選的 consequence 欄位優先，
+        否則由胺基酸變化推得 stop_gained / missense_variant。
+        """
+        def rows():
+            for row in self._iter_tsv_rows(path):
+                item = {}
+                consequence = row.get("consequence")
+                if not consequence and row.get("aaalt"):
+                    aaref, aaalt = row.get("aaref", ""), row["aaalt"]
+                    if aaalt == "X" and aaref != "X":
+                        consequence = "stop_gained"
+                    elif aaalt != aaref and aaalt != ".":
+                        consequence = "missense_variant"
+                if consequence:
+                    item["genecode"] = {"consequence": consequence}
+                domains = [d for d in dict.fromkeys(row.get("Interpro_domain", "").split(";")) if d and d != "."]
+                if domains:
+                    item["interpro_domain"] = [{"description": d} for d in domains]
+                sift = _first_number(row.get("SIFT_score", ""), min)
+                if sift is not None:
+                    item["sift"] = {"score": sift}
+                polyphen = _first_number(row.get("Polyphen2_HDIV_score", ""), max)
+                if polyphen is not None:
+                    item["polyphen"] = {"score": polyphen}
+                fragment = {"dbnsfp": [item]}
+                gene = row.get("genename", "").split(";")[0]
+                if gene and gene != ".":
+                    fragment["ensembl"] = {"gene": {"symbol": gene}}
+                yield self.source_variant_id(row["chr"], int(row["pos(1-based)"]), row["ref"], row["alt"]), fragment
+        return self._import_rows("dbnsfp", rows())
+
+    # --- 查詢 ---
+    def get_many(self, variant_ids):
+        """
+        查詢多個 HGVS ID，回傳 {variant_id: 合併後的註釋} (只包含有資料的變異)。
+        """
+        conn = self._connection()
+        priority = {source: i for i, source in enumerate(LOCAL_ANNOTATION_SOURCES)}
+        results = {}
+        unique_ids = list(dict.fromkeys(variant_ids))
+        for start in range(0, len(unique_ids), 500):  # 避免超過 SQLite 參數數量上限
+            batch = unique_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT variant_id, source, payload FROM annotations WHERE variant_id IN ({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            if not rows:
+                continue
+            rows.sort(key=lambda row: (row[0], priority.get(row[1], len(priority))))
+            # 整批片段一次解碼，避免逐筆呼叫 json.loads 的額外負擔
+            fragments = json.loads("[" + ",".join(row[2] for row in rows) + "]")
+            for (variant_id, _, _), fragment in zip(rows, fragments):
+                annotation = results.get(variant_id)
+                if annotation is None:
+                    annotation = results[variant_id] = {"_id": variant_id}
+                for key, value in fragment.items():
+                    annotation.setdefault(key, value)
+        return results
+
+    def annotate_ids(self, variant_ids, fetch=None):
+        """
+        回傳與 variant_ids 順序一致的註釋列表；資料庫中沒有的變異回傳 not_found 狀態字典。
+        """
+        results = self.get_many(variant_ids)
+        self.lookups += len(variant_ids)
+        self.found += sum(1 for v in variant_ids if v in results)
+        return [
+            results.get(variant_id, {"status": "not_found", "query": variant_id, "message": "本地註釋資料庫中沒有此變異"})
+            for variant_id in variant_ids
+        ]
+
+    def annotate_variant_docs(self, variant_docs):
+        """
+        註釋一個 chunk 的變異文件 (文件在建立時已正規化，不再重新正規化)。
+        """
+        return self.annotate_ids([self.variant_id(d["chrom"], d["pos"], d["ref"], d["alt"]) for d in variant_docs])
+
+    def summary(self):
+        return f"本地註釋資料庫統計: 查詢 {self.lookups} 個變異，找到 {self.found} 個"
+
+_local_annotation_store = None
+
+def get_local_annotation_store():
+    """
+    取得共用的 LocalAnnotationStore (延遲建立，開啟 LOCAL_ANNOTATION_DB_PATH)。
+    """
+    global _local_annotation_store
+    with _default_myvariant_client_lock:
+        if _local_annotation_store is None:
+            _local_annotation_store = LocalAnnotationStore()
+        return _local_annotation_store
+
+def get_annotation_client():
+    """
+    依 ANNOTATION_BACKEND 取得註釋來源: MyVariantInfoClient 或 LocalAnnotationStore (兩者介面相同)。
+    """
+    if ANNOTATION_BACKEND == "local":
+        return get_local_annotation_store()
+    return get_myvariant_client()
+
+def annotate_local(chrom, pos, ref, alt):
+    """
+    使用本地註釋資料庫查詢變異，回傳格式與 annotate_myvariant_info 相同。
+    """
+    return get_local_annotation_store().annotate_ids([LocalAnnotationStore.variant_id(chrom, pos, ref, alt)])[0]
+
+# --- 致病性評估函數 (簡化 ACMG 準則) ---
+def assess_pathogenicity(variant_doc, gene_panel, hpo_terms):
+    """
+    根據簡化版的 ACMG 準則、ClinVar 評級、gnomAD 頻率以及基因面板來評估變異致病性。
+    同時提供相關臨床佐證。
+    """
+    pathogenicity = "VUS (意義不明變異)"
+    evidence = []
+    
+    myvariant_anno = variant_doc.get("annotation_myvariant_info", {})
+    
+    # 1. 檢查 ClinVar 臨床意義 (PVS1_Strong / PS1_Strong)
+    clinvar_data = myvariant_anno.get("clinvar", {})
+    if clinvar_data:
+        # ClinVar 可能有多個結果，取第一個或聚合結果
+        # 修正: ClinVar rcv 字段可能是一個 dict 或 list of dicts
+        if isinstance(clinvar_data.get("rcv"), list) and clinvar_data["rcv"]:
+            clin_sig = clinvar_data["rcv"][0].get("clinical_significance", "").lower()
+        elif isinstance(clinvar_data.get("rcv"), dict):
+            clin_sig = clinvar_data["rcv"].get("clinical_significance", "").lower()
+        else:
+            clin_sig = "" # 沒有 rcv 資訊
+
+        if "pathogenic" in clin_sig:
+            pathogenicity = "Pathogenic (致病性)"
+            evidence.append(f"ClinVar 報告為 '{clin_sig}'。")
+        elif "likely pathogenic" in clin_sig:
+            pathogenicity = "Likely Pathogenic (可能致病性)"
+            evidence.append(f"ClinVar 報告為 '{clin_sig}'。")
+        elif "benign" in clin_sig:
+            pathogenicity = "Benign (良性)"
+            evidence.append(f"ClinVar 報告為 '{clin_sig}'。")
+        elif "likely benign" in clin_sig:
+            pathogenicity = "Likely Benign (可能良性)"
+            evidence.append(f"ClinVar 報告為 '{clin_sig}'。")
+        elif "uncertain significance" in clin_sig:
+            evidence.append(f"ClinVar 報告為 '{clin_sig}'。") # 仍是 VUS
+            
+    # 2. 檢查 gnomAD 等位基因頻率 (PM2_Moderate / BA1_StandAlone)
+    gnomad_exome_af = myvariant_anno.get("gnomad_exome", {}).get("af")
+    gnomad_genome_af = myvariant_anno.get("gnomad_genome", {}).get("af")
+
+    if gnomad_exome_af is not None and gnomad_exome_af > GNOMAD_PATHOGENICITY_THRESHOLD_AF:
+        evidence.append(f"gnomAD Exome 頻率 ({gnomad_exome_af:.4f}) 高於致病閾值 ({GNOMAD_PATHOGENICITY_THRESHOLD_AF:.4f})。")
+        if gnomad_exome_af > 0.05: # 簡化 BA1 (>5% in controls)
+            pathogenicity = "Benign (良性)"
+            evidence.append(f"gnomAD Exome 頻率 ({gnomad_exome_af:.4f}) 非常高，高度提示良性。")
+    elif gnomad_genome_af is not None and gnomad_genome_af > GNOMAD_PATHOGENICITY_THRESHOLD_AF:
+        evidence.append(f"gnomAD Genome 頻率 ({gnomad_genome_af:.4f}) 高於致病閾值 ({GNOMAD_PATHOGENICITY_THRESHOLD_AF:.4f})。")
+        if gnomad_genome_af > 0.05:
+            pathogenicity = "Benign (良性)"
+            evidence.append(f"gnomAD Genome 頻率 ({gnomad_genome_af:.4f}) 非常高，高度提示良性。")
+    else: # 頻率非常低 (PM2_Moderate)
+        if pathogenicity == "VUS (意義不明變異)": # 只有當 ClinVar 沒有明確指示時才考慮
+            evidence.append(f"gnomAD Exome 頻率 ({gnomad_exome_af if gnomad_exome_af is not None else 'N/A'}) 和 Genome 頻率 ({gnomad_genome_af if gnomad_genome_af is not None else 'N/A'}) 低，支持致病性。")
+
+    # 3. 檢查變異類型和基因面板 (PVS1_Strong / PM1_Moderate)
+    # 這裡假設變異是單一基因的，MyVariant.info 的 ensembl.gene 應提供。
+    gene_symbol = None
+    if "ensembl" in myvariant_anno and myvariant_anno["ensembl"] and "gene" in myvariant_anno["ensembl"]:
+        gene_info = myvariant_anno["ensembl"]["gene"]
+        # 修正: ensembl.gene 可能是一個 dict (單個基因) 或 list (多個基因)
+        if isinstance(gene_info, list) and gene_info:
+            gene_symbol = gene_info[0].get("symbol") # 取第一個基因
+        elif isinstance(gene_info, dict):
+             gene_symbol = gene_info.get("symbol")
+
+    if gene_symbol and gene_symbol.upper() in [g.upper() for g in gene_panel]:
+        evidence.append(f"變異位於肺腺癌相關基因面板中的 '{gene_symbol}' 基因。")
+        variant_doc["relevant_to_lung_adenocarcinoma"] = True
+        
+        # 檢查是否為截斷性變異 (nonsense, frameshift, splice site) - 模擬 PVS1
+        dbnsfp_data = myvariant_anno.get("dbnsfp", {})
+        if dbnsfp_data and isinstance(dbnsfp_data, list) and dbnsfp_data:
+            # dbnsfp 可能為列表，因為一個變異可能有多個轉錄本影響
+            consequences = []
+            for item in dbnsfp_data:
+                if "interpro_domain" in item and item["interpro_domain"] and isinstance(item["interpro_domain"], list):
+                     for domain in item["interpro_domain"]:
+                        if "description" in domain:
+                            evidence.append(f"變異影響功能性蛋白質結構域: {domain['description']}。") # PM1_Moderate
+                # 從 dbnsfp 獲取變異影響類型，通常在 `genecode` 或 `variant_effect` 等字段
+                # MyVariant.info 的 dbnsfp 字段結構可能因版本而異，這裡嘗試獲取 'consequence'
+                if "genecode" in item and item["genecode"]: 
+                    if isinstance(item["genecode"], list):
+                        for genecode_entry in item["genecode"]:
+                            if "consequence" in genecode_entry:
+                                consequences.append(genecode_entry["consequence"])
+                    elif isinstance(item["genecode"], dict): # 單個 genecode entry
+                        if "consequence" in item["genecode"]:
+                            consequences.append(item["genecode"]["consequence"])
+            
+            # 簡化判斷截斷性變異
+            is_truncating = False
+            for cons in consequences:
+                if any(c in cons.lower() for c in ["stop_gained", "frameshift_variant", "splice_acceptor_variant", "splice_donor_variant"]):
+                    is_truncating = True
+                    break
+            
+            if is_truncating:
+                evidence.append("變異為截斷性變異 (無義突變/移碼突變/剪接位點變異)，強烈支持致病性。")
+                if pathogenicity not in ["Pathogenic (致病性)", "Likely Pathogenic (可能致病性)"]:
+                    pathogenicity = "Likely Pathogenic (可能致病性)" # 提升致病性評級
+        
+    else:
+        variant_doc["relevant_to_lung_adenocarcinoma"] = False
+        if gene_symbol:
+            evidence.append(f"變異位於 '{gene_symbol}' 基因，但此基因不在肺腺癌相關基因面板中。")
+        else:
+            evidence.append("無法識別變異所在的基因符號。")
+
+    # 4. 計算證據分數或提升評級 (這裡簡化為基於關鍵證據提升)
+    # 如果 ClinVar 已經是 Pathogenic/Likely Pathogenic，則優先採用。
+    # 否則，綜合其他證據。
+
+    # 如果是 VUS，且有低頻率和截斷性/功能影響，可以考慮提升為 Likely Pathogenic
+    if pathogenicity == "VUS (意義不明變異)" and \
+       any("低頻率" in s for s in evidence) and \
+       any("截斷性變異" in s for s in evidence) and \
+       variant_doc.get("relevant_to_lung_adenocarcinoma", False): # 確保基因與疾病相關
+        pathogenicity = "Likely Pathogenic (可能致病性)"
+        evidence.append("綜合低頻率和截斷性變異等證據，評級提升至可能致病性。")
+        
+    # 5. 添加 HPO 術語的連結 (概念性佐證)
+    # 這裡不直接用 HPO 術語篩選變異，而是強調疾病上下文
+    evidence.append(f"此分析以肺腺癌 ({', '.join(hpo_terms)}) 為主要疾病上下文進行。")
+
+    # 6. 整合預測工具分數 (PP3_Supporting)
+    if "dbnsfp" in myvariant_anno and myvariant_anno["dbnsfp"] and isinstance(myvariant_anno["dbnsfp"], list):
+        for item in myvariant_anno["dbnsfp"]:
+            sift_score = item.get("sift", {}).get("score")
+            polyphen_score = item.get("polyphen", {}).get("score")
+            
+            if sift_score is not None and sift_score < 0.05: # SIFT 越低越有害 (通常是 < 0.05)
+                evidence.append(f"SIFT 預測有害 (分數: {sift_score:.2f})。")
+            if polyphen_score is not None and polyphen_score > 0.9: # PolyPhen-2 越高越有害 (通常是 > 0.9)
+                evidence.append(f"PolyPhen-2 預測可能有害 (分數: {polyphen_score:.2f})。")
+            # 可以添加更多預測工具的判斷
+
+    return pathogenicity, evidence
+
+# --- 向量化致病性評估 (規則表) ---
+PATHOGENICITY_LABELS = ("VUS (意義不明變異)", "Pathogenic (致病性)", "Likely Pathogenic (可能致病性)", "Benign (良性)")
+LABEL_VUS, LABEL_PATHOGENIC, LABEL_LIKELY_PATHOGENIC, LABEL_BENIGN = range(len(PATHOGENICITY_LABELS))
+
+# ClinVar 臨床意義代碼，依 assess_pathogenicity 的子字串判斷順序 ("likely pathogenic" 歸為 pathogenic，"likely benign" 歸為 benign)
+CLINVAR_NONE, CLINVAR_PATHOGENIC, CLINVAR_BENIGN, CLINVAR_UNCERTAIN = range(4)
+
+TRUNCATING_CONSEQUENCES = ("stop_gained", "frameshift_variant", "splice_acceptor_variant", "splice_donor_variant")
+TRUNCATING_CONSEQUENCE_PATTERN = re.compile("|".join(TRUNCATING_CONSEQUENCES), re.IGNORECASE)
+BENIGN_STANDALONE_AF = 0.05 # 簡化 BA1 (>5% in controls)
+SIFT_DELETERIOUS_SCORE = 0.05 # SIFT 低於此值預測有害
+POLYPHEN_DAMAGING_SCORE = 0.9 # PolyPhen-2 高於此值預測可能有害
+
+# 規則表: (證據代碼, 條件遮罩 (欄位陣列, 目前評級), 命中時改成的評級)，依序套用，順序與 assess_pathogenicity 的判斷順序相同。
+# 證據代碼為 None 的規則只調整評級。assess_pathogenicity 第 4 步 (VUS + 低頻率 + 截斷性 → 可能致病性) 不會命中:
+# 面板基因中的截斷性變異已由 PVS1 規則升級，不會停留在 VUS，因此不列入規則表。
+PATHOGENICITY_RULES = [
+    ("CLINVAR_PATHOGENIC", lambda c, label: c["clinvar"] == CLINVAR_PATHOGENIC, LABEL_PATHOGENIC),
+    ("CLINVAR_BENIGN", lambda c, label: c["clinvar"] == CLINVAR_BENIGN, LABEL_BENIGN),
+    ("CLINVAR_UNCERTAIN", lambda c, label: c["clinvar"] == CLINVAR_UNCERTAIN, None),
+    ("AF_EXOME_ABOVE_THRESHOLD", lambda c, label: c["exome_above"], None),
+    ("BA1_EXOME", lambda c, label: c["exome_above"] & (c["exome_af"] > BENIGN_STANDALONE_AF), LABEL_BENIGN),
+    ("AF_GENOME_ABOVE_THRESHOLD", lambda c, label: c["genome_above"], None),
+    ("BA1_GENOME", lambda c, label: c["genome_above"] & (c["genome_af"] > BENIGN_STANDALONE_AF), LABEL_BENIGN),
+    ("PM2_LOW_AF", lambda c, label: ~c["exome_above"] & ~c["genome_above"] & (label == LABEL_VUS), None),
+    ("PANEL_GENE", lambda c, label: c["in_panel"], None),
+    ("PM1_PROTEIN_DOMAIN", lambda c, label: c["in_panel"] & (c["domain_count"] > 0), None),
+    ("PVS1_TRUNCATING", lambda c, label: c["in_panel"] & c["truncating"], None),
+    (None, lambda c, label: c["in_panel"] & c["truncating"] & (label != LABEL_PATHOGENIC) & (label != LABEL_LIKELY_PATHOGENIC),
+     LABEL_LIKELY_PATHOGENIC),
+    ("OFF_PANEL_GENE", lambda c, label: c["has_gene"] & ~c["in_panel"], None),
+    ("NO_GENE_SYMBOL", lambda c, label: ~c["has_gene"], None),
+    ("DISEASE_CONTEXT", lambda c, label: np.ones(len(label), dtype=bool), None),
+    ("PP3_PREDICTORS", lambda c, label: (c["sift_min"] < SIFT_DELETERIOUS_SCORE) | (c["polyphen_max"] > POLYPHEN_DAMAGING_SCORE), None),
+]
+
+def pathogenicity_ruleset_version(gene_panel, hpo_terms, af_threshold=None, classifier="vectorized", evidence_text="all"):
+    """
+    回傳目前規則與參數的版本字串 "<PATHOGENICITY_RULESET_NAME>+<10 碼雜湊>"。
+    classifier 與 evidence_text 也納入雜湊，因為兩者決定文件記錄的證據欄位。
+    """
+    params = {
+        "classifier": classifier,
+        "evidence_text": evidence_text,
+        "rules": [(code, new_label) for code, _, new_label in PATHOGENICITY_RULES],
+        "labels": PATHOGENICITY_LABELS,
+        "af_threshold": GNOMAD_PATHOGENICITY_THRESHOLD_AF if af_threshold is None else af_threshold,
+        "benign_standalone_af": BENIGN_STANDALONE_AF,
+        "sift": SIFT_DELETERIOUS_SCORE,
+        "polyphen": POLYPHEN_DAMAGING_SCORE,
+        "truncating": TRUNCATING_CONSEQUENCES,
+        "gene_panel": sorted({symbol.upper() for symbol in gene_panel}),
+        "hpo_terms": list(hpo_terms),
+    }
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+    return f"{PATHOGENICITY_RULESET_NAME}+{digest}"
+
+def _as_number(value):
+    """
+    數值原樣回傳，其他型別 (None、dict、list、字串) 回傳 None。
+    """
+    return value if type(value) in (int, float) else None
+
+def _clinvar_significance(myvariant_anno):
+    """
+    取出 ClinVar 第一個 RCV 的臨床意義 (小寫)；沒有時回傳空字串。
+    """
+    clinvar_data = myvariant_anno.get("clinvar") or {}
+    rcv = clinvar_data.get("rcv") if isinstance(clinvar_data, dict) else None
+    if isinstance(rcv, list) and rcv:
+        rcv = rcv[0]
+    if isinstance(rcv, dict):
+        return (rcv.get("clinical_significance") or "").lower()
+    return ""
+
+class ClassifiedChunk:
+    """
+    ChunkPathogenicityClassifier.classify() 的結果。
+    labels / relevant / evidence_codes 為每個變異的評級代碼、面板相關性與證據代碼；
+    hits 為每個證據代碼命中的變異索引 (NumPy 陣列)，details 保留產生證據文字所需的原始值欄位。
+    """
+    def __init__(self, labels, relevant, evidence_codes, hits, details):
+        self.labels = labels
+        self.relevant = relevant
+        self.evidence_codes = evidence_codes
+        self.hits = hits
+        self.details = details
+
+    def __len__(self):
+        return len(self.labels)
+
+class ChunkPathogenicityClassifier:
+    """
+    以規則表批次評估整個 chunk 的致病性，結果 (評級、證據文字與順序、面板相關性) 與逐筆呼叫 assess_pathogenicity 相同。
+    flatten() 先將巢狀的 MyVariant.info 回應攤平成欄位陣列，再依序以 NumPy 遮罩套用 PATHOGENICITY_RULES；
+    判斷只依據結構化的證據代碼，不再比對證據文字。證據文字由 render_evidence() 依代碼另外產生；
+    evidence_text 為 "reported" (預設依 PATHOGENICITY_EVIDENCE_TEXT) 時只為報告會列出的評級產生。
+    """
+    def __init__(self, gene_panel, hpo_terms, af_threshold=None, evidence_text=None):
+        self.hpo_terms = list(hpo_terms)
+        self.af_threshold = GNOMAD_PATHOGENICITY_THRESHOLD_AF if af_threshold is None else af_threshold
+        self.evidence_text = evidence_text or PATHOGENICITY_EVIDENCE_TEXT
+        if self.evidence_text not in ("all", "reported"):
+            raise ValueError(f"不支援的證據文字範圍: {self.evidence_text}")
+        self.ruleset_version = pathogenicity_ruleset_version(gene_panel, self.hpo_terms, self.af_threshold,
+                                                             evidence_text=self.evidence_text)
+        # 基因符號 ID: 面板基因固定為 0..panel_size-1；其他基因在每次 flatten() 中依出現順序編號，
+        # 不共用可變狀態，因此多個評估執行緒可共用同一個分類器
+        self.panel_gene_ids = {}
+        for symbol in gene_panel:
+            self.panel_gene_ids.setdefault(symbol.upper(), len(self.panel_gene_ids))
+        self.panel_size = len(self.panel_gene_ids)
+        # 不含變異相關數值的證據文字只組合一次
+        self.static_evidence = {
+            "PVS1_TRUNCATING": "變異為截斷性變異 (無義突變/移碼突變/剪接位點變異)，強烈支持致病性。",
+            "NO_GENE_SYMBOL": "無法識別變異所在的基因符號。",
+            "DISEASE_CONTEXT": f"此分析以肺腺癌 ({', '.join(self.hpo_terms)}) 為主要疾病上下文進行。",
+        }
+
+    def flatten(self, annotations):
+        """
+        將註釋列表攤平成欄位陣列，回傳 (欄位 dict, 產生證據文字用的原始值欄位 dict)。
+        巢狀 JSON 只走訪一次並先收集成 Python 列表，最後一次轉成 NumPy 陣列。
+        """
+        clinvar, gene_id = [], []
+        truncating, domain_count, sift_min, polyphen_max = [], [], [], []
+        clin_sigs, exome_values, genome_values, gene_symbols, domain_lists, predictor_lists = [], [], [], [], [], []
+        gene_ids = dict(self.panel_gene_ids)
+        clinvar_codes = {} # 同一 chunk 中的臨床意義字串重複很多，只判斷一次
+        nan = float("nan")
+
+        for anno in annotations:
+            clin_sig = _clinvar_significance(anno)
+            clinvar_code = clinvar_codes.get(clin_sig)
+            if clinvar_code is None:
+                if "pathogenic" in clin_sig:
+                    clinvar_code = CLINVAR_PATHOGENIC
+                elif "benign" in clin_sig:
+                    clinvar_code = CLINVAR_BENIGN
+                elif "uncertain significance" in clin_sig:
+                    clinvar_code = CLINVAR_UNCERTAIN
+                else:
+                    clinvar_code = CLINVAR_NONE
+                clinvar_codes[clin_sig] = clinvar_code
+            clinvar.append(clinvar_code)
+            clin_sigs.append(clin_sig)
+
+            exome_values.append(_as_number((anno.get("gnomad_exome") or {}).get("af")))
+            genome_values.append(_as_number((anno.get("gnomad_genome") or {}).get("af")))
+
+            gene_symbol = myvariant_gene_symbol(anno)
+            symbol_id = gene_ids.setdefault(gene_symbol.upper(), len(gene_ids)) if gene_symbol else -1
+            gene_id.append(symbol_id)
+            gene_symbols.append(gene_symbol)
+            in_panel = 0 <= symbol_id < self.panel_size # 結構域與截斷性只影響面板基因，其他基因不必走訪
+
+            is_truncating = False
+            domains = ()
+            predictors = ()
+            sift_low = polyphen_high = nan
+            dbnsfp_data = anno.get("dbnsfp")
+            if dbnsfp_data and isinstance(dbnsfp_data, list):
+                domains = []
+                predictors = []
+                for item in dbnsfp_data:
+                    if in_panel:
+                        interpro = item.get("interpro_domain")
+                        if interpro and isinstance(interpro, list):
+                            domains.extend(domain["description"] for domain in interpro if "description" in domain)
+                        genecode = item.get("genecode")
+                        if genecode and not is_truncating:
+                            for entry in (genecode if isinstance(genecode, list) else [genecode]):
+                                consequence = entry.get("consequence")
+                                if consequence and TRUNCATING_CONSEQUENCE_PATTERN.search(consequence):
+                                    is_truncating = True
+                                    break
+                    sift = item.get("sift")
+                    polyphen = item.get("polyphen")
+                    if sift or polyphen:
+                        sift = _as_number(sift.get("score")) if sift else None
+                        polyphen = _as_number(polyphen.get("score")) if polyphen else None
+                        if sift is not None and not sift >= sift_low:
+                            sift_low = sift
+                        if polyphen is not None and not polyphen <= polyphen_high:
+                            polyphen_high = polyphen
+                        predictors.append((sift, polyphen))
+            truncating.append(is_truncating)
+            domain_count.append(len(domains))
+            domain_lists.append(domains)
+            sift_min.append(sift_low)
+            polyphen_max.append(polyphen_high)
+            predictor_lists.append(predictors)
+
+        gene_id = np.array(gene_id, dtype=np.int32)
+        exome_af = np.array(exome_values, dtype=float) # None 轉為 NaN
+        genome_af = np.array(genome_values, dtype=float)
+        exome_above = exome_af > self.af_threshold
+        columns = {
+            "clinvar": np.array(clinvar, dtype=np.int8),
+            "exome_af": exome_af,
+            "genome_af": genome_af,
+            "exome_above": exome_above,
+            "genome_above": ~exome_above & (genome_af > self.af_threshold), # 與 assess_pathogenicity 相同，只在 exome 未超過時檢查
+            "gene_id": gene_id,
+            "has_gene": gene_id >= 0,
+            "in_panel": (gene_id >= 0) & (gene_id < self.panel_size),
+            "truncating": np.array(truncating, dtype=bool),
+            "domain_count": np.array(domain_count, dtype=np.int32),
+            "sift_min": np.array(sift_min, dtype=float),
+            "polyphen_max": np.array(polyphen_max, dtype=float),
+        }
+        details = {
+            "clin_sig": clin_sigs,
+            "exome_af": exome_values,
+            "genome_af": genome_values,
+            "gene_symbol": gene_symbols,
+            "domains": domain_lists,
+            "predictors": predictor_lists,
+        }
+        return columns, details
+
+    def classify(self, annotations):
+        """
+        評估一個 chunk 的註釋，回傳 ClassifiedChunk。
+        """
+        columns, details = self.flatten(annotations)
+        labels = np.full(len(annotations), LABEL_VUS, dtype=np.int8)
+        evidence_codes = [[] for _ in annotations]
+        hits = []
+        for code, condition, new_label in PATHOGENICITY_RULES:
+            mask = condition(columns, labels)
+            if new_label is not None:
+                labels = np.where(mask, new_label, labels).astype(np.int8)
+            if code is not None:
+                indices = np.flatnonzero(mask)
+                hits.append((code, indices))
+                for i in indices.tolist():
+                    evidence_codes[i].append(code)
+        return ClassifiedChunk(labels.tolist(), columns["in_panel"].tolist(), evidence_codes, hits, details)
+
+    def render_evidence(self, result, selected=None):
+        """
+        依證據代碼產生與 assess_pathogenicity 相同的證據文字，回傳每個變異的文字列表。
+        依規則順序逐一處理每個代碼命中的變異，因此每個變異的文字順序與 assess_pathogenicity 相同。
+        selected 為布林遮罩時只產生被選取變異的文字，其他變異回傳空列表。
+        """
+        evidence = [[] for _ in range(len(result))]
+        details = result.details
+        threshold = f"{self.af_threshold:.4f}"
+        for code, indices in result.hits:
+            indices = (indices if selected is None else indices[selected[indices]]).tolist()
+            static_text = self.static_evidence.get(code)
+            if static_text is not None:
+                for i in indices:
+                    evidence[i].append(static_text)
+            elif code.startswith("CLINVAR_"):
+                for i in indices:
+                    evidence[i].append(f"ClinVar 報告為 '{details['clin_sig'][i]}'。")
+            elif code == "AF_EXOME_ABOVE_THRESHOLD":
+                for i in indices:
+                    evidence[i].append(f"gnomAD Exome 頻率 ({details['exome_af'][i]:.4f}) 高於致病閾值 ({threshold})。")
+            elif code == "BA1_EXOME":
+                for i in indices:
+                    evidence[i].append(f"gnomAD Exome 頻率 ({details['exome_af'][i]:.4f}) 非常高，高度提示良性。")
+            elif code == "AF_GENOME_ABOVE_THRESHOLD":
+                for i in indices:
+                    evidence[i].append(f"gnomAD Genome 頻率 ({details['genome_af'][i]:.4f}) 高於致病閾值 ({threshold})。")
+            elif code == "BA1_GENOME":
+                for i in indices:
+                    evidence[i].append(f"gnomAD Genome 頻率 ({details['genome_af'][i]:.4f}) 非常高，高度提示良性。")
+            elif code == "PM2_LOW_AF":
+                for i in indices:
+                    exome, genome = details["exome_af"][i], details["genome_af"][i]
+                    evidence[i].append(f"gnomAD Exome 頻率 ({exome if exome is not None else 'N/A'}) 和 Genome 頻率 "
+                                       f"({genome if genome is not None else 'N/A'}) 低，支持致病性。")
+            elif code == "PANEL_GENE":
+                for i in indices:
+                    evidence[i].append(f"變異位於肺腺癌相關基因面板中的 '{details['gene_symbol'][i]}' 基因。")
+            elif code == "PM1_PROTEIN_DOMAIN":
+                for i in indices:
+                    evidence[i].extend(f"變異影響功能性蛋白質結構域: {description}。" for description in details["domains"][i])
+            elif code == "OFF_PANEL_GENE":
+                for i in indices:
+                    evidence[i].append(f"變異位於 '{details['gene_symbol'][i]}' 基因，但此基因不在肺腺癌相關基因面板中。")
+            elif code == "PP3_PREDICTORS":
+                for i in indices:
+                    for sift, polyphen in details["predictors"][i]:
+                        if sift is not None and sift < SIFT_DELETERIOUS_SCORE:
+                            evidence[i].append(f"SIFT 預測有害 (分數: {sift:.2f})。")
+                        if polyphen is not None and polyphen > POLYPHEN_DAMAGING_SCORE:
+                            evidence[i].append(f"PolyPhen-2 預測可能有害 (分數: {polyphen:.2f})。")
+        return evidence
+
+    def assess_docs(self, variant_docs):
+        """
+        評估已附上 annotation_myvariant_info 的變異文件，寫入與 assess_pathogenicity 相同的欄位以及證據代碼。
+        evidence_text 為 "reported" 時，報告不會列出的文件不含 pathogenicity_evidence (只有證據代碼)。
+        """
+        result = self.classify([d.get("annotation_myvariant_info", {}) for d in variant_docs])
+        selected = None
+        if self.evidence_text == "reported":
+            reported_labels = [i for i, label in enumerate(PATHOGENICITY_LABELS) if label in REPORT_CLASSIFICATIONS]
+            selected = np.isin(np.array(result.labels, dtype=np.int8), reported_labels)
+        rows = zip(variant_docs, result.labels, result.relevant, result.evidence_codes,
+                   self.render_evidence(result, selected))
+        for i, (variant_doc, label, relevant, evidence_codes, evidence) in enumerate(rows):
+            variant_doc["relevant_to_lung_adenocarcinoma"] = relevant
+            variant_doc["pathogenicity_assessment"] = PATHOGENICITY_LABELS[label]
+            if selected is None or selected[i]:
+                variant_doc["pathogenicity_evidence"] = evidence
+            else:
+                variant_doc.pop("pathogenicity_evidence", None)
+            variant_doc["pathogenicity_evidence_codes"] = evidence_codes
+            variant_doc["pathogenicity_ruleset"] = self.ruleset_version
+        return result
+
+# --- 模擬 MedGemma 報告生成函數 ---
+REPORT_CLASSIFICATIONS = ("Pathogenic (致病性)", "Likely Pathogenic (可能致病性)")
+REPORT_NO_VARIANTS_HTML = "<p>No significant pathogenic or likely pathogenic variants were identified for report generation based on the provided data and HPO terms in this simulation.</p>"
+REPORT_DISCLAIMER_HTML = "<p>This report is generated for demonstration purposes using simulated data and a conceptual MedGemma model via the Python backend. It is not a substitute for professional medical advice, diagnosis, or treatment. All interpretations and clinical decisions should be made by qualified healthcare providers.</p>"
+
+def report_header_html(vcf_file_name, hpo_terms_list):
+    # 檔名與 HPO terms 可能來自上傳者，一律跳脫後再放入 HTML
+    hpo_terms_text = html.escape(', '.join(hpo_terms_list))
+    report_parts = []
+    report_parts.append("<h3>Patient Gene Report (Simulated by MedGemma via Python Backend)</h3>")
+    report_parts.append(f"<p><strong>Date:</strong> {datetime.now().strftime('%Y-%m-%d')}</p>")
+    report_parts.append(f"<p><strong>Patient VCF:</strong> {html.escape(str(vcf_file_name))}</p>")
+    report_parts.append(f"<p><strong>Associated HPO Terms:</strong> {hpo_terms_text}</p>")
+    report_parts.append("<hr>")
+    report_parts.append("<h4>Summary of Findings:</h4>")
+    report_parts.append(
+        f"<p>Analysis of the provided VCF file in the context of HPO terms: {hpo_terms_text}, "
+        "has identified the following clinically significant variants. These findings should be "
+        "correlated with clinical presentation and other diagnostic information by a qualified "
+        "healthcare professional.</p>"
+    )
+    report_parts.append("<h4>Variant Details:</h4>")
+    return report_parts
+
+def report_variant_html(number, variant_doc):
+    """
+    單一變異的報告段落 (HTML 行列表)；number 為報告中的序號。
+    VCF 欄位、註釋與證據文字都來自輸入資料，一律以 html.escape 跳脫。
+    """
+    # slim 文件與聚合結果只有 gene_symbol 欄位；較舊的完整文件則從原始註釋取得
+    gene_symbol = html.escape(str(variant_doc.get("gene_symbol")
+                                  or myvariant_gene_symbol(variant_doc.get("annotation_myvariant_info", {}))
+                                  or "N/A"))
+    classification = html.escape(str(variant_doc.get('pathogenicity_assessment', 'N/A')))
+    evidence_html = "<ul>" + "".join(f"<li>{html.escape(str(ev))}</li>" for ev in variant_doc.get('pathogenicity_evidence', [])) + "</ul>"
+    location = html.escape(f"{variant_doc['chrom']}:{variant_doc['pos']} {variant_doc['ref']}>{variant_doc['alt']}")
+    return [
+        f"<p><strong>Variant {number}: {gene_symbol} ({location})</strong></p>",
+        "<ul>",
+        f"    <li><strong>Classification:</strong> {classification}</li>",
+        f"    <li><strong>Annotation & Evidence:</strong> {evidence_html}</li>",
+        # Simulated MedGemma insights
+        f"    <li><strong>Potential Implications (Simulated):</strong> Based on the {gene_symbol} gene's role and the nature of this variant, it is considered {classification.lower()}. This variant may contribute to the patient's phenotype or predisposition to conditions associated with the selected HPO terms. For example, alterations in {gene_symbol} are known to be involved in [simulated disease area, e.g., cancer development, metabolic disorders].</li>",
+        f"    <li><strong>Recommendations (Conceptual):</strong> Consider confirmatory testing if not already performed. Genetic counseling is recommended. Specific therapeutic options targeting pathways involving {gene_symbol} may be relevant (e.g., [simulated therapy type]).</li>",
+        "</ul>",
+    ]
+
+def generate_report_with_medgemma(variants, vcf_file_name, hpo_terms_list):
+    """
+    模擬使用類似 MedGemma 的服務生成基因報告。
+    接收已篩選的變異列表，回傳完整報告字串；大量變異請使用 write_variant_report 串流寫入檔案。
+    """
+    report_parts = report_header_html(vcf_file_name, hpo_terms_list)
+    if not variants:
+        report_parts.append(REPORT_NO_VARIANTS_HTML)
+    else:
+        for i, variant_doc in enumerate(variants):
+            report_parts.extend(report_variant_html(i + 1, variant_doc))
+
+    report_parts.append("<hr>")
+    report_parts.append("<h4>Disclaimer:</h4>")
+    report_parts.append(REPORT_DISCLAIMER_HTML)
+    
+    return "\\n".join(report_parts)
+
+# --- 串流報告 ---
+REPORT_SORT_KEYS = {
+    "gene": [("gene_symbol", 1), ("chrom_order", 1), ("chrom", 1), ("pos", 1)],
+    "position": [("chrom_order", 1), ("chrom", 1), ("pos", 1)],
+    "classification": [("pathogenicity_assessment", -1), ("gene_symbol", 1), ("chrom_order", 1), ("chrom", 1), ("pos", 1)],
+}
+# 染色體排序鍵 (1-22、X、Y、M；"7" 與 "chr7" 相同，其他 contig 排在最後)。
+# 以運算式計算而不使用 numericOrdering collation，$match 才能使用預設 (simple) collation 的 pathogenicity_assessment 索引
+REPORT_CHROM_ORDER = {"$switch": {
+    "branches": [
+        {"case": {"$in": ["$chrom", [name, f"chr{name}"] + (["MT", "chrMT"] if name == "M" else [])]}, "then": order}
+        for order, name in enumerate([str(n) for n in range(1, 23)] + ["X", "Y", "M"], start=1)
+    ],
+    "default": 99,
+}}
+
+def report_aggregation_pipeline(classifications=REPORT_CLASSIFICATIONS, sort_by="gene", skip=0, limit=None, match=None):
+    """
+    報告查詢的聚合管線: 依分類與額外條件 match 篩選 (使用 pathogenicity_assessment 索引)、只投影報告欄位，
+    並在伺服器端計算 gene_symbol (slim 文件的欄位，否則取 ensembl.gene 的第一個 symbol，可能為物件或陣列)，
+    再排序與分頁。原始註釋不會離開資料庫。
+    """
+    if sort_by not in REPORT_SORT_KEYS:
+        raise ValueError(f"不支援的報告排序方式: {sort_by}")
+    ensembl_gene = "$annotation_myvariant_info.ensembl.gene"
+    annotated_symbol = {"$cond": [{"$isArray": ensembl_gene},
+                                  {"$arrayElemAt": [f"{ensembl_gene}.symbol", 0]},
+                                  f"{ensembl_gene}.symbol"]}
+    pipeline = [
+        {"$match": dict(match or {}, pathogenicity_assessment={"$in": list(classifications)})},
+        {"$project": {
+            "_id": 0, "chrom": 1, "pos": 1, "id": 1, "ref": 1, "alt": 1,
+            "pathogenicity_assessment": 1, "pathogenicity_evidence": 1,
+            "gene_symbol": {"$ifNull": ["$gene_symbol", {"$ifNull": [annotated_symbol, "N/A"]}]},
+            "chrom_order": REPORT_CHROM_ORDER,
+        }},
+        {"$sort": dict(REPORT_SORT_KEYS[sort_by])},
+    ]
+    if skip:
+        pipeline.append({"$skip": skip})
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$project": {"chrom_order": 0}})
+    return pipeline
+
+
+class HtmlReportWriter:
+    """
+    逐筆寫入 HTML 報告 (與 generate_report_with_medgemma 相同的段落格式)，不在記憶體中累積內容。
+    group_by_gene 為 True 時每個基因的變異放在各自的 <section class="gene-group" id="gene-...">，以基因標題開頭。
+    """
+    def __init__(self, stream, vcf_file_name, hpo_terms_list, group_by_gene=False):
+        self.stream = stream
+        self.vcf_file_name = vcf_file_name
+        self.hpo_terms_list = hpo_terms_list
+        self.group_by_gene = group_by_gene
+
+    def _write_lines(self, lines):
+        self.stream.write("\n".join(lines) + "\n")
+
+    def start(self, page_info=None):
+        self._write_lines(report_header_html(self.vcf_file_name, self.hpo_terms_list))
+        if page_info:
+            self._write_lines([f"<p><em>{html.escape(page_info)}</em></p>"])
+        if self.group_by_gene:
+            self._write_lines(["<p><em>Variants are grouped by gene.</em></p>"])
+
+    def start_group(self, gene_symbol):
+        gene_symbol = html.escape(str(gene_symbol))
+        self._write_lines([f'<section class="gene-group" id="gene-{gene_symbol}">', f"<h4>{gene_symbol}</h4>"])
+
+    def end_group(self):
+        self._write_lines(["</section>"])
+
+    def variant(self, number, variant_doc):
+        self._write_lines(report_variant_html(number, variant_doc))
+
+    def finish(self, count):
+        lines = [REPORT_NO_VARIANTS_HTML] if not count else []
+        self._write_lines(lines + ["<hr>", "<h4>Disclaimer:</h4>", REPORT_DISCLAIMER_HTML])
+
+
+class JsonReportWriter:
+    """
+    逐筆寫入 JSON 報告: {"vcf", "hpo_terms", "generated", "variants" 或 "genes": [{"gene_symbol", "variants"}], "count"}。
+    """
+    def __init__(self, stream, vcf_file_name, hpo_terms_list, group_by_gene=False):
+        self.stream = stream
+        self.vcf_file_name = vcf_file_name
+        self.hpo_terms_list = hpo_terms_list
+        self.group_by_gene = group_by_gene
+        self.first_item = True
+
+    def _separator(self):
+        if not self.first_item:
+            self.stream.write(",")
+        self.first_item = False
+
+    def start(self, page_info=None):
+        header = {"vcf": self.vcf_file_name, "hpo_terms": list(self.hpo_terms_list),
+                  "generated": datetime.now().isoformat(timespec="seconds")}
+        if page_info:
+            header["page"] = page_info
+        items_key = "genes" if self.group_by_gene else "variants"
+        self.stream.write(json.dumps(header, ensure_ascii=False)[:-1] + f', "{items_key}": [')
+
+    def start_group(self, gene_symbol):
+        self._separator()
+        self.stream.write(json.dumps({"gene_symbol": gene_symbol}, ensure_ascii=False)[:-1] + ', "variants": [')
+        self.first_item = True
+
+    def end_group(self):
+        self.stream.write("]}")
+        self.first_item = False
+
+    def variant(self, number, variant_doc):
+        self._separator()
+        self.stream.write(json.dumps(dict(variant_doc, number=number), ensure_ascii=False, default=str))
+
+    def finish(self, count):
+        self.stream.write(f'], "count": {count}}}\n')
+
+
+REPORT_WRITERS = {"html": HtmlReportWriter, "json": JsonReportWriter}
+
+def write_variant_report(collection, output, vcf_file_name, hpo_terms_list, report_format=None, sort_by=None,
+                         group_by_gene=None, page=None, page_size=None, classifications=REPORT_CLASSIFICATIONS, match=None):
+    """
+    以聚合 cursor 串流產生致病性/可能致病性變異報告，寫入 output (檔案路徑或文字串流)，回傳輸出的變異數。
+    match 為額外的篩選條件 (例如服務模式的 {"job_id": ...})。
+    依基因分組時結果先依基因排序，分組在串流中完成，不需將同一基因的變異收集到記憶體。
+    """
+    report_format = report_format or REPORT_FORMAT
+    if report_format is None:
+        report_format = "json" if isinstance(output, str) and output.endswith(".json") else "html"
+    if report_format not in REPORT_WRITERS:
+        raise ValueError(f"不支援的報告格式: {report_format}")
+    group_by_gene = REPORT_GROUP_BY_GENE if group_by_gene is None else group_by_gene
+    sort_by = "gene" if group_by_gene else (sort_by or REPORT_SORT)
+    page = max(1, page or REPORT_PAGE)
+    page_size = page_size or REPORT_PAGE_SIZE
+    skip = (page - 1) * page_size if page_size else 0
+
+    if isinstance(output, str):
+        with open(output, "w", encoding="utf-8") as stream:
+            return write_variant_report(collection, stream, vcf_file_name, hpo_terms_list, report_format, sort_by,
+                                        group_by_gene, page, page_size, classifications, match)
+
+    pipeline = report_aggregation_pipeline(classifications, sort_by, skip, page_size, match)
+    # allowDiskUse 讓大量結果的排序不受記憶體上限影響；使用預設 collation，$match 才能使用索引
+    cursor = collection.aggregate(pipeline, allowDiskUse=True, batchSize=REPORT_CURSOR_BATCH_SIZE)
+    writer = REPORT_WRITERS[report_format](output, vcf_file_name, hpo_terms_list, group_by_gene)
+    writer.start(f"Page {page} ({page_size} variants per page)" if page_size else None)
+    count = 0
+    current_gene = None
+    for variant_doc in cursor:
+        count += 1
+        if group_by_gene and (count == 1 or variant_doc["gene_symbol"] != current_gene):
+            if count > 1:
+                writer.end_group()
+            current_gene = variant_doc["gene_symbol"]
+            writer.start_group(current_gene)
+        writer.variant(skip + count, variant_doc)
+    if group_by_gene and count:
+        writer.end_group()
+    writer.finish(count)
+    return count
+
+# --- 執行監控 ---
+class LatencyHistogram:
+    """
+    固定桶界限的延遲直方圖 (秒，與 Prometheus histogram 相同的 le 語意)。
+    quantile() 以桶上界估計分位數，足以觀察長時間執行的延遲分布。
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1) # 最後一格為 +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        running = 0
+        for bound, n in zip(self.BUCKETS + (float("inf"),), self.counts):
+            running += n
+            if running >= q * self.count:
+                return bound
+        return float("inf")
+
+    def cumulative_buckets(self):
+        """
+        回傳 [(le, 累積數量)]，包含 "+Inf"。
+        """
+        running = 0
+        buckets = []
+        for bound, n in zip(self.BUCKETS + (float("inf"),), self.counts):
+            running += n
+            buckets.append(("+Inf" if bound == float("inf") else repr(bound), running))
+        return buckets
+
+
+class WorkflowMetrics:
+    """
+    註釋工作流程的執行緒安全監控資料: 各階段延遲直方圖 (parse、api、mongo_write 與各管線階段)、
+    計數器、限速等待秒數、快取命中率，以及依 VCF 總記錄數估計的進度與剩餘時間。
+    """
+    COUNTERS = ("records_read", "records_done", "processed", "inserted", "not_found", "api_error", "api_requests", "api_retries",
+                "multiallelic_split", "skipped_multiallelic", "skipped_alleles")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, start_records=0, cache=None):
+        """
+        開始新的一次執行；start_records 為續跑時已完成的記錄數，cache 為用於計算命中率的 AnnotationCache。
+        """
+        with self.lock:
+            self.histograms = {}
+            self.counters = dict.fromkeys(self.COUNTERS, 0)
+            self.counters["records_read"] = self.counters["records_done"] = start_records
+            self.rate_limit_wait_seconds = 0.0
+            self.start_records = start_records
+            self.total_records = None
+            self.cache = cache
+            self.started_at = time.monotonic()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, amount=1):
+        if amount:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_max(self, name, value):
+        with self.lock:
+            self.counters[name] = max(self.counters.get(name, 0), value)
+
+    def add_rate_limit_wait(self, seconds):
+        if seconds > 0:
+            with self.lock:
+                self.rate_limit_wait_seconds += seconds
+
+    def time_iter(self, name, iterable):
+        """
+        包裝產生器，將每次取得下一個項目的時間記錄到 name 直方圖 (例如 VCF 解析)。
+        """
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - started)
+            yield item
+
+    def cache_hit_ratio(self):
+        cache = self.cache
+        if cache is None or not (cache.hits + cache.misses):
+            return None
+        return cache.hits / (cache.hits + cache.misses)
+
+    def progress(self):
+        """
+        回傳 (已完成寫入階段的記錄數, 總記錄數或 None, 每秒記錄數, 預估剩餘秒數或 None)。
+        """
+        with self.lock:
+            done = self.counters["records_done"]
+            total = self.total_records
+            elapsed = max(time.monotonic() - self.started_at, 1e-9)
+            if total is not None:
+                total = max(total, self.counters["records_read"]) # 估計值偏低時以已解析的記錄數為下限
+        rate = (done - self.start_records) / elapsed
+        eta = (total - done) / rate if total is not None and rate > 0 else None
+        return done, total, rate, eta
+
+    def finish_reading(self):
+        """
+        輸入已完整解析：以實際解析的記錄數取代估計的總記錄數，使進度在結束時到達 100%。
+        """
+        with self.lock:
+            self.total_records = self.counters["records_read"]
+
+    def progress_summary(self):
+        done, total, rate, eta = self.progress()
+        with self.lock:
+            counters = dict(self.counters)
+            wait = self.rate_limit_wait_seconds
+            api = self.histograms.get("api")
+            api_latency = f"，API p50/p95 {api.quantile(0.5):g}/{api.quantile(0.95):g} 秒" if api else ""
+        position = f"{done}/{total} 筆記錄 ({done / total:.1%})" if total else f"{done} 筆記錄"
+        position += f" (已解析 {counters['records_read']})"
+        eta_text = f"，預估剩餘 {time.strftime('%H:%M:%S', time.gmtime(eta))}" if eta is not None else ""
+        hit_ratio = self.cache_hit_ratio()
+        cache_text = f"，快取命中率 {hit_ratio:.1%}" if hit_ratio is not None else ""
+        return (f"進度: {position}，{rate:,.0f} 筆/秒{eta_text} | 已評估 {counters['processed']}，"
+                f"已寫入 {counters['inserted']}，not_found {counters['not_found']}，api_error {counters['api_error']}，"
+                f"限速等待 {wait:.1f} 秒{cache_text}{api_latency}")
+
+    def summary(self):
+        """
+        執行結束時的統計: 計數器與各直方圖的次數、平均與 p50/p95/p99。
+        """
+        with self.lock:
+            counters = ", ".join(f"{name}={value}" for name, value in self.counters.items())
+            lines = [f"監控統計: {counters}，限速等待 {self.rate_limit_wait_seconds:.1f} 秒"]
+            for name, histogram in sorted(self.histograms.items()):
+                if histogram.count:
+                    lines.append(f"  {name}: {histogram.count} 次，平均 {histogram.total / histogram.count:.4f} 秒，"
+                                 f"p50/p95/p99 ≤ {histogram.quantile(0.5):g}/{histogram.quantile(0.95):g}/"
+                                 f"{histogram.quantile(0.99):g} 秒")
+        hit_ratio = self.cache_hit_ratio()
+        if hit_ratio is not None:
+            lines[0] += f"，快取命中率 {hit_ratio:.1%}"
+        return "\n".join(lines)
+
+    def collect(self):
+        """
+        prometheus_client 自訂 collector 介面: 每次抓取時由目前的監控資料產生指標。
+        """
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+
+        with self.lock:
+            histograms = {name: (h.cumulative_buckets(), h.total) for name, h in self.histograms.items()}
+            counters = dict(self.counters)
+            wait = self.rate_limit_wait_seconds
+        latency = HistogramMetricFamily("geneinsight_stage_latency_seconds", "各階段延遲 (秒)", labels=["stage"])
+        for name, (buckets, total) in histograms.items():
+            latency.add_metric([name], buckets, sum_value=total)
+        yield latency
+        events = CounterMetricFamily("geneinsight_events", "工作流程計數器", labels=["kind"])
+        for name, value in counters.items():
+            events.add_metric([name], value)
+        yield events
+        yield CounterMetricFamily("geneinsight_rate_limit_wait_seconds", "token bucket 限速累計等待秒數", value=wait)
+        hit_ratio = self.cache_hit_ratio()
+        if hit_ratio is not None:
+            yield GaugeMetricFamily("geneinsight_cache_hit_ratio", "註釋快取命中率", value=hit_ratio)
+        done, total, rate, eta = self.progress()
+        yield GaugeMetricFamily("geneinsight_records_per_second", "平均每秒處理的 VCF 記錄數", value=rate)
+        if total:
+            yield GaugeMetricFamily("geneinsight_progress_ratio", "已處理的 VCF 記錄比例", value=done / total)
+        if eta is not None:
+            yield GaugeMetricFamily("geneinsight_eta_seconds", "預估剩餘秒數", value=eta)
+
+
+workflow_metrics = WorkflowMetrics()
+_metrics_server_started = False
+
+def start_metrics_server(port, addr="127.0.0.1"):
+    """
+    以 prometheus_client 在 addr:port 提供 /metrics (同一行程只啟動一次)；未安裝 prometheus_client 時只記錄警告。
+    """
+    global _metrics_server_started
+    if _metrics_server_started:
+        return True
+    if prometheus_client is None:
+        logging.warning("未安裝 prometheus_client，無法提供 /metrics 端點。")
+        return False
+    registry = prometheus_client.CollectorRegistry()
+    registry.register(workflow_metrics)
+    try:
+        prometheus_client.start_http_server(port, addr=addr, registry=registry)
+    except OSError as e:
+        logging.warning(f"無法在 {addr}:{port} 啟動 /metrics 端點: {e}")
+        return False
+    _metrics_server_started = True
+    logging.info(f"Prometheus 指標端點: http://{addr}:{port}/metrics")
+    return True
+
+def estimate_vcf_records(file_path, sample_bytes=PROGRESS_SAMPLE_BYTES):
+    """
+    估計 VCF 的資料列數，用於估計進度：只解壓標頭後約 sample_bytes 的資料計算換行數，
+    再依取樣所佔的壓縮 (或原始) 檔案大小比例推算全檔，不需要把整個檔案解壓第二次。
+    檔案在取樣範圍內讀完時回傳確切數量。
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "rb") as raw:
+        f = gzip.GzipFile(fileobj=raw) if file_path.endswith(".gz") else raw
+        line = f.readline()
+        while line.startswith(b"#"):
+            line = f.readline()
+        data_start = raw.tell()
+        count = 1 if line.strip() else 0
+        sampled = 0
+        while sampled < sample_bytes:
+            block = f.read(1 << 20)
+            if not block:
+                return count
+            count += block.count(b"\n")
+            sampled += len(block)
+        consumed = raw.tell() - data_start
+    return round(count * (file_size - data_start) / consumed) if consumed > 0 else count
+
+def start_record_count(file_paths):
+    """
+    在背景執行緒估計 file_paths 的總記錄數並寫入 workflow_metrics.total_records，不延遲工作流程的啟動。
+    """
+    def run():
+        try:
+            total = sum(estimate_vcf_records(path) for path in file_paths)
+        except (OSError, EOFError, zlib.error) as e:
+            logging.warning(f"無法計算 VCF 記錄數，將不顯示預估剩餘時間: {e}")
+            return
+        with workflow_metrics.lock:
+            if workflow_metrics.total_records is None: # 解析已結束時保留確切數量
+                workflow_metrics.total_records = total
+        logging.info(f"輸入約 {total} 筆 VCF 記錄。")
+    threading.Thread(target=run, name="record-counter", daemon=True).start()
+
+# --- 管線化執行框架 ---
+_PIPELINE_END = object() # 階段結束標記
+
+class PipelineStage:
+    """
+    管線中的一個階段：以 concurrency 個執行緒從輸入佇列取出 chunk、呼叫 func，並將結果送往下一階段。
+    func 回傳 None 或拋出例外時，該 chunk 以 None 繼續往下傳遞 (保持序號連續)，後續階段會直接略過。
+    ordered=True 的階段依 chunk 原始序號處理 (需單一執行緒)；on_missing 在收到上游遺失的 chunk 時呼叫。
+    """
+    def __init__(self, name, func, concurrency=1, ordered=False, on_missing=None):
+        if ordered and concurrency != 1:
+            raise ValueError(f"階段 '{name}' 需依序處理，只能使用單一執行緒。")
+        self.name = name
+        self.func = func
+        self.concurrency = max(1, concurrency)
+        self.ordered = ordered
+        self.on_missing = on_missing
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.lock = threading.Lock()
+        self.input_queue = None
+
+    def _process(self, payload):
+        if payload is None:
+            if self.on_missing is not None:
+                self.on_missing()
+            return None
+        started = time.perf_counter()
+        try:
+            return self.func(payload)
+        except Exception as e:
+            logging.error(f"管線階段 '{self.name}' 處理 chunk 時發生錯誤 ({type(e).__name__}): {e}")
+            with self.lock:
+                self.errors += 1
+            return None
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.items += 1
+                self.busy_seconds += elapsed
+            workflow_metrics.observe(self.name, elapsed)
+
+
+class StagedPipeline:
+    """
+    以有界佇列串接的多階段管線。來源 (例如 VCF 讀取) 在獨立執行緒中產生 chunk，
+    每個階段有自己的並行度；佇列滿時上游自動等待 (背壓)，因此整體速率由最慢的階段決定，
+    而不是所有階段耗時的總和。
+    有 ordered 階段時，來源最多領先該階段 queue_size + 上游工作執行緒數個 chunk (重排視窗)；
+    某個 chunk 卡在重試時，其他 chunk 不會無限累積在重排暫存區中。
+    """
+    def __init__(self, source, stages, queue_size=None, report_interval=None, metrics=None):
+        self.source = source
+        self.metrics = metrics
+        self.stages = stages
+        self.queue_size = queue_size or PIPELINE_QUEUE_SIZE
+        self.report_interval = PIPELINE_REPORT_INTERVAL_SECONDS if report_interval is None else report_interval
+        self.source_items = 0
+        self.source_error = None # 來源 (例如格式錯誤的 VCF) 拋出的例外；之後的 chunk 不會被處理
+        self.reorder_window = None # 重排視窗 (BoundedSemaphore)；來源產生 chunk 前取得，最後一個 ordered 階段處理後釋放
+        self.window_stage = None
+        self.started_at = None
+        self.finished = threading.Event()
+
+    def _run_source(self, first_queue, first_stage):
+        try:
+            for seq, payload in enumerate(self.source):
+                if self.reorder_window is not None:
+                    self.reorder_window.acquire()
+                first_queue.put((seq, payload))
+                self.source_items += 1
+        except Exception as e:
+            self.source_error = e
+            logging.error(f"管線來源發生錯誤 ({type(e).__name__}): {e}")
+        finally:
+            for _ in range(first_stage.concurrency):
+                first_queue.put(_PIPELINE_END)
+
+    def _run_stage_worker(self, stage, output_queue, next_stage, remaining_workers):
+        pending = {}
+        next_seq = 0
+        while True:
+            item = stage.input_queue.get()
+            if item is _PIPELINE_END:
+                break
+            if not stage.ordered:
+                seq, payload = item
+                result = stage._process(payload)
+                if output_queue is not None:
+                    output_queue.put((seq, result))
+                continue
+            # 依序號處理：先暫存提早到達的 chunk (數量受重排視窗限制)
+            pending[item[0]] = item[1]
+            while next_seq in pending:
+                result = stage._process(pending.pop(next_seq))
+                if output_queue is not None:
+                    output_queue.put((next_seq, result))
+                next_seq += 1
+                if stage is self.window_stage:
+                    self.reorder_window.release()
+
+        with stage.lock:
+            remaining_workers[stage.name] -= 1
+            last_worker = remaining_workers[stage.name] == 0
+        if last_worker and output_queue is not None:
+            for _ in range(next_stage.concurrency):
+                output_queue.put(_PIPELINE_END)
+
+    def _run_monitor(self):
+        while not self.finished.wait(self.report_interval):
+            logging.info(self.progress_summary())
+            if self.metrics is not None:
+                logging.info(self.metrics.progress_summary())
+
+    def progress_summary(self):
+        """
+        回傳各階段的佇列深度、已處理 chunk 數、吞吐量 (chunk/秒) 與忙碌比例。
+        """
+        elapsed = max(time.perf_counter() - self.started_at, 1e-9)
+        parts = [f"來源: {self.source_items} chunk"]
+        for stage in self.stages:
+            busy_ratio = stage.busy_seconds / (elapsed * stage.concurrency)
+            parts.append(
+                f"{stage.name}: 佇列 {stage.input_queue.qsize()}/{self.queue_size}，"
+                f"已處理 {stage.items}，{stage.items / elapsed:.2f} chunk/秒，忙碌 {busy_ratio:.0%}"
+            )
+        return "管線狀態 | " + " | ".join(parts)
+
+    def run(self):
+        """
+        執行管線直到來源耗盡且所有階段完成。
+        """
+        self.started_at = time.perf_counter()
+        for stage in self.stages:
+            stage.input_queue = queue.Queue(maxsize=self.queue_size)
+        remaining_workers = {stage.name: stage.concurrency for stage in self.stages}
+        ordered_indexes = [i for i, stage in enumerate(self.stages) if stage.ordered]
+        if ordered_indexes:
+            self.window_stage = self.stages[ordered_indexes[-1]]
+            window = self.queue_size + sum(stage.concurrency for stage in self.stages[:ordered_indexes[-1]])
+            self.reorder_window = threading.BoundedSemaphore(window)
+
+        threads = [threading.Thread(
+            target=self._run_source, args=(self.stages[0].input_queue, self.stages[0]), name="pipeline-source", daemon=True
+        )]
+        for i, stage in enumerate(self.stages):
+            next_stage = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            output_queue = next_stage.input_queue if next_stage is not None else None
+            for n in range(stage.concurrency):
+                threads.append(threading.Thread(
+                    target=self._run_stage_worker, args=(stage, output_queue, next_stage, remaining_workers),
+                    name=f"pipeline-{stage.name}-{n}", daemon=True,
+                ))
+        monitor = threading.Thread(target=self._run_monitor, name="pipeline-monitor", daemon=True)
+
+        for thread in threads:
+            thread.start()
+        if self.report_interval and self.report_interval > 0:
+            monitor.start()
+        for thread in threads:
+            thread.join()
+        self.finished.set()
+        logging.info(self.progress_summary().replace("管線狀態", "管線完成"))
+
+# --- MongoDB 批量寫入 ---
+def slim_variant_doc(variant_doc):
+    """
+    將完整變異文件拆成 (精簡文件, 原始註釋文件)。
+    精簡文件只保留報告與查詢需要的欄位，並以 myvariant_id 參照原始註釋；
+    原始註釋文件以 MyVariant.info 的變異 ID 作為 _id，多個樣本/執行共用同一份。
+    """
+    myvariant_anno = variant_doc.get("annotation_myvariant_info") or {}
+    slim_doc = {
+        key: variant_doc[key]
+        for key in ("_id", "chrom", "pos", "id", "ref", "alt", "qual", "filter", "samples",
+                    "gene_symbol", "pathogenicity_assessment", "pathogenicity_evidence",
+                    "pathogenicity_evidence_codes", "pathogenicity_ruleset", "relevant_to_lung_adenocarcinoma")
+        if key in variant_doc
+    }
+    slim_doc["info"] = {key: value for key, value in (variant_doc.get("info") or {}).items() if key in SLIM_DOC_INFO_KEYS}
+    annotation_doc = None
+    if myvariant_anno.get("_id"):
+        slim_doc["myvariant_id"] = myvariant_anno["_id"]
+        annotation_doc = {key: value for key, value in myvariant_anno.items() if key != "query"}
+    return slim_doc, annotation_doc
+
+class MongoVariantWriter:
+    """
+    累積變異文件並以固定批次大小 (與 VCF chunk 大小無關) 寫入 MongoDB。
+    write_mode 為 "upsert" 時使用無序的 ReplaceOne 批量 upsert；為 "insert" 時使用 insert_many(ordered=False)，
+    重複 _id (錯誤碼 11000) 視為已寫入。提供 annotation_collection 時改寫精簡文件，原始註釋依變異 ID 去重另存。
+    added_count / flushed_count 分別為已加入與已送出寫入的文件數，供呼叫端判斷哪些 chunk 已完整寫入。
+    document_id 為產生文件 _id 的函數 (預設 variant_document_id)。
+    """
+    def __init__(self, collection, annotation_collection=None, batch_size=1000, write_mode="upsert", write_concern=None,
+                 document_id=None):
+        if write_mode not in ("upsert", "insert"):
+            raise ValueError(f"不支援的 MongoDB 寫入模式: {write_mode}")
+        if write_concern:
+            concern = WriteConcern(**write_concern)
+            collection = collection.with_options(write_concern=concern)
+            if annotation_collection is not None:
+                annotation_collection = annotation_collection.with_options(write_concern=concern)
+        self.collection = collection
+        self.annotation_collection = annotation_collection
+        self.batch_size = max(1, batch_size)
+        self.write_mode = write_mode
+        self.document_id = document_id or variant_document_id
+        self.buffer = []
+        self.added_count = 0
+        self.flushed_count = 0
+        self.written_count = 0 # 已確認寫入的文件數 (含覆寫/重複)
+        self.new_count = 0 # 其中新增的文件數
+        self.annotation_count = 0
+
+    def add(self, variant_docs):
+        """
+        加入文件；緩衝區累積滿一個批次時立即寫入。寫入失敗時拋出例外 (該批文件不會重試)。
+        """
+        self.buffer.extend(variant_docs)
+        self.added_count += len(variant_docs)
+        while len(self.buffer) >= self.batch_size:
+            self._write_batch(self._take(self.batch_size))
+
+    def flush(self):
+        """
+        寫入緩衝區中剩餘的文件。
+        """
+        if self.buffer:
+            self._write_batch(self._take(len(self.buffer)))
+
+    def _take(self, count):
+        batch, self.buffer = self.buffer[:count], self.buffer[count:]
+        self.flushed_count += len(batch)
+        return batch
+
+    def _write_batch(self, variant_docs):
+        for variant_doc in variant_docs:
+            variant_doc["_id"] = self.document_id(variant_doc)
+        if self.annotation_collection is not None:
+            annotations = {}
+            slim_docs = []
+            for variant_doc in variant_docs:
+                slim_doc, annotation_doc = slim_variant_doc(variant_doc)
+                slim_docs.append(slim_doc)
+                if annotation_doc is not None:
+                    annotations[annotation_doc["_id"]] = annotation_doc # 同一批次內依變異 ID 去重
+            # 先寫原始註釋，確保精簡文件參照的註釋一定存在
+            if annotations:
+                self._write_docs(self.annotation_collection, list(annotations.values()))
+                self.annotation_count += len(annotations)
+            variant_docs = slim_docs
+        written, new = self._write_docs(self.collection, variant_docs)
+        self.written_count += written
+        self.new_count += new
+        workflow_metrics.inc("inserted", written)
+
+    def _write_docs(self, collection, docs):
+        """
+        以目前的寫入模式寫入 docs，回傳 (寫入文件數, 新增文件數)；未確認寫入 (w=0) 時新增數以寫入數計。
+        """
+        started = time.perf_counter()
+        try:
+            return self._write_docs_unmetered(collection, docs)
+        finally:
+            workflow_metrics.observe("mongo_write", time.perf_counter() - started)
+
+    def _write_docs_unmetered(self, collection, docs):
+        if self.write_mode == "upsert":
+            result = collection.bulk_write([ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs], ordered=False)
+            if not result.acknowledged:
+                return len(docs), len(docs)
+            return len(docs), result.upserted_count
+        try:
+            result = collection.insert_many(docs, ordered=False)
+            return len(docs), len(result.inserted_ids)
+        except pymongo.errors.BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in write_errors):
+                raise
+            return len(docs), e.details.get("nInserted", 0)
+
+# --- 主註釋工作流程 ---
+def assess_annotated_docs(chunk_docs, annotations, classifier=None, gene_panel=None, hpo_terms=None):
+    """
+    將註釋結果附加到變異文件並執行致病性評估，回傳 MyVariant.info 找到資訊的文件。
+    classifier 為 None 時逐筆呼叫 assess_pathogenicity (gene_panel/hpo_terms 預設為肺腺癌面板)。
+    """
+    variants_to_insert = []
+    failures = {"not_found": 0, "api_error": 0}
+    # 逐筆日誌在數百萬筆記錄時本身就是可觀的成本: 預設只在 DEBUG 等級記錄，或每 VARIANT_LOG_SAMPLE_EVERY 筆抽樣一筆
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+    for index, (variant_doc, myvariant_annotation) in enumerate(zip(chunk_docs, annotations)):
+        if debug_enabled or (VARIANT_LOG_SAMPLE_EVERY > 0 and index % VARIANT_LOG_SAMPLE_EVERY == 0):
+            chrom, pos, ref, alt = variant_doc["chrom"], variant_doc["pos"], variant_doc["ref"], variant_doc["alt"]
+            logging.log(logging.DEBUG if debug_enabled else logging.INFO,
+                         f"正在註釋變異: {chrom}-{pos}-{ref}-{alt} (ID: {variant_doc['id']})")
+
+        if myvariant_annotation.get("_id"):  # 確保有找到資訊
+            variant_doc["annotation_myvariant_info"] = myvariant_annotation
+            variant_doc["gene_symbol"] = myvariant_gene_symbol(myvariant_annotation)
+            variants_to_insert.append(variant_doc)
+        else:
+            failures["not_found" if myvariant_annotation.get("status") == "not_found" else "api_error"] += 1
+            if debug_enabled:
+                logging.debug(f"MyVariant.info 未找到變異資訊: {variant_doc['chrom']}-{variant_doc['pos']}-"
+                              f"{variant_doc['ref']}-{variant_doc['alt']} ({myvariant_annotation.get('status')})")
+    workflow_metrics.inc("processed", len(chunk_docs))
+    workflow_metrics.inc("not_found", failures["not_found"])
+    workflow_metrics.inc("api_error", failures["api_error"])
+
+    # --- 執行致病性評估 ---
+    classify_annotated_docs(variants_to_insert, classifier, gene_panel, hpo_terms)
+    return variants_to_insert
+
+def build_pathogenicity_classifier(gene_panel, hpo_terms):
+    """
+    依 PATHOGENICITY_CLASSIFIER 建立分類器: "vectorized" 回傳 ChunkPathogenicityClassifier，
+    "legacy" 回傳 None (classify_annotated_docs 逐筆呼叫 assess_pathogenicity)；其他值拋出 ValueError。
+    """
+    if PATHOGENICITY_CLASSIFIER == "vectorized":
+        return ChunkPathogenicityClassifier(gene_panel, hpo_terms)
+    if PATHOGENICITY_CLASSIFIER != "legacy":
+        raise ValueError(f"不支援的 PATHOGENICITY_CLASSIFIER: {PATHOGENICITY_CLASSIFIER}")
+    return None
+
+def classify_annotated_docs(variant_docs, classifier=None, gene_panel=None, hpo_terms=None):
+    """
+    依 annotation_myvariant_info 評估文件的致病性並記錄規則版本；classifier 為 None 時逐筆呼叫 assess_pathogenicity，
+    gene_panel/hpo_terms 未指定時使用肺腺癌面板與 HPO terms。
+    """
+    if classifier is not None:
+        classifier.assess_docs(variant_docs)
+        return
+    gene_panel = LUNG_ADENOCARCINOMA_GENE_PANEL if gene_panel is None else gene_panel
+    hpo_terms = LUNG_ADENOCARCINOMA_HPO_TERMS if hpo_terms is None else hpo_terms
+    ruleset_version = pathogenicity_ruleset_version(gene_panel, hpo_terms, classifier="legacy")
+    for variant_doc in variant_docs:
+        pathogenicity, evidence = assess_pathogenicity(variant_doc, gene_panel, hpo_terms)
+        variant_doc["pathogenicity_assessment"] = pathogenicity
+        variant_doc["pathogenicity_evidence"] = evidence
+        variant_doc["pathogenicity_ruleset"] = ruleset_version
+
+def build_variant_doc(record):
+    """
+    將 PyVCF 記錄或 FastVcfRecord 轉換為寫入 MongoDB 的變異文件 (只取第一個 ALT)。
+    """
+    if isinstance(record, FastVcfRecord):
+        return {
+            "chrom": record.CHROM,
+            "pos": record.POS,
+            "id": record.ID if record.ID else ".",
+            "ref": record.REF,
+            "alt": str(record.ALT[0]),
+            "qual": record.QUAL,
+            "filter": record.FILTER,
+            "info": record.INFO,
+            "samples": [{"sample_id": name, "genotype": gt} for name, gt in record.genotypes()]
+        }
+
+    variant_doc = {
+        "chrom": str(record.CHROM),
+        "pos": record.POS,
+        "id": record.ID if record.ID else ".",
+        "ref": str(record.REF),
+        "alt": str(record.ALT[0]),  # 獲取第一個變異等位基因
+        "qual": record.QUAL,
+        "filter": record.FILTER,
+        "info": dict(record.INFO),
+        "samples": []
+    }
+
+    for sample in record.samples:
+        sample_data = {
+            "sample_id": sample.sample,
+            "genotype": sample['GT']
+        }
+        variant_doc["samples"].append(sample_data)
+
+    return variant_doc
+
+def build_variant_docs(record, reference=None):
+    """
+    將一筆 VCF 記錄分解為每個 ALT 一份的雙等位基因變異文件，並正規化位置與等位基因。
+    多等位基因記錄的基因型與 Number=A/R 的 INFO 欄位依 ALT 拆分；"*"、<DEL> 等無法以 HGVS
+    查詢的等位基因會記錄警告後略過，僅有參考等位基因的記錄 (ALT 為 ".") 則不產生文件也不記錄警告。
+    分解或正規化過的文件以 "vcf_record" 保留原始記錄的位置與等位基因。
+    """
+    base_doc = build_variant_doc(record)
+    alts = [str(alt) if alt is not None else "." for alt in record.ALT]
+    variant_docs = []
+    if len(alts) > 1:
+        workflow_metrics.inc("multiallelic_split")
+    for allele_index, alt in enumerate(alts, 1):
+        if alt == ".":
+            logging.debug(f"跳過僅有參考等位基因的記錄: {record.CHROM}-{record.POS}")
+            continue
+        if not is_sequence_allele(alt):
+            logging.warning(f"跳過無法註釋的等位基因: {record.CHROM}-{record.POS}-{base_doc['ref']}-{alt}")
+            workflow_metrics.inc("skipped_alleles")
+            continue
+        if len(alts) == 1:
+            variant_doc = dict(base_doc)
+        else:
+            variant_doc = dict(
+                base_doc,
+                alt=alt,
+                info=split_info(base_doc["info"], len(alts), allele_index),
+                samples=[{"sample_id": s["sample_id"], "genotype": split_genotype(s["genotype"], allele_index)}
+                         for s in base_doc["samples"]]
+            )
+        pos, ref, norm_alt = normalize_variant(variant_doc["chrom"], variant_doc["pos"], variant_doc["ref"], alt, reference)
+        if len(alts) > 1 or (pos, ref, norm_alt) != (variant_doc["pos"], variant_doc["ref"], alt):
+            variant_doc["vcf_record"] = {"pos": base_doc["pos"], "ref": base_doc["ref"], "alt": alts,
+                                         "allele_index": allele_index}
+            variant_doc.update(pos=pos, ref=ref, alt=norm_alt)
+        variant_docs.append(variant_doc)
+    return variant_docs
+
+def variant_document_id(variant_doc):
+    """
+    產生確定性的文件 _id: "chrom-pos-ref-alt:樣本"，重跑時覆寫同一份文件而非重複插入。
+    """
+    samples = "+".join(str(s["sample_id"]) for s in variant_doc.get("samples", []))
+    return f"{variant_doc['chrom']}-{variant_doc['pos']}-{variant_doc['ref']}-{variant_doc['alt']}:{samples}"
+
+def iter_variant_doc_chunks(file_path, chunk_size, region_index=None, regions=None, skip_records=0, reference=None,
+                            start_offset=None):
+    """
+    逐 chunk 產生 (變異文件列表, 已讀取的記錄數, 續跑位置)，供註釋階段使用。
+    NORMALIZE_VARIANTS 為 True 時多等位基因記錄分解為每個 ALT 一份文件並正規化 (reference 為選用的
+    ReferenceGenome，用於左對齊)；否則跳過多等位基因變異。
+    已讀取的記錄數為通過區域過濾的 VCF 記錄累計數，作為續跑檢查點的位置；
+    skip_records 大於 0 時，前 skip_records 筆記錄只計數而不建立文件 (續跑時略過已完成的部分)。
+    續跑位置為 chunk 最後一筆記錄之後的檔案位置 (RecordChunk.resume_offset)；循序解析時可將它作為 start_offset
+    直接定位到該處繼續，前 skip_records 筆記錄不必重新讀取。索引區域查詢與平行解析不提供位置 (為 None)，
+    續跑時仍以計數略過。
+    若提供 regions，使用 Tabix/CSI 索引只讀取這些區域。
+    若提供 region_index，先丟棄面板區域以外的記錄，並重新湊滿 chunk_size 以維持批次查詢效率。
+    """
+    total_count = 0
+    kept_count = 0
+    yielded_count = skip_records
+    resume_offset = None
+    chunk_docs = []
+    prefiltered = False
+    if regions is not None:
+        chunks = parse_vcf_regions_in_chunks(file_path, regions, chunk_size)
+    elif VCF_PARSE_WORKERS > 1:
+        # 平行模式在工作行程中完成區域過濾，因此只能統計保留的記錄數
+        chunks = parse_vcf_parallel_in_chunks(file_path, chunk_size, VCF_PARSE_WORKERS, region_index)
+        prefiltered = True
+    else:
+        chunks = parse_vcf_in_chunks(file_path, chunk_size, start_offset)
+        if start_offset is not None:
+            kept_count = skip_records # 已定位到檢查點之後，不需要再計數略過
+    for chunk in chunks:
+        resume_offset = getattr(chunk, "resume_offset", None)
+        total_count += len(chunk)
+        if region_index is not None and not prefiltered:
+            chunk = filter_records_by_regions(chunk, region_index)
+        if kept_count + len(chunk) <= skip_records:
+            kept_count += len(chunk)
+            continue
+        for record in chunk:
+            kept_count += 1
+            if kept_count <= skip_records:
+                continue
+            if NORMALIZE_VARIANTS:
+                chunk_docs.extend(build_variant_docs(record, reference))
+                continue
+            if len(record.ALT) != 1:
+                logging.warning(f"跳過多等位基因變異: {record.CHROM}-{record.POS}-{record.REF}-{record.ALT}")
+                workflow_metrics.inc("skipped_multiallelic")
+                continue
+            chunk_docs.append(build_variant_doc(record))
+        if region_index is None or len(chunk_docs) >= chunk_size:
+            yield chunk_docs, kept_count, resume_offset
+            yielded_count = kept_count
+            chunk_docs = []
+    if kept_count > yielded_count:  # 最後一批 (可能為空) 也要產生，讓檢查點推進到檔案結尾
+        yield chunk_docs, kept_count, resume_offset
+    if region_index is not None and prefiltered:
+        logging.info(f"基因面板區域過濾: 保留 {kept_count} 個位於面板區域內的變異。")
+    elif region_index is not None:
+        logging.info(f"基因面板區域過濾: 共讀取 {total_count} 個變異，保留 {kept_count} 個位於面板區域內的變異。")
+
+# --- 世代 (cohort) 模式 ---
+def chrom_sort_key(chrom, contig_ranks=None):
+    """
+    染色體排序鍵。提供 contig_ranks (正規化 contig 名稱 -> 順序，來自 VCF 標頭的 ##contig) 時依標頭順序，
+    與 bcftools sort 的排序一致；不在標頭中或沒有 contig_ranks 時，1-22 依數字，接著 X、Y、M/MT，
+    其他 contig 依名稱排在最後 (與 GRCh37/38 參考基因組的順序一致)。
+    """
+    name = normalize_chrom(chrom)
+    if contig_ranks:
+        rank = contig_ranks.get(name)
+        if rank is not None:
+            return (0, rank, "")
+    name = name.upper()
+    if name.isdigit():
+        return (1, int(name), "")
+    if name in ("X", "Y", "M", "MT"):
+        return (2, "XYM".index(name[0]), "")
+    return (3, 0, name)
+
+def read_vcf_contig_order(file_path):
+    """
+    依出現順序回傳 VCF 標頭 ##contig 行的正規化 contig 名稱 (沒有 ##contig 行時為空列表)。
+    """
+    opener = gzip.open if str(file_path).endswith(".gz") else open
+    contigs = []
+    with opener(file_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.startswith("##"):
+                break
+            if line.startswith("##contig=<"):
+                for field in line.strip()[len("##contig=<"):].rstrip(">").split(","):
+                    key, _, value = field.partition("=")
+                    if key == "ID":
+                        contigs.append(normalize_chrom(value))
+                        break
+    return contigs
+
+def cohort_contig_ranks(file_paths):
+    """
+    合併各 VCF 標頭的 contig 順序 (以第一個檔案為準，其他檔案新增的 contig 依序接在後面)，回傳 contig -> 順序。
+    兩個檔案共有的 contig 順序不一致時 (各自依不同的參考基因組排序) 無法依位置合併，拋出 ValueError。
+    """
+    ranks = {}
+    for path in file_paths:
+        contigs = read_vcf_contig_order(path)
+        known = [contig for contig in contigs if contig in ranks]
+        for before, after in zip(known, known[1:]):
+            if ranks[before] > ranks[after]:
+                raise ValueError(f"'{path}' 標頭的 contig 順序 ({before} 在 {after} 之前) 與先前的 VCF 不一致，"
+                                 f"請以相同的參考基因組標頭 (bcftools reheader) 重新排序後再合併。")
+        for contig in contigs:
+            ranks.setdefault(contig, len(ranks))
+    return ranks
+
+def variant_site_id(variant_doc):
+    """
+    位點 _id: "chrom-pos-ref-alt" (正規化後的等位基因，"chr7" 與 "7" 視為同一條染色體)。
+    """
+    return f"{normalize_chrom(variant_doc['chrom'])}-{variant_doc['pos']}-{variant_doc['ref']}-{variant_doc['alt']}"
+
+def genotype_document_id(genotype_doc):
+    return f"{genotype_doc['site_id']}:{genotype_doc['sample_id']}"
+
+def build_genotype_docs(variant_doc, site_id):
+    """
+    將變異文件的樣本基因型轉為各自的基因型文件 (以 site_id 參照位點)；
+    COHORT_STORE_REF_CALLS 為 False 時略過同型合子參考與缺失的基因型。
+    """
+    info = {key: value for key, value in (variant_doc.get("info") or {}).items() if key in COHORT_GENOTYPE_INFO_KEYS}
+    genotype_docs = []
+    for sample in variant_doc["samples"]:
+        genotype = sample["genotype"]
+        if not COHORT_STORE_REF_CALLS and not any(
+                allele not in ("0", ".") for allele in str(genotype).replace("|", "/").split("/")):
+            continue
+        genotype_doc = {
+            "site_id": site_id,
+            "sample_id": sample["sample_id"],
+            "genotype": genotype,
+            "source_vcf": variant_doc["source_vcf"],
+            "qual": variant_doc["qual"],
+            "filter": variant_doc["filter"],
+            "info": info,
+        }
+        if "vcf_record" in variant_doc:
+            genotype_doc["vcf_record"] = variant_doc["vcf_record"]
+        genotype_docs.append(genotype_doc)
+    return genotype_docs
+
+def iter_sorted_variant_docs(file_path, region_index=None, regions=None, reference=None, contig_ranks=None):
+    """
+    逐筆產生 ((染色體排序鍵, 原始位置), 變異文件)，並確認檔案依位置排序 (k 路合併的前提)。
+    以 VCF 記錄的原始位置排序，因此左對齊後位置改變的變異不會破壞合併順序；染色體順序見 chrom_sort_key。
+    """
+    source_vcf = os.path.basename(file_path)
+    last_key = None
+    for chunk_docs, _, _ in iter_variant_doc_chunks(file_path, VCF_CHUNK_SIZE, region_index, regions, reference=reference):
+        for variant_doc in chunk_docs:
+            record_pos = variant_doc["vcf_record"]["pos"] if "vcf_record" in variant_doc else variant_doc["pos"]
+            key = (chrom_sort_key(variant_doc["chrom"], contig_ranks), record_pos)
+            if last_key is not None and key < last_key:
+                raise ValueError(f"'{file_path}' 未依染色體與位置排序 (位於 {variant_doc['chrom']}:{record_pos})，"
+                                 f"請先以 bcftools sort 排序。")
+            last_key = key
+            variant_doc["source_vcf"] = source_vcf
+            yield key, variant_doc
+
+def iter_cohort_site_chunks(file_paths, chunk_size, region_index=None, regions=None, reference=None):
+    """
+    以 heapq.merge 將多個已排序的 VCF 依位置 k 路合併 (每個檔案同時只保留目前的 chunk 在記憶體中)，
+    逐 chunk 產生 (位點文件列表, 基因型文件列表, 合併的變異記錄數)。染色體順序取自 VCF 標頭的 ##contig。
+    每個位點 (正規化後) 只產生一份位點文件，各檔案/樣本的基因型各自成為基因型文件，並與其位點在同一個 chunk。
+    正規化可能讓位點位置與原始位置相差數個鹼基，因此位點在合併位置超過其位置 COHORT_SITE_MARGIN_BP
+    (或換到下一條染色體) 後才送出，之後的記錄不會再產生相同位點。沒有任何帶變異基因型的位點不會被註釋。
+    """
+    contig_ranks = cohort_contig_ranks(file_paths)
+    if regions is not None:
+        regions = sorted(regions, key=lambda region: (chrom_sort_key(region[0], contig_ranks),) + tuple(region[1:]))
+    streams = [iter_sorted_variant_docs(path, region_index, regions, reference, contig_ranks) for path in file_paths]
+    pending = {} # site_id -> (位點文件, 基因型文件列表)，包含已可送出與仍在等待的位點
+    waiting = deque() # 依加入順序等待合併位置越過的 (site_id, 染色體排序鍵, 位置)
+    ready = [] # 之後的記錄不會再產生的 site_id
+    record_count = 0
+
+    def take_sites(site_ids):
+        site_docs, genotype_docs = [], []
+        for site_id in site_ids:
+            site_doc, calls = pending.pop(site_id)
+            site_docs.append(site_doc)
+            genotype_docs.extend(calls)
+        return site_docs, genotype_docs
+
+    for key, variant_doc in heapq.merge(*streams, key=lambda item: item[0]):
+        chrom_key, record_pos = key
+        while waiting and (waiting[0][1] != chrom_key or waiting[0][2] < record_pos - COHORT_SITE_MARGIN_BP):
+            ready.append(waiting.popleft()[0])
+        if len(ready) >= chunk_size:
+            site_docs, genotype_docs = take_sites(ready[:chunk_size])
+            del ready[:chunk_size]
+            yield site_docs, genotype_docs, record_count
+            record_count = 0
+        record_count += 1
+        site_id = variant_site_id(variant_doc)
+        calls = build_genotype_docs(variant_doc, site_id)
+        if not calls and variant_doc["samples"]:
+            continue
+        entry = pending.get(site_id)
+        if entry is None:
+            pending[site_id] = ({
+                "chrom": normalize_chrom(variant_doc["chrom"]),
+                "pos": variant_doc["pos"],
+                "id": variant_doc["id"],
+                "ref": variant_doc["ref"],
+                "alt": variant_doc["alt"],
+            }, calls)
+            waiting.append((site_id, chrom_key, variant_doc["pos"]))
+            continue
+        entry[1].extend(calls)
+        if entry[0]["id"] == ".":
+            entry[0]["id"] = variant_doc["id"]
+    ready.extend(site_id for site_id, _, _ in waiting)
+    for offset in range(0, len(ready), chunk_size):
+        site_docs, genotype_docs = take_sites(ready[offset:offset + chunk_size])
+        yield site_docs, genotype_docs, record_count
+        record_count = 0
+    if record_count:
+        yield [], [], record_count
+
+def start_workflow_metrics(client, file_paths, region_index, regions, start_records=0):
+    """
+    重設本次執行的監控資料、依設定啟動 /metrics 端點，並在未使用面板或區域過濾時於背景估計總記錄數以估計剩餘時間
+    (過濾後保留的記錄數無法由檔案大小推算)。
+    """
+    workflow_metrics.reset(start_records, getattr(client, "cache", None))
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT, METRICS_ADDR)
+    if PROGRESS_COUNT_RECORDS and region_index is None and regions is None:
+        start_record_count(file_paths)
+
+def prepare_workflow_inputs():
+    """
+    載入單一 VCF 與世代模式共用的資源，回傳 (面板區域索引, 索引查詢區域, 參考基因組, 註釋客戶端, 分類器)；
+    設定有誤時記錄錯誤並回傳 None。
+    """
+    region_index = None
+    if PANEL_ONLY_MODE:
+        if not PANEL_REGIONS_FILE:
+            logging.error("已啟用 PANEL_ONLY_MODE，但未設定 PANEL_REGIONS_FILE，退出。")
+            return None
+        try:
+            region_index = load_gene_region_index(PANEL_REGIONS_FILE, LUNG_ADENOCARCINOMA_GENE_PANEL, PANEL_REGION_PADDING_BP)
+        except (OSError, ValueError, IndexError) as e:
+            logging.error(f"載入基因面板區域檔案 '{PANEL_REGIONS_FILE}' 時發生錯誤 ({type(e).__name__}): {e}")
+            return None
+
+    regions = None
+    if VCF_QUERY_REGIONS:
+        regions = [parse_region_string(r) for r in VCF_QUERY_REGIONS]
+    elif region_index is not None and VCF_USE_TABIX_INDEX:
+        regions = list(region_index.regions())
+
+    reference = None
+    if NORMALIZE_VARIANTS and REFERENCE_FASTA_PATH:
+        try:
+            reference = ReferenceGenome(REFERENCE_FASTA_PATH)
+        except (ImportError, OSError, ValueError) as e:
+            logging.error(f"開啟參考基因組 '{REFERENCE_FASTA_PATH}' 時發生錯誤 ({type(e).__name__}): {e}")
+            return None
+
+    if ANNOTATION_BACKEND == "local" and not os.path.exists(LOCAL_ANNOTATION_DB_PATH):
+        logging.error(f"找不到本地註釋資料庫 '{LOCAL_ANNOTATION_DB_PATH}'，請先執行 build_annotation_store.py，退出。")
+        return None
+    client = get_annotation_client()
+
+    try:
+        classifier = build_pathogenicity_classifier(LUNG_ADENOCARCINOMA_GENE_PANEL, LUNG_ADENOCARCINOMA_HPO_TERMS)
+    except ValueError as e:
+        logging.error(f"{e}，退出。")
+        return None
+    return region_index, regions, reference, client, classifier
+
+def write_workflow_report(collection):
+    """
+    依 REPORT_* 設定，以聚合 cursor 串流產生致病性/可能致病性變異報告；
+    設定 REPORT_OUTPUT_PATH 時寫入檔案，否則輸出到控制台。
+    """
+    logging.info("正在以 MongoDB 聚合串流產生致病性/可能致病性變異報告...")
+    try:
+        if REPORT_OUTPUT_PATH:
+            report_count = write_variant_report(collection, REPORT_OUTPUT_PATH, VCF_FILE_PATH, LUNG_ADENOCARCINOMA_HPO_TERMS)
+            logging.info(f"報告已寫入 '{REPORT_OUTPUT_PATH}'，共 {report_count} 個變異。")
+        else:
+            print("\n" + "="*30 + " Simulated MedGemma Report " + "="*30)
+            report_count = write_variant_report(collection, sys.stdout, VCF_FILE_PATH, LUNG_ADENOCARCINOMA_HPO_TERMS)
+            print("="*80 + "\n")
+            logging.info(f"模擬 MedGemma 報告已輸出到控制台，共 {report_count} 個變異。")
+        if not report_count:
+            logging.info("在 MongoDB 中未找到致病性/可能致病性變異以產生報告。")
+        return report_count
+    except Exception as e:
+        logging.error(f"從 MongoDB 檢索變異或生成報告時發生錯誤: {e}")
+        return 0
+
+def run_annotation_workflow():
+    """
+    執行完整的 VCF 註釋和 MongoDB 儲存工作流程。
+    """
+    collection = get_mongo_collection()
+    # 修正: 檢查 Collection 物件是否為 None
+    if collection is None:
+        logging.error("無法初始化 MongoDB Collection，退出。")
+        return
+
+    if MONGO_CREATE_INDEXES:
+        ensure_variant_indexes(collection)
+
+    annotation_collection = None
+    if MONGO_STORAGE_MODE == "slim":
+        annotation_collection = collection.database[ANNOTATION_COLLECTION_NAME]
+    elif MONGO_STORAGE_MODE != "full":
+        logging.error(f"不支援的 MONGO_STORAGE_MODE: {MONGO_STORAGE_MODE}，退出。")
+        return
+    writer = MongoVariantWriter(collection, annotation_collection, MONGO_WRITE_BATCH_SIZE,
+                                MONGO_WRITE_MODE, MONGO_BULK_WRITE_CONCERN)
+
+    counts = {"processed": 0, "inserted": 0}
+    counts_lock = threading.Lock()
+
+    # --- 檢查點與續跑 ---
+    run_id = RUN_ID or os.path.abspath(VCF_FILE_PATH)
+    checkpoint_collection = collection.database[CHECKPOINT_COLLECTION_NAME]
+    skip_records = 0
+    start_offset = None
+    if RESUME_RUN:
+        checkpoint = load_checkpoint(checkpoint_collection, run_id)
+        if checkpoint and checkpoint.get("completed"):
+            logging.info(f"執行 '{run_id}' 已於先前完成，無需續跑。")
+            skip_records = None
+        elif checkpoint:
+            skip_records = checkpoint.get("records_done", 0)
+            start_offset = checkpoint_resume_offset(checkpoint, VCF_FILE_PATH)
+            logging.info(f"從檢查點續跑 '{run_id}': 略過前 {skip_records} 筆已完成的記錄 "
+                         f"(最後位置 {checkpoint.get('last_chrom')}:{checkpoint.get('last_pos')})。")
+        else:
+            logging.info(f"找不到 '{run_id}' 的檢查點，從頭開始執行。")
+
+    inputs = prepare_workflow_inputs()
+    if inputs is None:
+        return
+    region_index, regions, reference, client, classifier = inputs
+    if start_offset is not None and (regions is not None or VCF_PARSE_WORKERS > 1):
+        start_offset = None # 索引區域查詢與平行解析無法定位，改為重新讀取並以記錄數略過
+    if start_offset is not None:
+        logging.info(f"直接定位到檢查點的檔案位置 ({start_offset}) 繼續解析，不重新讀取已完成的記錄。")
+    start_workflow_metrics(client, [VCF_FILE_PATH], region_index, regions, skip_records or 0)
+
+    def parse_chunks():
+        chunks = iter_variant_doc_chunks(VCF_FILE_PATH, VCF_CHUNK_SIZE, region_index, regions, skip_records, reference,
+                                         start_offset)
+        for chunk_docs, records_done, resume_offset in workflow_metrics.time_iter("parse", chunks):
+            workflow_metrics.set_max("records_read", records_done)
+            yield chunk_docs, (records_done, resume_offset)
+        workflow_metrics.finish_reading()
+
+    def annotate_stage(doc_chunk):
+        chunk_docs, position = doc_chunk
+        return chunk_docs, position, client.annotate_variant_docs(chunk_docs)
+
+    def assess_stage(annotated_chunk):
+        chunk_docs, position, annotations = annotated_chunk
+        # api_error 的變異不會寫入；記錄數量，讓寫入階段不把檢查點推進到這個 chunk 之後
+        api_errors = sum(1 for anno in annotations if not anno.get("_id") and anno.get("status") != "not_found")
+        variants_to_insert = assess_annotated_docs(chunk_docs, annotations, classifier)
+        with counts_lock:
+            counts["processed"] += len(chunk_docs)
+        return variants_to_insert, position, chunk_docs[-1] if chunk_docs else None, api_errors
+
+    checkpoint_state = {"frozen": False}
+
+    def freeze_checkpoint(reason="管線上游發生錯誤"):
+        # 上游階段處理失敗的 chunk 未寫入；停止推進檢查點，讓續跑能重新處理
+        if not checkpoint_state["frozen"]:
+            checkpoint_state["frozen"] = True
+            logging.warning(f"{reason}，檢查點將停留在最後一個完整寫入的位置。")
+
+    # 每個 chunk 的 (加入後的文件累計數, (記錄累計數, 續跑位置), 最後一個變異)；對應文件全部送出寫入後才推進檢查點
+    pending_checkpoints = deque()
+
+    def write_documents(variant_docs=None):
+        # 以確定性 _id 寫入，重跑或續跑時不會產生重複文件
+        written_before = writer.written_count
+        try:
+            if variant_docs is None:
+                writer.flush()
+            else:
+                writer.add(variant_docs)
+        except Exception as e:
+            logging.error(f"批量寫入 MongoDB 時發生錯誤: {e}")
+            freeze_checkpoint()
+        if writer.written_count > written_before:
+            with counts_lock:
+                counts["inserted"] = writer.written_count
+            logging.info(f"已寫入 {writer.written_count - written_before} 個變異到 MongoDB (累計新增 {writer.new_count})。"
+                         f"總計已處理: {counts['processed']}，已寫入: {counts['inserted']}")
+        checkpoint = None
+        while pending_checkpoints and pending_checkpoints[0][0] <= writer.flushed_count:
+            checkpoint = pending_checkpoints.popleft()
+        if checkpoint is not None and not checkpoint_state["frozen"]:
+            records_done, resume_offset = checkpoint[1]
+            save_checkpoint(checkpoint_collection, run_id, records_done, VCF_FILE_PATH, checkpoint[2],
+                            resume_offset=resume_offset)
+
+    def write_stage(assessed_chunk):
+        variants_to_insert, position, last_doc, api_errors = assessed_chunk
+        if api_errors:
+            # 查詢失敗的變異沒有寫入；先送出前面 chunk 的文件讓檢查點推進到此 chunk 之前，
+            # 之後不再推進，執行也不會標記為完成，--resume 時會重新查詢
+            write_documents()
+            freeze_checkpoint(f"{api_errors} 個變異的 MyVariant.info 查詢失敗 (api_error)")
+        pending_checkpoints.append((writer.added_count + len(variants_to_insert), position, last_doc))
+        write_documents(variants_to_insert)
+        workflow_metrics.set_max("records_done", position[0])
+
+    if skip_records is not None:
+        # 解析 -> 註釋 -> 評估 -> 寫入，各階段以有界佇列串接並同時運作
+        stages = [
+            PipelineStage("annotate", annotate_stage, PIPELINE_ANNOTATE_WORKERS),
+            PipelineStage("assess", assess_stage, PIPELINE_ASSESS_WORKERS),
+            PipelineStage("write", write_stage, PIPELINE_WRITE_WORKERS, ordered=True, on_missing=freeze_checkpoint),
+        ]
+        pipeline = StagedPipeline(parse_chunks(), stages, metrics=workflow_metrics)
+        pipeline.run()
+        write_documents() # 寫入最後未滿一個批次的文件
+        if pipeline.source_error is not None:
+            # VCF 中途無法解析 (格式錯誤或截斷)：錯誤前的記錄已寫入並推進檢查點，但不標記為完成
+            checkpoint = load_checkpoint(checkpoint_collection, run_id) or {}
+            logging.error(f"VCF 檔案未完整讀取，本次執行未完成 (檢查點停留在第 {checkpoint.get('records_done', skip_records)} 筆記錄)。"
+                          f"修正檔案後可以 --resume 續跑。")
+        elif not checkpoint_state["frozen"] and not any(stage.errors for stage in stages):
+            checkpoint = load_checkpoint(checkpoint_collection, run_id) or {}
+            save_checkpoint(checkpoint_collection, run_id, checkpoint.get("records_done", skip_records), VCF_FILE_PATH, completed=True)
+        else:
+            logging.warning("本次執行有未完成的 chunk (處理失敗或 MyVariant.info 查詢失敗)，未標記為完成；"
+                            "可以 --resume 從檢查點重新處理。")
+    processed_count = counts["processed"]
+    inserted_count = counts["inserted"]
+
+    logging.info(f"註釋工作流程完成。總計處理了 {processed_count} 個變異，成功插入 {inserted_count} 個變異。")
+    logging.info(f"MyVariant.info 網路請求次數: {client.request_count}")
+    if client.cache is not None:
+        logging.info(client.cache.summary())
+    if isinstance(client, LocalAnnotationStore):
+        logging.info(client.summary())
+    logging.info(workflow_metrics.summary())
+    logging.info(f"您可以透過 MongoDB Compass 或 Atlas UI 檢查 '{DB_NAME}.{COLLECTION_NAME}' Collection。")
+
+    # --- 產生模擬 MedGemma 報告 ---
+    if (inserted_count > 0 or RESUME_RUN) and collection is not None:
+        write_workflow_report(collection)
     elif collection is None:
         logging.warning("MongoDB collection 未初始化，跳過報告生成。")
     else:
         logging.info("沒有插入任何變異，跳過報告生成。")
 
+def run_cohort_workflow(vcf_paths):
+    """
+    世代模式: 將多個 VCF (或一個多樣本 VCF) 依位置合併，每個獨特位點只註釋與評估一次，
+    位點文件寫入 SITE_COLLECTION_NAME，每個樣本的基因型寫入 GENOTYPE_COLLECTION_NAME。
+    註釋成本因此與獨特變異數成正比，而非樣本數 × 變異數。文件以確定性 _id upsert，可安全重跑 (不使用檢查點)。
+    全部記錄都成功處理時回傳 True；VCF 無法完整合併 (例如未排序) 或有 chunk 失敗時回傳 False。
+    """
+    collection = get_mongo_collection()
+    if collection is None:
+        logging.error("無法初始化 MongoDB Collection，退出。")
+        return False
+    database = collection.database
+    site_collection = database[SITE_COLLECTION_NAME]
+    genotype_collection = database[GENOTYPE_COLLECTION_NAME]
+    if MONGO_CREATE_INDEXES:
+        ensure_variant_indexes(site_collection)
+        ensure_variant_indexes(genotype_collection, [[("site_id", pymongo.ASCENDING)], [("sample_id", pymongo.ASCENDING)]])
+
+    annotation_collection = None
+    if MONGO_STORAGE_MODE == "slim":
+        annotation_collection = database[ANNOTATION_COLLECTION_NAME]
+    elif MONGO_STORAGE_MODE != "full":
+        logging.error(f"不支援的 MONGO_STORAGE_MODE: {MONGO_STORAGE_MODE}，退出。")
+        return False
+    site_writer = MongoVariantWriter(site_collection, annotation_collection, MONGO_WRITE_BATCH_SIZE,
+                                     MONGO_WRITE_MODE, MONGO_BULK_WRITE_CONCERN, document_id=variant_site_id)
+    genotype_writer = MongoVariantWriter(genotype_collection, None, MONGO_WRITE_BATCH_SIZE,
+                                         MONGO_WRITE_MODE, MONGO_BULK_WRITE_CONCERN, document_id=genotype_document_id)
+
+    inputs = prepare_workflow_inputs()
+    if inputs is None:
+        return False
+    region_index, regions, reference, client, classifier = inputs
+    counts = {"records": 0, "sites": 0, "found": 0}
+    start_workflow_metrics(client, vcf_paths, region_index, regions)
+
+    def parse_chunks():
+        chunks = iter_cohort_site_chunks(vcf_paths, VCF_CHUNK_SIZE, region_index, regions, reference)
+        for site_docs, genotype_docs, record_count in workflow_metrics.time_iter("parse", chunks):
+            workflow_metrics.inc("records_read", record_count)
+            yield site_docs, genotype_docs, record_count
+        workflow_metrics.finish_reading()
+
+    def annotate_stage(site_chunk):
+        site_docs, genotype_docs, record_count = site_chunk
+        return site_docs, genotype_docs, record_count, client.annotate_variant_docs(site_docs)
+
+    def assess_stage(annotated_chunk):
+        site_docs, genotype_docs, record_count, annotations = annotated_chunk
+        found_sites = assess_annotated_docs(site_docs, annotations, classifier)
+        found_ids = {variant_site_id(site_doc) for site_doc in found_sites}
+        return found_sites, [g for g in genotype_docs if g["site_id"] in found_ids], record_count, len(site_docs)
+
+    def write_stage(assessed_chunk):
+        found_sites, genotype_docs, record_count, site_count = assessed_chunk
+        site_writer.add(found_sites) # 先寫位點，基因型文件參照的位點一定存在
+        genotype_writer.add(genotype_docs)
+        counts["records"] += record_count
+        counts["sites"] += site_count
+        workflow_metrics.inc("records_done", record_count)
+        counts["found"] += len(found_sites)
+
+    stages = [
+        PipelineStage("annotate", annotate_stage, PIPELINE_ANNOTATE_WORKERS),
+        PipelineStage("assess", assess_stage, PIPELINE_ASSESS_WORKERS),
+        PipelineStage("write", write_stage, PIPELINE_WRITE_WORKERS, ordered=True),
+    ]
+    staged = StagedPipeline(parse_chunks(), stages, metrics=workflow_metrics)
+    staged.run()
+    try:
+        site_writer.flush()
+        genotype_writer.flush()
+    except pymongo.errors.PyMongoError as e:
+        logging.error(f"批量寫入 MongoDB 時發生錯誤: {e}")
+        return False
+    if staged.source_error is not None:
+        # 例如未排序或格式錯誤的 VCF: 已寫入的位點只涵蓋錯誤之前的記錄
+        logging.error(f"世代註釋失敗: 合併 VCF 時發生錯誤，只處理了 {counts['records']} 筆記錄，結果不完整 "
+                      f"({type(staged.source_error).__name__}: {staged.source_error})")
+        return False
+    failed = sum(stage.errors for stage in stages)
+    if failed:
+        logging.error(f"世代註釋失敗: {failed} 個 chunk 處理失敗，結果不完整。")
+        return False
+
+    logging.info(f"世代註釋完成: {len(vcf_paths)} 個 VCF 共 {counts['records']} 筆變異記錄，合併為 {counts['sites']} 個獨特位點 "
+                 f"({counts['found']} 個有註釋)。已寫入 {site_writer.written_count} 個位點與 "
+                 f"{genotype_writer.written_count} 個基因型文件。")
+    logging.info(f"MyVariant.info 網路請求次數: {client.request_count}")
+    if client.cache is not None:
+        logging.info(client.cache.summary())
+    if isinstance(client, LocalAnnotationStore):
+        logging.info(client.summary())
+    logging.info(workflow_metrics.summary())
+    logging.info(f"位點: '{DB_NAME}.{SITE_COLLECTION_NAME}'，基因型: '{DB_NAME}.{GENOTYPE_COLLECTION_NAME}' (以 site_id 參照)。")
+    return True
+
+# --- 重新分類 (不重新註釋) ---
+RECLASSIFY_FIELDS = ("pathogenicity_assessment", "pathogenicity_evidence", "pathogenicity_evidence_codes",
+                     "relevant_to_lung_adenocarcinoma")
+
+def reclassify_batch(stored_docs, classifier, annotation_collection=None):
+    """
+    以目前的規則重新評估一批已儲存的文件 (完整文件內嵌註釋，slim 文件以 myvariant_id 從 annotation_collection 批次取回)。
+    回傳 (評估結果有變更的 UpdateOne 列表, 結果相同只需記錄版本的 _id 列表, 評級轉變 Counter, 缺少註釋的 _id 列表)。
+    目前分類器不產生的欄位 (例如 legacy 的 pathogenicity_evidence_codes、"reported" 模式下未列入報告評級的
+    pathogenicity_evidence) 以 $unset 移除，不會留下前一版規則的舊值。
+    """
+    annotations = {}
+    slim_ids = [doc["myvariant_id"] for doc in stored_docs
+                if "annotation_myvariant_info" not in doc and doc.get("myvariant_id")]
+    if slim_ids and annotation_collection is not None:
+        annotations = {anno["_id"]: anno for anno in annotation_collection.find({"_id": {"$in": slim_ids}})}
+
+    reassessed = []
+    missing_ids = []
+    for stored in stored_docs:
+        myvariant_anno = stored.get("annotation_myvariant_info") or annotations.get(stored.get("myvariant_id"))
+        if not myvariant_anno:
+            missing_ids.append(stored["_id"])
+            continue
+        reassessed.append((stored, {"annotation_myvariant_info": myvariant_anno}))
+    classify_annotated_docs([work for _, work in reassessed], classifier)
+
+    updates, unchanged_ids, transitions = [], [], Counter()
+    for stored, work in reassessed:
+        changed = {field: work[field] for field in RECLASSIFY_FIELDS if field in work and stored.get(field) != work[field]}
+        stale = {field: "" for field in RECLASSIFY_FIELDS if field not in work and field in stored}
+        if changed or stale:
+            changed["pathogenicity_ruleset"] = work["pathogenicity_ruleset"]
+            update = {"$set": changed}
+            if stale:
+                update["$unset"] = stale
+            updates.append(UpdateOne({"_id": stored["_id"]}, update))
+            transitions[(stored.get("pathogenicity_assessment"), work["pathogenicity_assessment"])] += 1
+        else:
+            unchanged_ids.append(stored["_id"])
+    return updates, unchanged_ids, transitions, missing_ids
+
+def run_reclassification_workflow(collection_name=None, force=False):
+    """
+    以目前的規則、閾值、基因面板與 HPO terms 重新評估 collection 中已儲存的註釋，不呼叫註釋 API。
+    只讀取 pathogenicity_ruleset 與目前版本不同的文件 (force 時讀取全部)，分批串流；
+    評估結果改變的文件以無序 bulk_write 更新，結果相同的文件只以一次 update_many 記錄新版本。
+    缺少註釋的文件同樣記錄版本，之後的增量執行不會重複讀取。已處理的文件會帶有目前版本，因此中斷後重新執行會從未處理的文件繼續。
+    註釋服務的文件 (帶有 job_id) 以各工作自訂的基因面板與 HPO terms 評估，不會以預設面板重新分類而被略過。
+    """
+    collection = get_mongo_collection()
+    if collection is None:
+        logging.error("無法初始化 MongoDB Collection，退出。")
+        return None
+    if collection_name:
+        collection = collection.database[collection_name]
+    annotation_collection = collection.database[ANNOTATION_COLLECTION_NAME]
+    try:
+        classifier = build_pathogenicity_classifier(LUNG_ADENOCARCINOMA_GENE_PANEL, LUNG_ADENOCARCINOMA_HPO_TERMS)
+    except ValueError as e:
+        logging.error(f"{e}，退出。")
+        return None
+    if classifier is not None:
+        ruleset_version = classifier.ruleset_version
+    else:
+        ruleset_version = pathogenicity_ruleset_version(LUNG_ADENOCARCINOMA_GENE_PANEL, LUNG_ADENOCARCINOMA_HPO_TERMS,
+                                                        classifier="legacy")
+    query = {"job_id": {"$exists": False}}
+    if not force:
+        query["pathogenicity_ruleset"] = {"$ne": ruleset_version}
+    projection = dict.fromkeys(RECLASSIFY_FIELDS + ("annotation_myvariant_info", "myvariant_id", "pathogenicity_ruleset"), 1)
+    logging.info(f"重新分類 '{collection.name}': 規則版本 {ruleset_version}" + (" (全部文件)" if force else " (只處理過時的文件)"))
+
+    stats = Counter(dict.fromkeys(("scanned", "changed", "unchanged", "missing_annotation"), 0))
+    transitions = Counter()
+    started = last_report = time.monotonic()
+    cursor = collection.find(query, projection, batch_size=RECLASSIFY_BATCH_SIZE)
+    try:
+        while True:
+            batch = list(itertools.islice(cursor, RECLASSIFY_BATCH_SIZE))
+            if not batch:
+                break
+            batch_started = time.perf_counter()
+            updates, unchanged_ids, batch_transitions, missing_ids = reclassify_batch(batch, classifier, annotation_collection)
+            if updates:
+                collection.bulk_write(updates, ordered=False)
+            if unchanged_ids or missing_ids:
+                collection.update_many({"_id": {"$in": unchanged_ids + missing_ids}},
+                                       {"$set": {"pathogenicity_ruleset": ruleset_version}})
+            workflow_metrics.observe("reclassify", time.perf_counter() - batch_started)
+            stats.update(scanned=len(batch), changed=len(updates), unchanged=len(unchanged_ids),
+                         missing_annotation=len(missing_ids))
+            transitions.update(batch_transitions)
+            if time.monotonic() - last_report >= PIPELINE_REPORT_INTERVAL_SECONDS:
+                last_report = time.monotonic()
+                logging.info(f"重新分類進度: 已檢查 {stats['scanned']}，已更新 {stats['changed']}。")
+    except pymongo.errors.PyMongoError as e:
+        logging.error(f"重新分類時發生 MongoDB 錯誤 (已完成的批次會保留，重新執行即可繼續): {e}")
+    finally:
+        cursor.close()
+
+    logging.info(f"重新分類完成 ({time.monotonic() - started:.1f} 秒): 檢查 {stats['scanned']} 份文件，"
+                 f"{stats['changed']} 份評估結果改變並已更新，{stats['unchanged']} 份只記錄新版本，"
+                 f"{stats['missing_annotation']} 份缺少註釋而只記錄版本。")
+    for (before, after), count in transitions.most_common():
+        if before != after:
+            logging.info(f"  {before} -> {after}: {count}")
+    return dict(stats, ruleset_version=ruleset_version)
+
 
 if __name__ == "__main__":
     import os # Required for os.path.exists
+    import argparse
+
+    # 命令列參數覆寫設定區塊中的預設值
+    arg_parser = argparse.ArgumentParser(description="VCF 註釋與 MongoDB 儲存工作流程")
+    arg_parser.add_argument("--vcf", default=VCF_FILE_PATH, help="VCF 檔案路徑 (預設: %(default)s)")
+    arg_parser.add_argument("--parser", choices=["pyvcf", "fast"], default=VCF_PARSER_BACKEND, help="VCF 解析後端")
+    arg_parser.add_argument("--workers", type=int, default=VCF_PARSE_WORKERS,
+                            help="平行解壓縮與解析 BGZF VCF 的行程數 (大於 1 時使用 fast 後端)")
+    arg_parser.add_argument("--resume", action="store_true", default=RESUME_RUN,
+                            help="從上次寫入成功的檢查點續跑，跳過已完成的變異")
+    arg_parser.add_argument("--run-id", default=RUN_ID, help="檢查點識別碼 (預設為 VCF 檔案的絕對路徑)")
+    arg_parser.add_argument("--annotations", choices=["myvariant", "local"], default=ANNOTATION_BACKEND,
+                            help="註釋來源: MyVariant.info API 或本地離線資料庫")
+    arg_parser.add_argument("--local-db", default=LOCAL_ANNOTATION_DB_PATH, help="本地註釋資料庫路徑")
+    arg_parser.add_argument("--cohort", nargs="+", default=COHORT_VCF_PATHS, metavar="VCF",
+                            help="世代模式: 合併多個已排序的 VCF，每個獨特位點只註釋一次")
+    arg_parser.add_argument("--reference", default=REFERENCE_FASTA_PATH,
+                            help="參考基因組 FASTA，用於插入/刪除變異左對齊 (需要 pysam)")
+    arg_parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                            help="在此埠提供 Prometheus /metrics 端點 (需要 prometheus_client)")
+    arg_parser.add_argument("--log-sample-every", type=int, default=VARIANT_LOG_SAMPLE_EVERY, metavar="N",
+                            help="每 N 個變異以 INFO 記錄一次註釋日誌 (預設只在 DEBUG 等級記錄)")
+    arg_parser.add_argument("--report", default=REPORT_OUTPUT_PATH, metavar="PATH",
+                            help="將報告串流寫入檔案 (.html 或 .json)，預設輸出到控制台")
+    arg_parser.add_argument("--report-format", choices=sorted(REPORT_WRITERS), default=REPORT_FORMAT)
+    arg_parser.add_argument("--report-sort", choices=sorted(REPORT_SORT_KEYS), default=REPORT_SORT)
+    arg_parser.add_argument("--report-page", type=int, default=REPORT_PAGE)
+    arg_parser.add_argument("--report-page-size", type=int, default=REPORT_PAGE_SIZE)
+    arg_parser.add_argument("--group-by-gene", action="store_true", default=REPORT_GROUP_BY_GENE,
+                            help="報告依基因分組")
+    arg_parser.add_argument("--report-only", action="store_true",
+                            help="只從已儲存的變異產生報告，不執行註釋")
+    arg_parser.add_argument("--reclassify", nargs="?", const=COLLECTION_NAME, metavar="COLLECTION",
+                            help="以目前的規則重新評估已儲存的註釋 (預設 collection: %(const)s)，不重新註釋")
+    arg_parser.add_argument("--reclassify-all", action="store_true",
+                            help="重新分類時也檢查已是目前規則版本的文件")
+    cli_args = arg_parser.parse_args()
+    REPORT_OUTPUT_PATH = cli_args.report
+    REPORT_FORMAT = cli_args.report_format
+    REPORT_SORT = cli_args.report_sort
+    REPORT_PAGE = cli_args.report_page
+    REPORT_PAGE_SIZE = cli_args.report_page_size
+    REPORT_GROUP_BY_GENE = cli_args.group_by_gene
+    METRICS_PORT = cli_args.metrics_port
+    VARIANT_LOG_SAMPLE_EVERY = cli_args.log_sample_every
+    RESUME_RUN = cli_args.resume
+    RUN_ID = cli_args.run_id
+    ANNOTATION_BACKEND = cli_args.annotations
+    LOCAL_ANNOTATION_DB_PATH = cli_args.local_db
+    REFERENCE_FASTA_PATH = cli_args.reference
+    COHORT_VCF_PATHS = cli_args.cohort
+    VCF_FILE_PATH = cli_args.vcf
+    VCF_PARSER_BACKEND = cli_args.parser
+    VCF_PARSE_WORKERS = max(1, cli_args.workers)
 
     # 提醒使用者替換連接字串和 VCF 檔案
     if MONGO_URI == "YOUR_MONGODB_ATLAS_CONNECTION_STRING": # Ensure this default string is different if you have a real one set
         logging.error("請在程式碼中替換為您的 MongoDB Atlas 連接字串。")
+    elif cli_args.reclassify:
+        run_reclassification_workflow(cli_args.reclassify, force=cli_args.reclassify_all)
+    elif cli_args.report_only:
+        report_collection = get_mongo_collection()
+        if report_collection is None:
+            logging.error("無法初始化 MongoDB Collection，退出。")
+        else:
+            write_workflow_report(report_collection)
+    elif COHORT_VCF_PATHS:
+        missing_paths = [path for path in COHORT_VCF_PATHS if not os.path.exists(path)]
+        if missing_paths:
+            logging.error(f"找不到 VCF 檔案: {', '.join(missing_paths)}")
+        else:
+            if not run_cohort_workflow(COHORT_VCF_PATHS):
+                sys.exit(1)
     elif not VCF_FILE_PATH:
         logging.error("請提供 VCF 檔案路徑。")
     else:
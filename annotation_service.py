@@ -0,0 +1,446 @@
+import argparse
+import asyncio
+import functools
+import gzip
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pymongo
+import tornado.iostream
+import tornado.locks
+import tornado.web
+
+import annotate_vcf_advanced as pipeline
+
+# 常駐註釋服務 (供 gene_demo.html 使用)
+# 用法:
+#   python annotation_service.py --port 8888 --mongo-uri "mongodb://localhost:27017"
+#   然後以瀏覽器開啟 http://127.0.0.1:8888/ (由服務提供 gene_demo.html，上傳後即以真實流程註釋)
+# 模組匯入、MongoDB 連線池、MyVariant.info HTTP 連線池/限速器與註釋快取 (或本地註釋資料庫) 只在啟動時建立一次，
+# 之後每個上傳的 VCF 作為一個工作排入有界佇列，由固定數量的工作執行緒處理，進度以 SSE 串流到頁面。
+#
+# API:
+#   GET  /api/panels                       可選的基因面板與預設 HPO terms
+#   POST /api/jobs                         multipart: vcf (檔案)、hpo_terms (逗號分隔)、panel 或 genes (逗號分隔)
+#   GET  /api/jobs/<id>                    工作狀態
+#   GET  /api/jobs/<id>/events             進度事件 (text/event-stream)
+#   GET  /api/jobs/<id>/report?format=html|json&page=1&page_size=200&group_by_gene=1
+
+# --- 服務設定 ---
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8888
+SERVICE_JOB_WORKERS = 2 # 同時執行的工作數；每個工作內部仍依 PIPELINE_* 設定並行註釋
+SERVICE_QUEUE_SIZE = 8 # 等待中的工作上限，佇列已滿時回應 503
+SERVICE_MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+SERVICE_UPLOAD_DIR = "service_uploads"
+SERVICE_COLLECTION_NAME = "service_job_variants" # 服務工作的變異文件 (以 job_id 區分)
+SERVICE_MAX_JOBS_KEPT = 50 # 保留最近的工作結果；超過時刪除最舊已完成工作的文件
+SERVICE_REPORT_PAGE_SIZE = 200
+SERVICE_SSE_KEEPALIVE_SECONDS = 15
+SERVICE_DEMO_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gene_demo.html")
+GENE_PANELS = {
+    "lung_adenocarcinoma": pipeline.LUNG_ADENOCARCINOMA_GENE_PANEL,
+}
+DEFAULT_GENE_PANEL = "lung_adenocarcinoma"
+
+
+def is_vcf_upload(filename, body):
+    """
+    檢查上傳內容是否以 VCF 規範要求的 ##fileformat=VCF 開頭 (.gz 只解壓縮開頭)，在排入佇列前拒絕錯誤的檔案。
+    """
+    try:
+        if filename.endswith(".gz"):
+            with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+                head = f.read(64)
+        else:
+            head = body[:64]
+    except (OSError, EOFError):
+        return False
+    return head.startswith(b"##fileformat=VCF")
+
+
+class AnnotationJob:
+    """
+    單一分析工作的參數、狀態與進度事件。events 與 status 只在 IOLoop 執行緒中修改，
+    工作執行緒透過 AnnotationService.publish_threadsafe 傳遞事件。
+    """
+    def __init__(self, job_id, vcf_name, vcf_path, hpo_terms, panel_name, gene_panel):
+        self.id = job_id
+        self.vcf_name = vcf_name
+        self.vcf_path = vcf_path
+        self.hpo_terms = hpo_terms
+        self.panel_name = panel_name
+        self.gene_panel = gene_panel
+        self.status = "queued"
+        self.events = []
+        self.changed = tornado.locks.Condition()
+        self.created_at = time.time()
+        self.finished_at = None
+        self.summary = {}
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def to_dict(self):
+        return {"job_id": self.id, "status": self.status, "vcf": self.vcf_name, "hpo_terms": self.hpo_terms,
+                "panel": self.panel_name, "summary": self.summary,
+                "elapsed_seconds": round((self.finished_at or time.time()) - self.created_at, 3)}
+
+    def publish(self, event):
+        if event.get("type") in ("done", "error"):
+            self.status = event["type"]
+            self.finished_at = time.time()
+        elif event.get("type") == "running":
+            self.status = "running"
+        if "summary" in event:
+            self.summary = event["summary"]
+        self.events.append(dict(event, job_id=self.id, status=self.status))
+        self.changed.notify_all()
+
+
+class AnnotationService:
+    """
+    常駐的工作佇列: asyncio.Queue (有界) 加上 SERVICE_JOB_WORKERS 個協程，每個協程把工作交給執行緒池執行。
+    MongoDB collection、註釋客戶端 (HTTP 連線池、限速器、快取) 與區域索引/參考基因組在所有工作間共用。
+    """
+    def __init__(self, collection, annotation_collection, inputs, workers=SERVICE_JOB_WORKERS,
+                 queue_size=SERVICE_QUEUE_SIZE, upload_dir=SERVICE_UPLOAD_DIR, max_jobs=SERVICE_MAX_JOBS_KEPT):
+        self.collection = collection
+        self.annotation_collection = annotation_collection
+        self.region_index, self.regions, self.reference, self.client, _ = inputs
+        self.workers = workers
+        self.queue_size = queue_size
+        self.upload_dir = upload_dir
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.job_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="annotation-job")
+        # 報告與清理使用獨立的執行緒池，不必排在執行中的註釋工作後面
+        self.query_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="annotation-query")
+        self.loop = None
+        self.queue = None
+
+    def start(self):
+        """
+        在 IOLoop 中啟動工作協程 (必須在事件迴圈執行中呼叫)。
+        """
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        os.makedirs(self.upload_dir, exist_ok=True)
+        for _ in range(self.workers):
+            self.loop.create_task(self._worker())
+
+    def submit(self, vcf_name, body, hpo_terms, panel_name, gene_panel):
+        """
+        儲存上傳的 VCF 並排入佇列；佇列已滿時拋出 asyncio.QueueFull。
+        """
+        if self.queue.full():
+            raise asyncio.QueueFull()
+        job_id = uuid.uuid4().hex[:12]
+        suffix = ".vcf.gz" if vcf_name.endswith(".gz") else ".vcf"
+        vcf_path = os.path.join(self.upload_dir, job_id + suffix)
+        with open(vcf_path, "wb") as f:
+            f.write(body)
+        job = AnnotationJob(job_id, vcf_name, vcf_path, hpo_terms, panel_name, gene_panel)
+        self.jobs[job_id] = job
+        self.queue.put_nowait(job)
+        job.publish({"type": "queued", "position": self.queue.qsize()})
+        logging.info(f"工作 {job_id} 已排入佇列: '{vcf_name}' ({len(body)} bytes)，面板 {panel_name}。")
+        return job
+
+    def publish_threadsafe(self, job, event):
+        self.loop.call_soon_threadsafe(job.publish, event)
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            job.publish({"type": "running"})
+            try:
+                summary = await self.loop.run_in_executor(self.job_executor, self.run_job, job)
+                job.publish({"type": "done", "summary": summary})
+                logging.info(f"工作 {job.id} 完成: {summary}")
+            except Exception as e:
+                logging.error(f"工作 {job.id} 失敗 ({type(e).__name__}): {e}")
+                job.publish({"type": "error", "message": f"{type(e).__name__}: {e}"})
+            finally:
+                try:
+                    os.remove(job.vcf_path)
+                except OSError:
+                    pass
+                self.queue.task_done()
+                self._evict_old_jobs()
+
+    def run_job(self, job):
+        """
+        在工作執行緒中執行: 解析 -> 註釋 -> 評估 -> 寫入 (與 run_annotation_workflow 相同的管線階段)，
+        以工作的 HPO terms 與基因面板及 PATHOGENICITY_CLASSIFIER 設定的分類器評估，文件帶有 job_id 並以 "job_id:變異 _id" 寫入。
+        """
+        started = time.perf_counter()
+        classifier = pipeline.build_pathogenicity_classifier(job.gene_panel, job.hpo_terms)
+        writer = pipeline.MongoVariantWriter(
+            self.collection, self.annotation_collection, pipeline.MONGO_WRITE_BATCH_SIZE, pipeline.MONGO_WRITE_MODE,
+            pipeline.MONGO_BULK_WRITE_CONCERN, document_id=lambda doc: f"{job.id}:{pipeline.variant_document_id(doc)}",
+        )
+        counts = {"records": 0, "variants": 0, "annotated": 0}
+
+        def annotate_stage(doc_chunk):
+            chunk_docs, records_done, _ = doc_chunk
+            return chunk_docs, records_done, self.client.annotate_variant_docs(chunk_docs)
+
+        def assess_stage(annotated_chunk):
+            chunk_docs, records_done, annotations = annotated_chunk
+            found = pipeline.assess_annotated_docs(chunk_docs, annotations, classifier, job.gene_panel, job.hpo_terms)
+            for variant_doc in found:
+                variant_doc["job_id"] = job.id
+            return found, records_done, len(chunk_docs)
+
+        def write_stage(assessed_chunk):
+            found, records_done, variant_count = assessed_chunk
+            writer.add(found)
+            counts["records"] = records_done
+            counts["variants"] += variant_count
+            counts["annotated"] += len(found)
+            self.publish_threadsafe(job, dict(counts, type="progress"))
+
+        stages = [
+            pipeline.PipelineStage("annotate", annotate_stage, pipeline.PIPELINE_ANNOTATE_WORKERS),
+            pipeline.PipelineStage("assess", assess_stage, pipeline.PIPELINE_ASSESS_WORKERS),
+            pipeline.PipelineStage("write", write_stage, pipeline.PIPELINE_WRITE_WORKERS, ordered=True),
+        ]
+        source = pipeline.iter_variant_doc_chunks(job.vcf_path, pipeline.VCF_CHUNK_SIZE, self.region_index,
+                                                  self.regions, reference=self.reference)
+        staged = pipeline.StagedPipeline(source, stages)
+        staged.run()
+        writer.flush()
+        if staged.source_error is not None:
+            raise ValueError(f"無法解析 VCF: {staged.source_error}")
+        failed = sum(stage.errors for stage in stages)
+        if failed:
+            raise RuntimeError(f"{failed} 個 chunk 處理失敗，結果不完整")
+        pathogenic = self.collection.count_documents(
+            {"job_id": job.id, "pathogenicity_assessment": {"$in": list(pipeline.REPORT_CLASSIFICATIONS)}})
+        return dict(counts, written=writer.written_count, pathogenic=pathogenic,
+                    seconds=round(time.perf_counter() - started, 3))
+
+    def render_report(self, job, report_format, page, page_size, group_by_gene):
+        """
+        以串流報告產生此工作的一頁報告 (在查詢執行緒中執行，頁面大小限制了回應的記憶體用量)。
+        """
+        stream = io.StringIO()
+        pipeline.write_variant_report(self.collection, stream, job.vcf_name, job.hpo_terms, report_format,
+                                      group_by_gene=group_by_gene, page=page, page_size=page_size,
+                                      match={"job_id": job.id})
+        return stream.getvalue()
+
+    def _evict_old_jobs(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job.id]
+            future = self.loop.run_in_executor(self.query_executor, self.collection.delete_many, {"job_id": job.id})
+            future.add_done_callback(functools.partial(self._log_eviction_failure, job.id))
+
+    @staticmethod
+    def _log_eviction_failure(job_id, future):
+        if not future.cancelled() and future.exception() is not None:
+            error = future.exception()
+            logging.error(f"刪除工作 {job_id} 的文件時發生錯誤 ({type(error).__name__}): {error}")
+
+
+class ServiceHandler(tornado.web.RequestHandler):
+    def initialize(self, service):
+        self.service = service
+
+    def write_json(self, payload, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps(payload, ensure_ascii=False))
+
+    def get_job(self, job_id):
+        job = self.service.jobs.get(job_id)
+        if job is None:
+            raise tornado.web.HTTPError(404, reason="Job not found")
+        return job
+
+
+class PanelsHandler(ServiceHandler):
+    def get(self):
+        self.write_json({"panels": GENE_PANELS, "default_panel": DEFAULT_GENE_PANEL,
+                         "default_hpo_terms": pipeline.LUNG_ADENOCARCINOMA_HPO_TERMS})
+
+
+class JobsHandler(ServiceHandler):
+    def post(self):
+        uploads = self.request.files.get("vcf")
+        if not uploads:
+            return self.write_json({"error": "缺少 vcf 檔案"}, 400)
+        upload = uploads[0]
+        if not upload.filename.endswith((".vcf", ".vcf.gz")):
+            return self.write_json({"error": "只接受 .vcf 或 .vcf.gz 檔案"}, 400)
+        if not is_vcf_upload(upload.filename, upload.body):
+            return self.write_json({"error": "檔案內容不是有效的 VCF (缺少 ##fileformat 標頭)"}, 400)
+        hpo_terms = [t.strip() for t in self.get_body_argument("hpo_terms", "").split(",") if t.strip()]
+        hpo_terms = hpo_terms or list(pipeline.LUNG_ADENOCARCINOMA_HPO_TERMS)
+        custom_genes = [g.strip().upper() for g in self.get_body_argument("genes", "").split(",") if g.strip()]
+        panel_name = "custom" if custom_genes else self.get_body_argument("panel", DEFAULT_GENE_PANEL)
+        if not custom_genes and panel_name not in GENE_PANELS:
+            return self.write_json({"error": f"未知的基因面板: {panel_name}"}, 400)
+        gene_panel = custom_genes or GENE_PANELS[panel_name]
+        try:
+            job = self.service.submit(os.path.basename(upload.filename), upload.body, hpo_terms, panel_name, gene_panel)
+        except asyncio.QueueFull:
+            self.set_header("Retry-After", "10")
+            return self.write_json({"error": "工作佇列已滿，請稍後再試"}, 503)
+        payload = job.to_dict()
+        payload.update(status_url=f"/api/jobs/{job.id}", events_url=f"/api/jobs/{job.id}/events",
+                       report_url=f"/api/jobs/{job.id}/report")
+        self.write_json(payload, 202)
+
+
+class JobHandler(ServiceHandler):
+    def get(self, job_id):
+        self.write_json(self.get_job(job_id).to_dict())
+
+
+class JobEventsHandler(ServiceHandler):
+    async def get(self, job_id):
+        job = self.get_job(job_id)
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        sent = 0
+        try:
+            while True:
+                while sent < len(job.events):
+                    self.write(f"data: {json.dumps(job.events[sent], ensure_ascii=False)}\n\n")
+                    sent += 1
+                if job.finished and sent == len(job.events):
+                    break
+                await self.flush()
+                if sent < len(job.events):
+                    continue # flush 期間發佈的事件 (例如 done) 已錯過 notify，不能再等待
+                if not await job.changed.wait(timeout=timedelta(seconds=SERVICE_SSE_KEEPALIVE_SECONDS)):
+                    self.write(": keepalive\n\n")
+            self.finish()
+        except tornado.iostream.StreamClosedError:
+            pass # 瀏覽器已關閉連線，工作仍繼續執行
+
+
+class JobReportHandler(ServiceHandler):
+    async def get(self, job_id):
+        job = self.get_job(job_id)
+        if job.status != "done":
+            return self.write_json({"error": f"工作尚未完成 (狀態: {job.status})"}, 409)
+        report_format = self.get_query_argument("format", "html")
+        if report_format not in pipeline.REPORT_WRITERS:
+            return self.write_json({"error": f"不支援的報告格式: {report_format}"}, 400)
+        try:
+            page = int(self.get_query_argument("page", "1"))
+            page_size = int(self.get_query_argument("page_size", str(SERVICE_REPORT_PAGE_SIZE)))
+        except ValueError:
+            return self.write_json({"error": "page 與 page_size 必須是整數"}, 400)
+        group_by_gene = self.get_query_argument("group_by_gene", "0") in ("1", "true")
+        body = await asyncio.get_running_loop().run_in_executor(
+            self.service.query_executor, self.service.render_report, job, report_format, page,
+            max(1, min(page_size, 5000)), group_by_gene)
+        content_type = "application/json" if report_format == "json" else "text/html"
+        self.set_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.finish(body)
+
+
+class DemoPageHandler(tornado.web.RequestHandler):
+    def get(self):
+        with open(SERVICE_DEMO_PAGE, encoding="utf-8") as f:
+            self.set_header("Content-Type", "text/html; charset=utf-8")
+            self.finish(f.read())
+
+
+def make_app(service):
+    handler_args = {"service": service}
+    return tornado.web.Application([
+        (r"/", DemoPageHandler),
+        (r"/gene_demo\.html", DemoPageHandler),
+        (r"/api/panels", PanelsHandler, handler_args),
+        (r"/api/jobs", JobsHandler, handler_args),
+        (r"/api/jobs/(\w+)", JobHandler, handler_args),
+        (r"/api/jobs/(\w+)/events", JobEventsHandler, handler_args),
+        (r"/api/jobs/(\w+)/report", JobReportHandler, handler_args),
+    ])
+
+
+def create_service(args):
+    """
+    建立共用資源 (MongoDB collection、註釋客戶端、分類所需輸入) 並回傳 AnnotationService；失敗時回傳 None。
+    """
+    collection = pipeline.get_mongo_collection()
+    if collection is None:
+        return None
+    database = collection.database
+    service_collection = database[SERVICE_COLLECTION_NAME]
+    if pipeline.MONGO_CREATE_INDEXES:
+        pipeline.ensure_variant_indexes(service_collection, [
+            [("job_id", pymongo.ASCENDING), ("pathogenicity_assessment", pymongo.ASCENDING)],
+        ])
+    annotation_collection = None
+    if pipeline.MONGO_STORAGE_MODE == "slim":
+        annotation_collection = database[pipeline.ANNOTATION_COLLECTION_NAME]
+    inputs = pipeline.prepare_workflow_inputs()
+    if inputs is None:
+        return None
+    client = inputs[3]
+    pipeline.workflow_metrics.reset(cache=getattr(client, "cache", None))
+    if pipeline.METRICS_PORT:
+        pipeline.start_metrics_server(pipeline.METRICS_PORT, pipeline.METRICS_ADDR)
+    return AnnotationService(service_collection, annotation_collection, inputs, args.workers, args.queue_size,
+                             args.upload_dir)
+
+
+async def serve(service, host, port):
+    service.start()
+    make_app(service).listen(port, address=host, max_body_size=SERVICE_MAX_UPLOAD_BYTES)
+    logging.info(f"註釋服務執行中: http://{host}:{port}/ (工作執行緒 {service.workers}，佇列上限 {service.queue_size})")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常駐 VCF 註釋服務 (gene_demo.html 後端)")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_JOB_WORKERS, help="同時執行的工作數")
+    parser.add_argument("--queue-size", type=int, default=SERVICE_QUEUE_SIZE, help="等待中的工作上限")
+    parser.add_argument("--upload-dir", default=SERVICE_UPLOAD_DIR, help="暫存上傳 VCF 的目錄")
+    parser.add_argument("--mongo-uri", default=os.environ.get("MONGO_URI", pipeline.MONGO_URI),
+                        help="MongoDB 連接字串 (預設讀取 MONGO_URI 環境變數)")
+    parser.add_argument("--db", default=pipeline.DB_NAME, help="資料庫名稱 (預設: %(default)s)")
+    parser.add_argument("--annotations", choices=["myvariant", "local"], default=pipeline.ANNOTATION_BACKEND,
+                        help="註釋來源: MyVariant.info API 或本地離線資料庫")
+    parser.add_argument("--local-db", default=pipeline.LOCAL_ANNOTATION_DB_PATH, help="本地註釋資料庫路徑")
+    parser.add_argument("--reference", default=pipeline.REFERENCE_FASTA_PATH, help="參考基因組 FASTA (需要 pysam)")
+    parser.add_argument("--metrics-port", type=int, default=pipeline.METRICS_PORT,
+                        help="在此埠提供 Prometheus /metrics 端點")
+    args = parser.parse_args()
+    pipeline.MONGO_URI = args.mongo_uri
+    pipeline.DB_NAME = args.db
+    pipeline.ANNOTATION_BACKEND = args.annotations
+    pipeline.LOCAL_ANNOTATION_DB_PATH = args.local_db
+    pipeline.REFERENCE_FASTA_PATH = args.reference
+    pipeline.METRICS_PORT = args.metrics_port
+
+    service = create_service(args)
+    if service is None:
+        logging.error("無法初始化註釋服務，退出。")
+        return 1
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,58 @@
+import argparse
+import logging
+import os
+
+import annotate_vcf_advanced as pipeline
+
+# 建立本地離線註釋資料庫 (取代 MyVariant.info API，讓整個流程以本地磁碟速度離線執行)
+# 用法:
+#   python build_annotation_store.py --db local_annotations.sqlite3 \
+#       --clinvar clinvar.vcf.gz \
+#       --gnomad-genome gnomad.genomes.sites.vcf.gz --gnomad-exome gnomad_exome_af.tsv \
+#       --dbnsfp dbNSFP4.4a_lung_panel.tsv.gz --reference GRCh38.fa
+#   然後以 python annotate_vcf_advanced.py --annotations local --local-db local_annotations.sqlite3 執行註釋流程
+# 每個來源可重複指定 (例如每條染色體一個檔案)；重新匯入同一變異時會覆寫該來源的舊資料。
+
+
+def main():
+    parser = argparse.ArgumentParser(description="將 ClinVar / gnomAD / dbNSFP 匯入本地註釋資料庫")
+    parser.add_argument("--db", default=pipeline.LOCAL_ANNOTATION_DB_PATH, help="SQLite 資料庫路徑 (預設: %(default)s)")
+    parser.add_argument("--clinvar", action="append", default=[], help="ClinVar VCF (使用 CLNSIG 與 GENEINFO)")
+    parser.add_argument("--gnomad-genome", action="append", default=[],
+                        help="gnomAD genome 位點 VCF (INFO AF) 或 TSV (chrom、pos、ref、alt、af)")
+    parser.add_argument("--gnomad-exome", action="append", default=[], help="gnomAD exome 位點 VCF 或 TSV")
+    parser.add_argument("--dbnsfp", action="append", default=[], help="dbNSFP 萃取 TSV")
+    parser.add_argument("--reference", default=pipeline.REFERENCE_FASTA_PATH,
+                        help="參考基因組 FASTA (需要 pysam)；請使用註釋 VCF 時的同一個檔案，匯入的變異才會與文件以相同方式左對齊")
+    args = parser.parse_args()
+
+    sources = args.clinvar + args.gnomad_genome + args.gnomad_exome + args.dbnsfp
+    if not sources:
+        parser.error("請至少指定一個要匯入的檔案")
+    missing = [path for path in sources if not os.path.exists(path)]
+    if missing:
+        parser.error(f"找不到檔案: {', '.join(missing)}")
+
+    reference = None
+    if args.reference:
+        try:
+            reference = pipeline.ReferenceGenome(args.reference)
+        except (ImportError, OSError, ValueError) as e:
+            parser.error(f"開啟參考基因組 '{args.reference}' 時發生錯誤 ({type(e).__name__}): {e}")
+
+    store = pipeline.LocalAnnotationStore(args.db, reference)
+    total = 0
+    for path in args.clinvar:
+        total += store.import_clinvar_vcf(path)
+    for path in args.gnomad_genome:
+        total += store.import_gnomad(path, "genome")
+    for path in args.gnomad_exome:
+        total += store.import_gnomad(path, "exome")
+    for path in args.dbnsfp:
+        total += store.import_dbnsfp(path)
+    logging.info(f"完成: 共匯入 {total} 筆記錄到 '{args.db}'。")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
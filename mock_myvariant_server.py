@@ -0,0 +1,198 @@
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+# 本地 MyVariant.info 替身伺服器 (無需網路即可驗證批次查詢與註釋流程)
+# 用法:
+#   python mock_myvariant_server.py --port 8765
+#   然後將 annotate_vcf_advanced.MYVARIANT_INFO_API_URL 設為 "http://127.0.0.1:8765/v1/variant/"
+#   python mock_myvariant_server.py --port 8765 --latency-ms 150 --rate-limit-ratio 0.05
+#   模擬公開 API 的往返延遲，並讓 5% 的請求回應 429 (Retry-After)，用於測試重試與限速行為
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- 預設的註釋資料 (對應 na12878_sample.vcf 與 __main__ 產生的測試 VCF) ---
+DEFAULT_ANNOTATIONS = {
+    "chr7:g.55249071C>T": {
+        "_id": "chr7:g.55249071C>T",
+        "clinvar": {"rcv": {"clinical_significance": "Pathogenic"}},
+        "gnomad_exome": {"af": 0.00001},
+        "ensembl": {"gene": {"symbol": "EGFR"}},
+        "dbnsfp": [{
+            "genecode": {"consequence": "missense_variant"},
+            "sift": {"score": 0.01},
+            "polyphen": {"score": 0.98},
+        }],
+    },
+    "chr12:g.25398284G>T": {
+        "_id": "chr12:g.25398284G>T",
+        "clinvar": {"rcv": [{"clinical_significance": "Likely pathogenic"}]},
+        "ensembl": {"gene": [{"symbol": "KRAS"}]},
+        "dbnsfp": [{
+            "genecode": [{"consequence": "missense_variant"}],
+            "interpro_domain": [{"description": "Small GTP-binding protein domain"}],
+        }],
+    },
+    "chr17:g.7674903C>A": {
+        "_id": "chr17:g.7674903C>A",
+        "clinvar": {"rcv": {"clinical_significance": "Uncertain significance"}},
+        "ensembl": {"gene": {"symbol": "TP53"}},
+        "dbnsfp": [{"genecode": {"consequence": "stop_gained"}}],
+    },
+    "chr1:g.10000A>G": {
+        "_id": "chr1:g.10000A>G",
+        "gnomad_genome": {"af": 0.12},
+        "ensembl": {"gene": {"symbol": "DDX11L1"}},
+    },
+}
+
+
+class MockMyVariantServer(ThreadingHTTPServer):
+    """
+    模擬 MyVariant.info 的 GET /v1/variant/<id> 與 POST /v1/variant 端點。
+    request_log 記錄每個請求的 (method, 查詢 ID 數量)，方便確認批次行為。
+    annotation_factory(variant_id) 為未收錄於 annotations 的 ID 產生註釋 (回傳 None 表示查無資料)；
+    每個請求先等待 latency_seconds，並以 rate_limit_ratio 的機率回應 429 (附 Retry-After: retry_after_seconds)。
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, annotations=None, annotation_factory=None, latency_seconds=0.0,
+                 rate_limit_ratio=0.0, retry_after_seconds=0.0, seed=None):
+        super().__init__(server_address, MockMyVariantHandler)
+        self.annotations = DEFAULT_ANNOTATIONS if annotations is None else annotations
+        self.annotation_factory = annotation_factory
+        self.latency_seconds = latency_seconds
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after_seconds = retry_after_seconds
+        self.rng = random.Random(seed)
+        self.request_log = []
+        self.rate_limited_count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/variant/"
+
+    def lookup(self, variant_id):
+        hit = self.annotations.get(variant_id)
+        if hit is None and self.annotation_factory is not None:
+            return self.annotation_factory(variant_id)
+        return json.loads(json.dumps(hit)) if hit is not None else None  # 回傳副本，避免呼叫端修改原始資料
+
+    def throttle(self):
+        """
+        模擬網路延遲與限速；回傳 True 表示此請求應回應 429。
+        """
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+        if self.rate_limit_ratio <= 0:
+            return False
+        with self.lock:
+            limited = self.rng.random() < self.rate_limit_ratio
+            if limited:
+                self.rate_limited_count += 1
+        return limited
+
+    def record_request(self, method, id_count):
+        with self.lock:
+            self.request_log.append((method, id_count))
+
+
+class MockMyVariantHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug("mock myvariant: " + format % args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _rate_limited(self):
+        if not self.server.throttle():
+            return False
+        self._send_json(429, {"success": False, "error": "Too many requests"},
+                        {"Retry-After": f"{self.server.retry_after_seconds:g}"})
+        return True
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        prefix = "/v1/variant/"
+        if not path.startswith(prefix):
+            self._send_json(404, {"success": False, "error": "Not found"})
+            return
+        variant_id = unquote(path[len(prefix):])
+        if self._rate_limited():
+            return
+        self.server.record_request("GET", 1)
+        hit = self.server.lookup(variant_id)
+        if hit is None:
+            self._send_json(404, {"success": False, "error": f"ID '{variant_id}' not found"})
+        else:
+            self._send_json(200, hit)
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/v1/variant":
+            self._send_json(404, {"success": False, "error": "Not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if self._rate_limited():
+            return
+        ids = [i.strip() for i in ",".join(form.get("ids", [])).split(",") if i.strip()]
+        if len(ids) > 1000:
+            self._send_json(400, {"success": False, "error": "Max number of ids is 1000"})
+            return
+        self.server.record_request("POST", len(ids))
+
+        results = []
+        for variant_id in ids:
+            hit = self.server.lookup(variant_id)
+            if hit is None:
+                results.append({"query": variant_id, "notfound": True})
+            else:
+                hit["query"] = variant_id
+                results.append(hit)
+        self._send_json(200, results)
+
+
+def start_mock_server(host="127.0.0.1", port=0, annotations=None, **options):
+    """
+    在背景執行緒啟動替身伺服器並回傳伺服器物件 (port=0 表示自動選擇可用埠)。
+    options 傳給 MockMyVariantServer (annotation_factory、latency_seconds、rate_limit_ratio 等)。
+    使用完畢後請呼叫 server.shutdown()。
+    """
+    server = MockMyVariantServer((host, port), annotations, **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.info(f"MyVariant.info 替身伺服器已啟動: {server.base_url}")
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本地 MyVariant.info 替身伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每個請求的模擬延遲 (毫秒)")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="回應 429 的請求比例 (0-1)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 回應的 Retry-After 秒數")
+    args = parser.parse_args()
+
+    server = MockMyVariantServer((args.host, args.port), latency_seconds=args.latency_ms / 1000,
+                                 rate_limit_ratio=args.rate_limit_ratio, retry_after_seconds=args.retry_after)
+    logging.info(f"MyVariant.info 替身伺服器執行中: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
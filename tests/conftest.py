@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# 專案模組位於儲存庫根目錄 (以腳本形式提供，未安裝為套件)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_myvariant_server import start_mock_server  # noqa: E402
+
+
+@pytest.fixture
+def make_server():
+    servers = []
+
+    def make(**options):
+        server = start_mock_server(port=0, **options)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,140 @@
+import sqlite3
+
+import pytest
+
+import annotate_vcf_advanced as pipeline
+
+FIELDS = "clinvar,gnomad_exome"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(pipeline.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def make_cache(tmp_path):
+    caches = []
+
+    def make(**options):
+        options.setdefault("ttl_seconds", 100)
+        options.setdefault("not_found_ttl_seconds", 10)
+        options.setdefault("max_bytes", 10 ** 9)
+        cache = pipeline.AnnotationCache(str(tmp_path / "cache.sqlite3"), **options)
+        caches.append(cache)
+        return cache
+
+    yield make
+    for cache in caches:
+        cache.close()
+
+
+def found(variant_id, padding=""):
+    return {"_id": variant_id, "clinvar": {"rcv": {"clinical_significance": "Pathogenic"}}, "note": padding}
+
+
+def not_found(variant_id):
+    return {"status": "not_found", "query": variant_id}
+
+
+def table_bytes(cache):
+    return cache.conn.execute("SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM annotations").fetchone()[0]
+
+
+def test_found_annotation_expires_after_ttl(make_cache, clock):
+    cache = make_cache()
+    cache.put_many([("chr7:g.1A>G", found("chr7:g.1A>G"))], FIELDS)
+
+    clock[0] += 99
+    assert cache.get_many(["chr7:g.1A>G"], FIELDS) == {"chr7:g.1A>G": found("chr7:g.1A>G")}
+    clock[0] += 2
+    assert cache.get_many(["chr7:g.1A>G"], FIELDS) == {}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_fields_are_part_of_the_key(make_cache, clock):
+    cache = make_cache()
+    cache.put_many([("chr7:g.1A>G", found("chr7:g.1A>G"))], FIELDS)
+
+    assert cache.get_many(["chr7:g.1A>G"], "clinvar") == {}
+
+
+def test_negative_cache_has_its_own_ttl_and_errors_are_not_cached(make_cache, clock):
+    cache = make_cache()
+    cache.put_many([
+        ("chr1:g.1A>G", not_found("chr1:g.1A>G")),
+        ("chr1:g.2A>G", {"status": "api_error", "query": "chr1:g.2A>G"}),
+        ("chr1:g.3A>G", found("chr1:g.3A>G")),
+    ], FIELDS)
+
+    hits = cache.get_many(["chr1:g.1A>G", "chr1:g.2A>G", "chr1:g.3A>G"], FIELDS)
+    assert hits["chr1:g.1A>G"]["status"] == "not_found"
+    assert "chr1:g.2A>G" not in hits
+    assert cache.negative_hits == 1
+
+    clock[0] += 11 # not_found 已過期，找到的註釋仍有效
+    assert set(cache.get_many(["chr1:g.1A>G", "chr1:g.3A>G"], FIELDS)) == {"chr1:g.3A>G"}
+
+
+def test_lru_eviction_keeps_recently_read_entries(make_cache, clock):
+    cache = make_cache()
+    padding = "x" * 2000
+    ids = [f"chr2:g.{i}A>G" for i in range(10)]
+    for variant_id in ids:
+        clock[0] += 1
+        cache.put_many([(variant_id, found(variant_id, padding + variant_id))], FIELDS)
+    entry_bytes = table_bytes(cache) / len(ids)
+    clock[0] += 1
+    cache.get_many([ids[0]], FIELDS) # 最舊的項目剛被讀取
+
+    cache.max_bytes = int(entry_bytes * 8.5)
+    clock[0] += 1
+    cache.put_many([("chr2:g.99A>G", found("chr2:g.99A>G", padding))], FIELDS)
+
+    remaining = set(cache.get_many(ids + ["chr2:g.99A>G"], FIELDS))
+    assert ids[0] in remaining and "chr2:g.99A>G" in remaining
+    assert ids[1] not in remaining and ids[2] not in remaining # 最久未使用的先被淘汰
+    assert cache.total_bytes <= cache.max_bytes * 0.9
+    assert cache.total_bytes == table_bytes(cache)
+
+
+def test_eviction_drops_expired_entries_first(make_cache, clock):
+    cache = make_cache()
+    cache.put_many([("chr3:g.1A>G", not_found("chr3:g.1A>G"))], FIELDS)
+    clock[0] += 50 # not_found 已過期
+    cache.put_many([(f"chr3:g.{i}A>G", found(f"chr3:g.{i}A>G")) for i in range(2, 6)], FIELDS)
+
+    cache.max_bytes = table_bytes(cache) - 1
+    clock[0] += 1
+    cache.put_many([("chr3:g.9A>G", found("chr3:g.9A>G"))], FIELDS)
+
+    assert cache.conn.execute("SELECT COUNT(*) FROM annotations WHERE not_found = 1").fetchone()[0] == 0
+    assert cache.total_bytes == table_bytes(cache)
+
+
+def test_running_total_tracks_overwrites_and_survives_reopen(make_cache, clock):
+    cache = make_cache()
+    cache.put_many([(f"chr4:g.{i}A>G", found(f"chr4:g.{i}A>G")) for i in range(20)], FIELDS)
+    cache.put_many([("chr4:g.1A>G", found("chr4:g.1A>G", "y" * 5000))], FIELDS) # 覆寫同一個鍵
+    cache.put_many([("chr4:g.2A>G", not_found("chr4:g.2A>G"))], FIELDS)
+    assert cache.total_bytes == table_bytes(cache)
+    cache.close()
+
+    reopened = make_cache()
+    assert reopened.total_bytes == table_bytes(reopened)
+
+
+def test_legacy_cache_file_gets_total_computed_once(tmp_path, make_cache):
+    conn = sqlite3.connect(tmp_path / "cache.sqlite3")
+    conn.execute("CREATE TABLE annotations (key TEXT PRIMARY KEY, payload BLOB NOT NULL, not_found INTEGER NOT NULL,"
+                 " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+    conn.execute("INSERT INTO annotations VALUES ('k', ?, 0, 1e12, 0)", (b"0123456789",))
+    conn.commit()
+    conn.close()
+
+    cache = make_cache()
+    assert cache.total_bytes == 10
+    cache.conn.execute("DELETE FROM annotations")
+    assert cache._stored_total_bytes() == 0
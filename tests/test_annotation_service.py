@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from unittest import mock
+
+import mongomock
+from tornado.testing import AsyncHTTPTestCase
+
+import annotate_vcf_advanced as pipeline
+import annotation_service as service_module
+from mock_myvariant_server import start_mock_server
+
+SAMPLE_VCF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "na12878_sample.vcf")
+
+
+def multipart_body(fields, filename, content):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="vcf"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+class AnnotationServiceTest(AsyncHTTPTestCase):
+    max_jobs = service_module.SERVICE_MAX_JOBS_KEPT
+
+    def setUp(self):
+        self.mock_server = start_mock_server(port=0)
+        self.client = pipeline.MyVariantInfoClient(api_url=self.mock_server.base_url, rate_per_second=0, max_retries=0)
+        self.upload_dir = tempfile.mkdtemp()
+        self.collection = mongomock.MongoClient().db[service_module.SERVICE_COLLECTION_NAME]
+        self.service = service_module.AnnotationService(self.collection, None, (None, None, None, self.client, None),
+                                                        workers=1, queue_size=2, upload_dir=self.upload_dir,
+                                                        max_jobs=self.max_jobs)
+        super().setUp()
+        self.io_loop.run_sync(self.service.start)
+
+    def tearDown(self):
+        super().tearDown()
+        self.service.job_executor.shutdown(wait=True)
+        self.service.query_executor.shutdown(wait=True)
+        self.client.close()
+        self.mock_server.shutdown()
+        self.mock_server.server_close()
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+    def get_app(self):
+        return service_module.make_app(self.service)
+
+    def submit(self, filename="sample.vcf", content=None, **fields):
+        if content is None:
+            with open(SAMPLE_VCF, "rb") as f:
+                content = f.read()
+        body, headers = multipart_body(fields, filename, content)
+        return self.fetch("/api/jobs", method="POST", body=body, headers=headers)
+
+    def run_job(self, **fields):
+        response = self.submit(**fields)
+        self.assertEqual(response.code, 202)
+        job = json.loads(response.body)
+        events = self.fetch(job["events_url"], request_timeout=30)
+        self.assertEqual(events.code, 200)
+        self.assertTrue(events.headers["Content-Type"].startswith("text/event-stream"))
+        payloads = [json.loads(line[len("data: "):]) for line in events.body.decode().split("\n\n")
+                    if line.startswith("data: ")]
+        return job, payloads
+
+
+class JobEndpointsTest(AnnotationServiceTest):
+    def test_submit_rejects_missing_or_invalid_vcf(self):
+        body, headers = multipart_body({"hpo_terms": "HP:0002665"}, "notes.txt", b"hello")
+        self.assertEqual(self.fetch("/api/jobs", method="POST", body=body, headers=headers).code, 400)
+        response = self.submit(content=b"#CHROM\tPOS\n1\t1\n")
+        self.assertEqual(response.code, 400)
+        self.assertIn("error", json.loads(response.body))
+        self.assertEqual(self.submit(panel="no_such_panel").code, 400)
+
+    def test_submit_returns_job_urls(self):
+        response = self.submit(hpo_terms="HP:0002665")
+        self.assertEqual(response.code, 202)
+        job = json.loads(response.body)
+        self.assertEqual(job["status"], "queued")
+        self.assertEqual(job["hpo_terms"], ["HP:0002665"])
+        self.assertEqual(job["panel"], service_module.DEFAULT_GENE_PANEL)
+        self.assertEqual(job["events_url"], f"/api/jobs/{job['job_id']}/events")
+        self.fetch(job["events_url"], request_timeout=30) # 等待工作結束，避免在執行中關閉服務
+
+    def test_events_stream_ends_with_done_summary(self):
+        job, events = self.run_job()
+        types = [event["type"] for event in events]
+        self.assertEqual(types[0], "queued")
+        self.assertEqual(types[1], "running")
+        self.assertEqual(types[-1], "done")
+        self.assertIn("progress", types)
+        summary = events[-1]["summary"]
+        self.assertEqual(summary["records"], 7)
+        self.assertGreater(summary["pathogenic"], 0)
+        self.assertTrue(all(event["job_id"] == job["job_id"] for event in events))
+        # 工作完成後重新訂閱會立即收到完整的事件紀錄
+        replay = self.fetch(job["events_url"], request_timeout=5)
+        self.assertEqual(replay.body.decode().count("data: "), len(events))
+        status = json.loads(self.fetch(job["status_url"]).body)
+        self.assertEqual(status["status"], "done")
+
+    def test_unknown_job_returns_404(self):
+        self.assertEqual(self.fetch("/api/jobs/missing").code, 404)
+        self.assertEqual(self.fetch("/api/jobs/missing/events").code, 404)
+        self.assertEqual(self.fetch("/api/jobs/missing/report").code, 404)
+
+
+class JobReportTest(AnnotationServiceTest):
+    def test_json_report_lists_only_this_jobs_reported_variants(self):
+        job, events = self.run_job()
+        response = self.fetch(job["report_url"] + "?format=json")
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("application/json"))
+        report = json.loads(response.body)
+        self.assertEqual(report["count"], events[-1]["summary"]["pathogenic"])
+        self.assertTrue(all(v["pathogenicity_assessment"] in pipeline.REPORT_CLASSIFICATIONS for v in report["variants"]))
+
+        grouped = json.loads(self.fetch(job["report_url"] + "?format=json&group_by_gene=1").body)
+        self.assertEqual(sum(len(gene["variants"]) for gene in grouped["genes"]), report["count"])
+
+    def test_html_report_and_bad_parameters(self):
+        job, _ = self.run_job()
+        response = self.fetch(job["report_url"])
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/html"))
+        self.assertIn(b"EGFR", response.body)
+        self.assertEqual(self.fetch(job["report_url"] + "?format=pdf").code, 400)
+        self.assertEqual(self.fetch(job["report_url"] + "?page=x").code, 400)
+
+    def test_job_uses_configured_classifier(self):
+        with mock.patch.object(pipeline, "PATHOGENICITY_CLASSIFIER", "legacy"):
+            job, _ = self.run_job(genes="EGFR,KRAS")
+        docs = list(self.collection.find({"job_id": job["job_id"]}))
+        self.assertTrue(docs)
+        expected = pipeline.pathogenicity_ruleset_version(["EGFR", "KRAS"], list(pipeline.LUNG_ADENOCARCINOMA_HPO_TERMS),
+                                                          classifier="legacy")
+        self.assertEqual({doc["pathogenicity_ruleset"] for doc in docs}, {expected})
+        self.assertFalse(any("pathogenicity_evidence_codes" in doc for doc in docs))
+
+    def test_invalid_classifier_fails_job(self):
+        with mock.patch.object(pipeline, "PATHOGENICITY_CLASSIFIER", "bogus"):
+            _, events = self.run_job()
+        self.assertEqual(events[-1]["type"], "error")
+        self.assertIn("PATHOGENICITY_CLASSIFIER", events[-1]["message"])
+
+
+class JobEvictionTest(AnnotationServiceTest):
+    max_jobs = 1
+
+    def test_old_job_documents_are_deleted(self):
+        first, _ = self.run_job()
+        second, _ = self.run_job()
+        self.service.query_executor.shutdown(wait=True) # 等待背景刪除完成
+        self.assertEqual(self.fetch(first["status_url"]).code, 404)
+        self.assertEqual(self.collection.count_documents({"job_id": first["job_id"]}), 0)
+        self.assertGreater(self.collection.count_documents({"job_id": second["job_id"]}), 0)
+
+    def test_failed_delete_is_logged(self):
+        self.run_job()
+        with mock.patch.object(self.collection, "delete_many", side_effect=RuntimeError("資料庫離線")), \
+                self.assertLogs(level=logging.ERROR) as logs:
+            self.run_job()
+            self.service.query_executor.shutdown(wait=True)
+            self.io_loop.run_sync(lambda: None) # 讓 done-callback 在事件迴圈中執行
+        self.assertTrue(any("資料庫離線" in line for line in logs.output))
@@ -0,0 +1,164 @@
+import gzip
+import logging
+
+import mongomock
+import pytest
+
+import annotate_vcf_advanced as pipeline
+
+SAMPLE_A = [
+    "1\t100\t.\tA\tG\t50\tPASS\tDP=10\tGT\t0/1",
+    "7\t55249071\t.\tC\tT\t50\tPASS\tDP=12\tGT\t0/1",
+    "7\t55249100\t.\tGCAT\tGCT\t50\tPASS\tDP=14\tGT\t0/1", # 修剪後為 7-55249101-CA-C
+    "12\t25398284\t.\tG\tT\t50\tPASS\tDP=16\tGT\t0/1",
+]
+SAMPLES_B = [
+    "1\t100\t.\tA\tG\t50\tPASS\tDP=20\tGT\t1/1\t0/0",
+    "7\t55249071\trs121434568\tC\tT,A\t50\tPASS\tDP=22\tGT\t1/2\t0/1",
+    "7\t55249101\t.\tCA\tC\t50\tPASS\tDP=24\tGT\t0/1\t./.",
+    "17\t7674903\t.\tC\tA\t50\tPASS\tDP=26\tGT\t0/0\t0/0", # 沒有任何帶變異的基因型: 不註釋
+]
+SAMPLE_C = [
+    "chr7\t55249071\t.\tC\tT\t50\tPASS\tDP=30\tGT\t0/0",
+    "chr12\t25398284\t.\tG\tT\t50\tPASS\tDP=32\tGT\t0|1",
+    "chrX\t20000\t.\tC\tA\t50\tPASS\tDP=34\tGT\t1/1",
+]
+EXPECTED_GENOTYPES = {
+    "1-100-A-G": {"A1", "B1"},
+    "7-55249071-C-T": {"A1", "B1", "B2"},
+    "7-55249071-C-A": {"B1"},
+    "7-55249101-CA-C": {"A1", "B1"},
+    "12-25398284-G-T": {"A1", "C1"},
+    "X-20000-C-A": {"C1"},
+}
+
+
+def write_vcf(path, samples, rows, contigs=()):
+    header = ["##fileformat=VCFv4.2\n"]
+    header += [f"##contig=<ID={contig}>\n" for contig in contigs]
+    header.append("##INFO=<ID=DP,Number=1,Type=Integer,Description=\"Total Depth\">\n")
+    header.append("##FORMAT=<ID=GT,Number=1,Type=String,Description=\"Genotype\">\n")
+    header.append("\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"] + samples) + "\n")
+    text = "".join(header) + "".join(row + "\n" for row in rows)
+    if str(path).endswith(".gz"):
+        with gzip.open(path, "wt") as f:
+            f.write(text)
+    else:
+        path.write_text(text)
+    return str(path)
+
+
+@pytest.fixture
+def cohort(make_server, monkeypatch):
+    server = make_server(annotations={}, annotation_factory=lambda variant_id: {
+        "_id": variant_id, "ensembl": {"gene": {"symbol": "EGFR"}}})
+    client = pipeline.MyVariantInfoClient(api_url=server.base_url, rate_per_second=0, max_retries=0)
+    annotated_sites = []
+    annotate_variant_docs = client.annotate_variant_docs
+
+    def recording_annotate(site_docs):
+        annotated_sites.extend(pipeline.variant_site_id(doc) for doc in site_docs)
+        return annotate_variant_docs(site_docs)
+
+    monkeypatch.setattr(client, "annotate_variant_docs", recording_annotate)
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(pipeline, "_default_myvariant_client", client)
+    monkeypatch.setattr(pipeline, "get_mongo_collection", lambda: database.variants)
+    monkeypatch.setattr(pipeline, "PROGRESS_COUNT_RECORDS", False)
+    monkeypatch.setattr(pipeline, "MONGO_WRITE_BATCH_SIZE", 2)
+    yield database, annotated_sites
+    client.close()
+
+
+def stored_genotypes(database):
+    genotypes = {}
+    for doc in database[pipeline.GENOTYPE_COLLECTION_NAME].find():
+        genotypes.setdefault(doc["site_id"], set()).add(doc["sample_id"])
+    return genotypes
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 100])
+def test_overlapping_sites_merge_across_chunk_boundaries(cohort, tmp_path, monkeypatch, chunk_size):
+    database, annotated_sites = cohort
+    monkeypatch.setattr(pipeline, "VCF_CHUNK_SIZE", chunk_size)
+    paths = [
+        write_vcf(tmp_path / "a.vcf", ["A1"], SAMPLE_A),
+        write_vcf(tmp_path / "b.vcf.gz", ["B1", "B2"], SAMPLES_B),
+        write_vcf(tmp_path / "c.vcf", ["C1"], SAMPLE_C),
+    ]
+
+    assert pipeline.run_cohort_workflow(paths) is True
+
+    assert sorted(annotated_sites) == sorted(EXPECTED_GENOTYPES) # 每個獨特位點只註釋一次
+    site_ids = {doc["_id"] for doc in database[pipeline.SITE_COLLECTION_NAME].find()}
+    assert site_ids == set(EXPECTED_GENOTYPES)
+    assert stored_genotypes(database) == EXPECTED_GENOTYPES
+    site = database[pipeline.SITE_COLLECTION_NAME].find_one({"_id": "7-55249071-C-T"})
+    assert site["id"] == "rs121434568"
+    genotype = database[pipeline.GENOTYPE_COLLECTION_NAME].find_one({"_id": "7-55249071-C-A:B1"})
+    assert genotype["genotype"] == "0/1" # 1/2 分解後，A 等位基因記為 1
+    assert genotype["info"] == {"DP": 22}
+
+
+def test_files_sharing_a_non_default_contig_order_merge(cohort, tmp_path):
+    database, _ = cohort
+    contigs = ["X", "1", "7"]
+    paths = [
+        write_vcf(tmp_path / "a.vcf", ["A1"], ["X\t500\t.\tC\tA\t50\tPASS\t.\tGT\t0/1",
+                                               "1\t100\t.\tA\tG\t50\tPASS\t.\tGT\t0/1"], contigs),
+        write_vcf(tmp_path / "b.vcf", ["B1"], ["X\t500\t.\tC\tA\t50\tPASS\t.\tGT\t1/1",
+                                               "7\t100\t.\tA\tG\t50\tPASS\t.\tGT\t0/1"], contigs),
+        write_vcf(tmp_path / "c.vcf", ["C1"], ["X\t500\t.\tC\tA\t50\tPASS\t.\tGT\t0/1",
+                                               "1\t100\t.\tA\tG\t50\tPASS\t.\tGT\t0/1"]), # 沒有 ##contig，沿用其他檔案的順序
+    ]
+
+    assert pipeline.run_cohort_workflow(paths) is True
+    assert stored_genotypes(database) == {"X-500-C-A": {"A1", "B1", "C1"}, "1-100-A-G": {"A1", "C1"}, "7-100-A-G": {"B1"}}
+
+
+def test_conflicting_contig_orders_fail_the_run(cohort, tmp_path, caplog):
+    database, annotated_sites = cohort
+    rows = {"1": "1\t100\t.\tA\tG\t50\tPASS\t.\tGT\t0/1", "X": "X\t100\t.\tA\tG\t50\tPASS\t.\tGT\t0/1"}
+    paths = [
+        write_vcf(tmp_path / "a.vcf", ["A1"], [rows["X"], rows["1"]], ["X", "1"]),
+        write_vcf(tmp_path / "b.vcf", ["B1"], [rows["1"], rows["X"]], ["1", "X"]),
+    ]
+
+    with caplog.at_level(logging.ERROR):
+        assert pipeline.run_cohort_workflow(paths) is False
+    assert "contig 順序" in caplog.text
+    assert annotated_sites == []
+    assert database[pipeline.SITE_COLLECTION_NAME].count_documents({}) == 0
+
+
+def test_unsorted_source_fails_the_run(cohort, tmp_path, caplog):
+    _, _ = cohort
+    paths = [
+        write_vcf(tmp_path / "a.vcf", ["A1"], SAMPLE_A),
+        write_vcf(tmp_path / "unsorted.vcf", ["U1"], ["7\t200\t.\tA\tG\t50\tPASS\t.\tGT\t0/1",
+                                                      "1\t100\t.\tA\tG\t50\tPASS\t.\tGT\t0/1"]),
+    ]
+
+    with caplog.at_level(logging.ERROR):
+        assert pipeline.run_cohort_workflow(paths) is False
+    assert "未依染色體與位置排序" in caplog.text
+
+
+def test_truncated_source_fails_the_run(cohort, tmp_path):
+    path = write_vcf(tmp_path / "b.vcf.gz", ["B1", "B2"], SAMPLES_B * 200)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:len(data) // 2])
+    paths = [write_vcf(tmp_path / "a.vcf", ["A1"], SAMPLE_A), path]
+
+    assert pipeline.run_cohort_workflow(paths) is False
+
+
+def test_failing_annotation_stage_fails_the_run(cohort, tmp_path, monkeypatch):
+    database, _ = cohort
+    monkeypatch.setattr(pipeline, "VCF_CHUNK_SIZE", 2)
+    monkeypatch.setattr(pipeline, "assess_annotated_docs", lambda *args, **kwargs: 1 / 0)
+
+    assert pipeline.run_cohort_workflow([write_vcf(tmp_path / "a.vcf", ["A1"], SAMPLE_A)]) is False
+    assert database[pipeline.GENOTYPE_COLLECTION_NAME].count_documents({}) == 0
@@ -0,0 +1,76 @@
+import pytest
+
+import annotate_vcf_advanced as pipeline
+
+# 1-based: G1 G2 G3 C4 A5 C6 A7 C8 A9 T10 T11 T12 (CA 重複位於 4-9)
+REFERENCE_SEQUENCE = "GGGCACACATTTGACTGACT"
+
+
+@pytest.fixture
+def reference(tmp_path):
+    pytest.importorskip("pysam")
+    path = tmp_path / "ref.fa"
+    path.write_text(f">chr1\n{REFERENCE_SEQUENCE}\n")
+    return pipeline.ReferenceGenome(str(path))
+
+
+def write_clinvar(path, rows):
+    with open(path, "w") as f:
+        f.write("##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+        for i, (pos, ref, alt) in enumerate(rows, 1):
+            f.write(f"1\t{pos}\t{i}\t{ref}\t{alt}\t.\t.\tALLELEID={i};CLNSIG=Pathogenic;GENEINFO=EGFR:1956\n")
+    return str(path)
+
+
+def variant_doc(pos, ref, alt, reference=None):
+    pos, ref, alt = pipeline.normalize_variant("1", pos, ref, alt, reference)
+    return {"chrom": "1", "pos": pos, "ref": ref, "alt": alt}
+
+
+def test_right_shifted_source_deletion_matches_left_aligned_doc(tmp_path, reference):
+    store = pipeline.LocalAnnotationStore(str(tmp_path / "store.sqlite3"), reference)
+    store.import_clinvar_vcf(write_clinvar(tmp_path / "clinvar.vcf", [(7, "ACA", "A")]))
+
+    doc = variant_doc(7, "ACA", "A", reference)
+    assert (doc["pos"], doc["ref"], doc["alt"]) == (3, "GCA", "G")
+    [annotation] = store.annotate_variant_docs([doc])
+    assert annotation["_id"] == "chr1:g.4_5del"
+    assert annotation["clinvar"]["rcv"]["clinical_significance"] == "Pathogenic"
+
+
+def test_lookup_does_not_renormalize_doc_alleles(tmp_path, reference):
+    store = pipeline.LocalAnnotationStore(str(tmp_path / "store.sqlite3"), reference)
+    store.import_clinvar_vcf(write_clinvar(tmp_path / "clinvar.vcf", [(3, "GCA", "G")]))
+
+    # 鍵值直接取自文件的等位基因；左對齊後的文件找得到，未正規化的表示法則不會被悄悄改寫
+    assert store.annotate_variant_docs([variant_doc(3, "GCA", "G", reference)])[0].get("_id") == "chr1:g.4_5del"
+    assert store.annotate_variant_docs([{"chrom": "1", "pos": 7, "ref": "ACA", "alt": "A"}])[0]["status"] == "not_found"
+
+
+@pytest.mark.parametrize("source, doc", [
+    ((10, "TTT", "TGT"), (11, "T", "G")),       # 共同前後綴 -> SNV
+    ((2, "GCAT", "GT"), (2, "GCA", "G")),       # 共同後綴
+    ((1, "GGG", "GG"), (1, "GG", "G")),         # POS 1 保留錨定鹼基
+])
+def test_import_trims_like_the_workflow(tmp_path, source, doc):
+    store = pipeline.LocalAnnotationStore(str(tmp_path / "store.sqlite3"))
+    store.import_clinvar_vcf(write_clinvar(tmp_path / "clinvar.vcf", [source]))
+
+    assert variant_doc(*source)["pos"] == doc[0]
+    [annotation] = store.annotate_variant_docs([{"chrom": "chr1", "pos": doc[0], "ref": doc[1], "alt": doc[2]}])
+    assert annotation.get("_id") == pipeline.myvariant_hgvs_id("1", *doc)
+
+
+def test_gnomad_tsv_and_vcf_use_same_keys(tmp_path, reference):
+    store = pipeline.LocalAnnotationStore(str(tmp_path / "store.sqlite3"), reference)
+    tsv = tmp_path / "gnomad.tsv"
+    tsv.write_text("chrom\tpos\tref\talt\taf\nchr1\t5\tACA\tA\t0.01\n")
+    vcf = tmp_path / "gnomad.vcf"
+    vcf.write_text("##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+                   "chr1\t7\t.\tACA\tA\t.\tPASS\tAF=0.002\n")
+    store.import_gnomad(str(tsv), "genome")
+    store.import_gnomad(str(vcf), "exome")
+
+    [annotation] = store.annotate_variant_docs([variant_doc(5, "ACA", "A", reference)])
+    assert annotation["gnomad_genome"]["af"] == 0.01
+    assert annotation["gnomad_exome"]["af"] == 0.002
@@ -0,0 +1,99 @@
+import pytest
+import requests
+
+from mock_myvariant_server import DEFAULT_ANNOTATIONS
+
+EGFR_ID = "chr7:g.55249071C>T"
+KRAS_ID = "chr12:g.25398284G>T"
+UNKNOWN_ID = "chr1:g.1A>C"
+
+
+@pytest.fixture
+def server(make_server):
+    return make_server()
+
+
+def post_ids(server, ids):
+    return requests.post(server.base_url.rstrip("/"), data={"ids": ",".join(ids)}, timeout=5)
+
+
+def test_get_returns_annotation(server):
+    response = requests.get(server.base_url + EGFR_ID, timeout=5)
+
+    assert response.status_code == 200
+    assert response.json() == DEFAULT_ANNOTATIONS[EGFR_ID]
+    assert server.request_log == [("GET", 1)]
+
+
+def test_get_unknown_variant_returns_404(server):
+    response = requests.get(server.base_url + UNKNOWN_ID, timeout=5)
+
+    assert response.status_code == 404
+    assert response.json()["success"] is False
+
+
+def test_post_returns_batch_in_query_order(server):
+    response = post_ids(server, [KRAS_ID, UNKNOWN_ID, EGFR_ID])
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [hit["query"] for hit in results] == [KRAS_ID, UNKNOWN_ID, EGFR_ID]
+    assert results[0]["_id"] == KRAS_ID
+    assert results[1] == {"query": UNKNOWN_ID, "notfound": True}
+    assert results[2]["ensembl"]["gene"]["symbol"] == "EGFR"
+    assert server.request_log == [("POST", 3)]
+
+
+def test_post_does_not_modify_stored_annotations(server):
+    post_ids(server, [EGFR_ID])
+
+    assert "query" not in DEFAULT_ANNOTATIONS[EGFR_ID]
+
+
+def test_post_rejects_more_than_1000_ids(server):
+    response = post_ids(server, [f"chr1:g.{i}A>G" for i in range(1, 1002)])
+
+    assert response.status_code == 400
+    assert "1000" in response.json()["error"]
+    assert server.request_log == []
+
+
+def test_post_accepts_exactly_1000_ids(server):
+    response = post_ids(server, [f"chr1:g.{i}A>G" for i in range(1, 1001)])
+
+    assert response.status_code == 200
+    assert len(response.json()) == 1000
+    assert server.request_log == [("POST", 1000)]
+
+
+def test_annotation_factory_covers_unknown_ids(make_server):
+    server = make_server(annotations={}, annotation_factory=lambda variant_id: {"_id": variant_id})
+
+    results = post_ids(server, [UNKNOWN_ID]).json()
+
+    assert results == [{"_id": UNKNOWN_ID, "query": UNKNOWN_ID}]
+
+
+@pytest.mark.parametrize("method", ["GET", "POST"])
+def test_rate_limit_injection_returns_429_with_retry_after(make_server, method):
+    server = make_server(rate_limit_ratio=1.0, retry_after_seconds=2, seed=0)
+
+    if method == "GET":
+        response = requests.get(server.base_url + EGFR_ID, timeout=5)
+    else:
+        response = post_ids(server, [EGFR_ID])
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert server.rate_limited_count == 1
+    assert server.request_log == []
+
+
+def test_rate_limit_ratio_is_seeded(make_server):
+    statuses = []
+    for _ in range(2):
+        server = make_server(rate_limit_ratio=0.5, seed=42)
+        statuses.append([requests.get(server.base_url + EGFR_ID, timeout=5).status_code for _ in range(20)])
+
+    assert statuses[0] == statuses[1]
+    assert {200, 429} == set(statuses[0])
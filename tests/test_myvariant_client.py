@@ -0,0 +1,106 @@
+import pytest
+
+import annotate_vcf_advanced as pipeline
+from mock_myvariant_server import DEFAULT_ANNOTATIONS
+
+EGFR_ID = "chr7:g.55249071C>T"
+KRAS_ID = "chr12:g.25398284G>T"
+TP53_ID = "chr17:g.7674903C>A"
+UNKNOWN_ID = "chr1:g.1A>C"
+
+
+def synthetic_id(i):
+    return f"chr2:g.{i}A>G"
+
+
+@pytest.fixture
+def make_client():
+    clients = []
+
+    def make(server, **options):
+        options.setdefault("rate_per_second", 0)
+        options.setdefault("max_retries", 0)
+        client = pipeline.MyVariantInfoClient(api_url=server.base_url, **options)
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+
+
+def test_one_post_per_chunk(make_server, make_client, monkeypatch):
+    monkeypatch.setattr(pipeline, "MYVARIANT_INFO_BATCH_SIZE", 3)
+    server = make_server()
+    client = make_client(server)
+
+    client.annotate_batch([EGFR_ID, KRAS_ID, TP53_ID, UNKNOWN_ID, synthetic_id(1), synthetic_id(2), synthetic_id(3)])
+
+    assert sorted(server.request_log) == [("POST", 1), ("POST", 3), ("POST", 3)]
+    assert client.request_count == 3
+
+
+def test_posts_at_most_1000_ids(make_server, make_client):
+    server = make_server(annotation_factory=lambda variant_id: {"_id": variant_id})
+    client = make_client(server)
+    variant_ids = [synthetic_id(i) for i in range(1, 2501)]
+
+    results = client.annotate_batch(variant_ids)
+
+    assert sorted(count for _, count in server.request_log) == [500, 1000, 1000]
+    assert all(method == "POST" for method, _ in server.request_log)
+    assert [hit["_id"] for hit in results] == variant_ids
+
+
+def test_results_keep_input_order_across_chunks(make_server, make_client, monkeypatch):
+    monkeypatch.setattr(pipeline, "MYVARIANT_INFO_BATCH_SIZE", 2)
+    server = make_server(latency_seconds=0.01)
+    client = make_client(server)
+    variant_ids = [TP53_ID, UNKNOWN_ID, KRAS_ID, EGFR_ID, synthetic_id(5)]
+
+    results = client.annotate_batch(variant_ids)
+
+    assert [hit.get("_id") or hit["query"] for hit in results] == variant_ids
+    assert results[2]["ensembl"] == DEFAULT_ANNOTATIONS[KRAS_ID]["ensembl"]
+
+
+def test_duplicates_are_queried_once_and_notfound_maps_to_status(make_server, make_client):
+    server = make_server()
+    client = make_client(server)
+
+    results = client.annotate_batch([UNKNOWN_ID, EGFR_ID, UNKNOWN_ID, EGFR_ID])
+
+    assert server.request_log == [("POST", 2)]
+    assert results[0] == results[2]
+    assert results[0]["status"] == "not_found"
+    assert results[0]["query"] == UNKNOWN_ID
+    assert results[1]["_id"] == results[3]["_id"] == EGFR_ID
+
+
+def test_annotate_myvariant_info_batch_uses_batched_posts(make_server, monkeypatch):
+    monkeypatch.setattr(pipeline, "MYVARIANT_INFO_BATCH_SIZE", 2)
+    server = make_server()
+    client = pipeline.MyVariantInfoClient(api_url=server.base_url, rate_per_second=0, max_retries=0)
+    monkeypatch.setattr(pipeline, "_default_myvariant_client", client)
+    variant_ids = [KRAS_ID, UNKNOWN_ID, EGFR_ID, KRAS_ID]
+
+    try:
+        results = pipeline.annotate_myvariant_info_batch(variant_ids)
+    finally:
+        client.close()
+
+    assert sorted(server.request_log) == [("POST", 1), ("POST", 2)]
+    assert [hit.get("_id") or hit["query"] for hit in results] == variant_ids
+    assert results[1]["status"] == "not_found"
+
+
+def test_request_count_is_exact_under_concurrent_requests(make_server, make_client, monkeypatch):
+    monkeypatch.setattr(pipeline, "MYVARIANT_INFO_USE_BATCH", False) # 每個變異一個 GET，由 concurrency 個執行緒同時送出
+    server = make_server(rate_limit_ratio=0.2, retry_after_seconds=0, seed=0)
+    client = make_client(server, concurrency=16, max_retries=20)
+
+    results = client.annotate_ids([synthetic_id(i) for i in range(300)])
+
+    assert len(results) == 300
+    assert server.rate_limited_count > 0 # 429 重試也計入請求數
+    assert client.request_count == len(server.request_log) + server.rate_limited_count
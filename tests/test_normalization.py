@@ -0,0 +1,203 @@
+import pytest
+
+import annotate_vcf_advanced as pipeline
+
+# 1-based: G1 G2 G3 C4 A5 C6 A7 C8 A9 T10 T11 T12 (CA 重複位於 4-9，T 同聚物位於 10-12)
+REFERENCE_SEQUENCE = "GGGCACACATTTGACTGACT"
+
+VCF_HEADER = [
+    "##fileformat=VCFv4.2\n",
+    "##INFO=<ID=DP,Number=1,Type=Integer,Description=\"Total Depth\">\n",
+    "##INFO=<ID=AF,Number=A,Type=Float,Description=\"Allele Frequency\">\n",
+    "##INFO=<ID=AD,Number=R,Type=Integer,Description=\"Allelic depths\">\n",
+    "##FORMAT=<ID=GT,Number=1,Type=String,Description=\"Genotype\">\n",
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2\n",
+]
+
+
+@pytest.fixture
+def reference(tmp_path):
+    pytest.importorskip("pysam")
+    path = tmp_path / "ref.fa"
+    path.write_text(f">chr1\n{REFERENCE_SEQUENCE}\n")
+    return pipeline.ReferenceGenome(str(path))
+
+
+@pytest.mark.parametrize("variant, expected", [
+    ((100, "C", "T"), (100, "C", "T")),               # SNV 不變
+    ((100, "CA", "C"), (100, "CA", "C")),             # 已正規化的刪除
+    ((100, "C", "CAG"), (100, "C", "CAG")),           # 已正規化的插入
+    ((100, "CAT", "CT"), (100, "CA", "C")),           # 共同後綴
+    ((100, "GCAT", "GCT"), (101, "CA", "C")),         # 共同前後綴
+    ((100, "ACG", "ATG"), (101, "C", "T")),           # MNV 修剪為 SNV
+    ((100, "ACGT", "AGCT"), (101, "CG", "GC")),       # MNV 保留中間兩個鹼基
+    ((100, "TTT", "TGT"), (101, "T", "G")),
+    ((1, "GGG", "GG"), (1, "GG", "G")),               # POS 1 保留錨定鹼基
+    ((1, "A", "AT"), (1, "A", "AT")),
+    ((100, "C", "C"), (100, "C", "C")),               # REF 與 ALT 相同
+    ((100, "CA", "*"), (100, "CA", "*")),             # 非序列等位基因原樣回傳
+    ((100, "CA", "<DEL>"), (100, "CA", "<DEL>")),
+    ((100, "CA", "."), (100, "CA", ".")),
+])
+def test_trim_without_reference(variant, expected):
+    assert pipeline.normalize_variant("7", *variant) == expected
+
+
+@pytest.mark.parametrize("chrom, variant, expected", [
+    ("1", (7, "ACA", "A"), (3, "GCA", "G")),          # CA 重複中的刪除左移到重複開頭
+    ("chr1", (5, "ACA", "A"), (3, "GCA", "G")),       # 染色體名稱 chr 前綴互通
+    ("1", (9, "A", "ACA"), (3, "G", "GCA")),          # 重複尾端的插入左移
+    ("1", (11, "TT", "T"), (9, "AT", "A")),           # 同聚物中的刪除
+    ("1", (12, "T", "TT"), (9, "A", "AT")),           # 同聚物中的插入
+    ("1", (2, "GG", "G"), (1, "GG", "G")),            # 左移到 POS 1 即停止
+    ("1", (1, "GG", "G"), (1, "GG", "G")),
+    ("1", (1, "G", "GG"), (1, "G", "GG")),
+    ("1", (10, "TTT", "TGT"), (11, "T", "G")),        # 非重複序列只修剪
+    ("1", (13, "G", "A"), (13, "G", "A")),
+    ("2", (7, "ACA", "A"), (7, "ACA", "A")),          # 參考基因組沒有的染色體不左移
+])
+def test_left_align_with_reference(reference, chrom, variant, expected):
+    assert pipeline.normalize_variant(chrom, *variant, reference) == expected
+
+
+@pytest.mark.parametrize("variant, expected", [
+    ((55249071, "C", "T"), "chr7:g.55249071C>T"),
+    ((100, "CA", "C"), "chr7:g.101del"),
+    ((100, "CAGT", "C"), "chr7:g.101_103del"),
+    ((100, "C", "CA"), "chr7:g.100_101insA"),
+    ((100, "C", "CAG"), "chr7:g.100_101insAG"),
+    ((100, "C", "TG"), "chr7:g.100delinsTG"),         # 單一鹼基的 delins
+    ((100, "CA", "T"), "chr7:g.100_101delinsT"),
+    ((100, "CA", "TG"), "chr7:g.100_101delinsTG"),    # MNV
+    ((100, "CAT", "CG"), "chr7:g.101_102delinsG"),    # 去掉未正規化的錨定鹼基
+    ((100, "CA", "CG"), "chr7:g.101delinsG"),
+    ((1, "GG", "G"), "chr7:g.2del"),                  # POS 1
+    ((1, "G", "GT"), "chr7:g.1_2insT"),
+])
+def test_myvariant_hgvs_id(variant, expected):
+    assert pipeline.myvariant_hgvs_id("7", *variant) == expected
+
+
+@pytest.mark.parametrize("ref, alt", [("", "A"), ("A", ""), ("", "")])
+def test_myvariant_hgvs_id_rejects_empty_alleles(ref, alt):
+    with pytest.raises(ValueError):
+        pipeline.myvariant_hgvs_id("7", 100, ref, alt)
+
+
+def parse_record(row):
+    return pipeline.FastVcfParser(VCF_HEADER).parse_line(row + "\n")
+
+
+def split_alleles(record, reference=None):
+    return [(doc["pos"], doc["ref"], doc["alt"]) for doc in pipeline.build_variant_docs(record, reference)]
+
+
+@pytest.mark.parametrize("row, expected", [
+    ("1\t100\t.\tGCA\tG,GCAT,T\t50\tPASS\t.\tGT\t1/2\t0/3",
+     [(100, "GCA", "G"), (102, "A", "AT"), (100, "GCA", "T")]),
+    ("1\t100\t.\tC\tT,*,<DEL>,A\t50\tPASS\t.\tGT\t1/2\t0/4",   # "*" 與符號等位基因略過
+     [(100, "C", "T"), (100, "C", "A")]),
+    ("1\t1\t.\tAT\tA,ATT\t50\tPASS\t.\tGT\t1/2\t0/0",          # POS 1 的多等位基因位點
+     [(1, "AT", "A"), (1, "A", "AT")]),
+    ("1\t100\t.\tC\t.\t50\tPASS\t.\tGT\t0/0\t0/0", []),         # 僅有參考等位基因
+])
+def test_multiallelic_split_and_trim(row, expected):
+    assert split_alleles(parse_record(row)) == expected
+
+
+def test_multiallelic_split_keeps_per_allele_genotypes_and_info():
+    record = parse_record("1\t100\t.\tGCA\tG,GCAT,T\t50\tPASS\tDP=30;AF=0.1,0.2,0.3;AD=10,5,4,3\tGT\t1/2\t0|3")
+    docs = pipeline.build_variant_docs(record)
+
+    assert [[s["genotype"] for s in doc["samples"]] for doc in docs] == [["1/0", "0|0"], ["0/1", "0|0"], ["0/0", "0|1"]]
+    assert [doc["info"] for doc in docs] == [
+        {"DP": 30, "AF": [0.1], "AD": [10, 5]},
+        {"DP": 30, "AF": [0.2], "AD": [10, 4]},
+        {"DP": 30, "AF": [0.3], "AD": [10, 3]},
+    ]
+    assert [doc["vcf_record"] for doc in docs] == [
+        {"pos": 100, "ref": "GCA", "alt": ["G", "GCAT", "T"], "allele_index": i} for i in (1, 2, 3)]
+
+
+def test_multiallelic_split_left_aligns_each_allele(reference):
+    record = parse_record("1\t7\t.\tACA\tA,ACACA\t50\tPASS\t.\tGT\t1/2\t0/1")
+    assert split_alleles(record, reference) == [(3, "GCA", "G"), (3, "G", "GCA")]
+
+
+def test_biallelic_record_without_changes_has_no_vcf_record():
+    [doc] = pipeline.build_variant_docs(parse_record("1\t100\t.\tC\tT\t50\tPASS\t.\tGT\t0/1\t0/0"))
+    assert "vcf_record" not in doc
+    [doc] = pipeline.build_variant_docs(parse_record("1\t100\t.\tGCAT\tGCT\t50\tPASS\t.\tGT\t0/1\t0/0"))
+    assert (doc["pos"], doc["ref"], doc["alt"]) == (101, "CA", "C")
+    assert doc["vcf_record"] == {"pos": 100, "ref": "GCAT", "alt": ["GCT"], "allele_index": 1}
+
+
+# 0-based 半開區間: [100, 200) 與 [150, 250) 重疊，[300, 400) 與 [400, 500) 相鄰，[502, 600) 中間隔兩個鹼基
+REGION_INDEX = pipeline.GeneRegionIndex({
+    "7": [(300, 400), (100, 200), (502, 600), (150, 250), (400, 500)],
+    "12": [(0, 10)],
+})
+
+
+@pytest.mark.parametrize("chrom, pos, expected", [
+    ("7", 1, False),          # 第一個區域之前
+    ("7", 100, False),        # 0-based 起點的前一個鹼基
+    ("7", 101, True),         # 區域第一個鹼基
+    ("7", 200, True),         # 重疊區域合併
+    ("7", 250, True),         # 合併後區域的最後一個鹼基
+    ("7", 251, False),        # 終點不包含
+    ("7", 300, False),
+    ("7", 301, True),
+    ("7", 400, True),         # 相鄰基因的交界
+    ("7", 401, True),
+    ("7", 500, True),
+    ("7", 501, False),        # 兩個區域之間的空隙
+    ("7", 502, False),
+    ("7", 503, True),
+    ("7", 600, True),
+    ("7", 601, False),        # 最後一個區域之後
+    ("chr7", 101, True),      # 查詢時染色體名稱正規化
+    ("12", 1, True),          # 從染色體開頭起算的區域與 POS 1
+    ("12", 10, True),
+    ("12", 11, False),
+    ("X", 101, False),        # 沒有區域的染色體
+])
+def test_region_index_lookup(chrom, pos, expected):
+    assert REGION_INDEX.contains(chrom, pos) is expected
+
+
+def test_region_index_merges_overlapping_and_adjacent_intervals():
+    assert list(REGION_INDEX.regions()) == [("7", 100, 250), ("7", 300, 500), ("7", 502, 600), ("12", 0, 10)]
+    assert len(REGION_INDEX) == 4
+
+
+def test_region_index_vectorized_lookup_matches_scalar():
+    positions = list(range(1, 700))
+    expected = [REGION_INDEX.contains("7", pos) for pos in positions]
+    assert REGION_INDEX.contains_many("7", positions).tolist() == expected
+    assert REGION_INDEX.contains_many("7", []).tolist() == []
+
+
+@pytest.mark.parametrize("filename, lines", [
+    ("panel.bed", ["track name=panel", "chr7\t100\t200\tEGFR", "chr7\t200\t300\tEGFR-AS1", "chr12\t0\t50\tKRAS",
+                   "chr1\t1000\t2000\tOTHER"]),
+    ("panel.gtf", ['chr7\tsrc\tgene\t101\t200\t.\t+\t.\tgene_id "1"; gene_name "EGFR";',
+                   'chr7\tsrc\texon\t101\t150\t.\t+\t.\tgene_id "1"; gene_name "EGFR";',
+                   'chr7\tsrc\tgene\t201\t300\t.\t+\t.\tgene_id "2"; gene_name "EGFR-AS1";',
+                   'chr12\tsrc\tgene\t1\t50\t.\t-\t.\tgene_id "3"; gene_name "KRAS";',
+                   'chr1\tsrc\tgene\t1001\t2000\t.\t+\t.\tgene_id "4"; gene_name "OTHER";']),
+])
+@pytest.mark.parametrize("padding, expected", [
+    (0, [("7", 100, 300), ("12", 0, 50)]),
+    (5, [("7", 95, 305), ("12", 0, 55)]),       # 起點不小於 0
+])
+def test_load_region_index_bed_and_gtf_coordinates(tmp_path, filename, lines, padding, expected):
+    path = tmp_path / filename
+    path.write_text("".join(line + "\n" for line in lines))
+
+    index = pipeline.load_gene_region_index(str(path), ["EGFR", "egfr-as1", "KRAS"], padding)
+
+    assert list(index.regions()) == expected
+    assert index.contains("7", 100 - padding) is False
+    assert index.contains("7", 101 - padding) is True
+    assert index.contains("1", 1500) is False
@@ -0,0 +1,106 @@
+import pytest
+
+import annotate_vcf_advanced as pipeline
+from benchmark_pipeline import build_classifier_corpus
+
+PANEL = pipeline.LUNG_ADENOCARCINOMA_GENE_PANEL
+HPO_TERMS = pipeline.LUNG_ADENOCARCINOMA_HPO_TERMS
+
+# 由 assess_pathogenicity 的證據文字推回證據代碼 (依文字開頭判斷)
+LEGACY_EVIDENCE_PREFIXES = [
+    ("gnomAD Exome 頻率 (", "高於致病閾值", "AF_EXOME_ABOVE_THRESHOLD"),
+    ("gnomAD Exome 頻率 (", "非常高", "BA1_EXOME"),
+    ("gnomAD Genome 頻率 (", "高於致病閾值", "AF_GENOME_ABOVE_THRESHOLD"),
+    ("gnomAD Genome 頻率 (", "非常高", "BA1_GENOME"),
+    ("gnomAD Exome 頻率 (", "低，支持致病性", "PM2_LOW_AF"),
+    ("變異位於肺腺癌相關基因面板中的", "", "PANEL_GENE"),
+    ("變異影響功能性蛋白質結構域", "", "PM1_PROTEIN_DOMAIN"),
+    ("變異為截斷性變異", "", "PVS1_TRUNCATING"),
+    ("變異位於 '", "不在肺腺癌相關基因面板中", "OFF_PANEL_GENE"),
+    ("無法識別變異所在的基因符號", "", "NO_GENE_SYMBOL"),
+    ("此分析以肺腺癌", "", "DISEASE_CONTEXT"),
+    ("SIFT 預測有害", "", "PP3_PREDICTORS"),
+    ("PolyPhen-2 預測可能有害", "", "PP3_PREDICTORS"),
+]
+
+
+def legacy_evidence_codes(evidence):
+    codes = []
+    for text in evidence:
+        if text.startswith("ClinVar 報告為"):
+            significance = text.split("'")[1]
+            code = ("CLINVAR_PATHOGENIC" if "pathogenic" in significance
+                    else "CLINVAR_BENIGN" if "benign" in significance else "CLINVAR_UNCERTAIN")
+        else:
+            code = next(code for prefix, marker, code in LEGACY_EVIDENCE_PREFIXES
+                        if text.startswith(prefix) and marker in text)
+        if not codes or codes[-1] != code:  # 多個結構域或預測工具共用同一代碼
+            codes.append(code)
+    return codes
+
+
+def legacy_results(corpus):
+    results = []
+    for anno in corpus:
+        doc = {"annotation_myvariant_info": anno}
+        label, evidence = pipeline.assess_pathogenicity(doc, PANEL, HPO_TERMS)
+        results.append((label, evidence, doc["relevant_to_lung_adenocarcinoma"]))
+    return results
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return build_classifier_corpus(5000, seed=0)
+
+
+@pytest.fixture(scope="module")
+def legacy(corpus):
+    return legacy_results(corpus)
+
+
+def assess_in_chunks(classifier, corpus, chunk_size=1000):
+    docs = [{"annotation_myvariant_info": anno} for anno in corpus]
+    for offset in range(0, len(docs), chunk_size):
+        classifier.assess_docs(docs[offset:offset + chunk_size])
+    return docs
+
+
+def test_labels_and_evidence_codes_match_legacy(corpus, legacy):
+    docs = assess_in_chunks(pipeline.ChunkPathogenicityClassifier(PANEL, HPO_TERMS), corpus)
+
+    for doc, (label, evidence, relevant) in zip(docs, legacy):
+        assert doc["pathogenicity_assessment"] == label
+        assert doc["relevant_to_lung_adenocarcinoma"] == relevant
+        assert doc["pathogenicity_evidence_codes"] == legacy_evidence_codes(evidence)
+
+
+def test_all_evidence_text_matches_legacy(corpus, legacy):
+    docs = assess_in_chunks(pipeline.ChunkPathogenicityClassifier(PANEL, HPO_TERMS, evidence_text="all"), corpus)
+
+    assert [doc["pathogenicity_evidence"] for doc in docs] == [evidence for _, evidence, _ in legacy]
+
+
+def test_reported_mode_renders_text_only_for_reported_labels(corpus, legacy):
+    docs = assess_in_chunks(pipeline.ChunkPathogenicityClassifier(PANEL, HPO_TERMS, evidence_text="reported"), corpus)
+
+    reported = 0
+    for doc, (label, evidence, _) in zip(docs, legacy):
+        if label in pipeline.REPORT_CLASSIFICATIONS:
+            reported += 1
+            assert doc["pathogenicity_evidence"] == evidence
+        else:
+            assert "pathogenicity_evidence" not in doc
+    assert 0 < reported < len(docs)
+
+
+def test_corpus_covers_every_label(legacy):
+    assert {label for label, _, _ in legacy} == set(pipeline.PATHOGENICITY_LABELS)
+
+
+def test_ruleset_version_depends_on_evidence_text_mode():
+    all_text = pipeline.ChunkPathogenicityClassifier(PANEL, HPO_TERMS, evidence_text="all")
+    reported = pipeline.ChunkPathogenicityClassifier(PANEL, HPO_TERMS, evidence_text="reported")
+
+    assert all_text.ruleset_version != reported.ruleset_version
+    with pytest.raises(ValueError):
+        pipeline.ChunkPathogenicityClassifier(PANEL, HPO_TERMS, evidence_text="none")
@@ -0,0 +1,63 @@
+import mongomock
+import pytest
+
+import annotate_vcf_advanced as pipeline
+from benchmark_pipeline import build_classifier_corpus
+
+PANEL = pipeline.LUNG_ADENOCARCINOMA_GENE_PANEL
+HPO_TERMS = pipeline.LUNG_ADENOCARCINOMA_HPO_TERMS
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = mongomock.MongoClient().db.variants
+    monkeypatch.setattr(pipeline, "get_mongo_collection", lambda: collection)
+    return collection
+
+
+def store_classified(collection, classifier):
+    docs = [{"_id": i, "annotation_myvariant_info": anno} for i, anno in enumerate(build_classifier_corpus(300, seed=1))]
+    pipeline.classify_annotated_docs(docs, classifier)
+    collection.insert_many(docs)
+    return docs
+
+
+def test_reclassify_with_legacy_removes_evidence_codes(collection, monkeypatch):
+    store_classified(collection, pipeline.ChunkPathogenicityClassifier(PANEL, HPO_TERMS, evidence_text="all"))
+    assert collection.count_documents({"pathogenicity_evidence_codes": {"$exists": True}}) == collection.count_documents({})
+    monkeypatch.setattr(pipeline, "PATHOGENICITY_CLASSIFIER", "legacy")
+
+    stats = pipeline.run_reclassification_workflow()
+
+    assert stats["changed"] == collection.count_documents({})
+    assert collection.count_documents({"pathogenicity_evidence_codes": {"$exists": True}}) == 0
+    legacy_version = pipeline.pathogenicity_ruleset_version(PANEL, HPO_TERMS, classifier="legacy")
+    assert collection.count_documents({"pathogenicity_ruleset": {"$ne": legacy_version}}) == 0
+
+
+def test_reclassify_in_reported_mode_removes_unreported_evidence_text(collection, monkeypatch):
+    docs = store_classified(collection, pipeline.ChunkPathogenicityClassifier(PANEL, HPO_TERMS, evidence_text="all"))
+    monkeypatch.setattr(pipeline, "PATHOGENICITY_EVIDENCE_TEXT", "reported")
+
+    pipeline.run_reclassification_workflow()
+
+    reported = {"pathogenicity_assessment": {"$in": list(pipeline.REPORT_CLASSIFICATIONS)}}
+    unreported = {"pathogenicity_assessment": {"$nin": list(pipeline.REPORT_CLASSIFICATIONS)}}
+    assert collection.count_documents(unreported) > 0
+    assert collection.count_documents(dict(unreported, pathogenicity_evidence={"$exists": True})) == 0
+    assert collection.count_documents(dict(reported, pathogenicity_evidence={"$exists": False})) == 0
+    # 評級、證據代碼與相關性不受證據文字範圍影響
+    for doc in docs:
+        stored = collection.find_one({"_id": doc["_id"]})
+        assert stored["pathogenicity_assessment"] == doc["pathogenicity_assessment"]
+        assert stored["pathogenicity_evidence_codes"] == doc["pathogenicity_evidence_codes"]
+
+
+def test_reclassify_back_to_all_restores_evidence_text(collection, monkeypatch):
+    store_classified(collection, pipeline.ChunkPathogenicityClassifier(PANEL, HPO_TERMS, evidence_text="reported"))
+    monkeypatch.setattr(pipeline, "PATHOGENICITY_EVIDENCE_TEXT", "all")
+
+    pipeline.run_reclassification_workflow()
+
+    assert collection.count_documents({"pathogenicity_evidence": {"$exists": False}}) == 0
+    assert pipeline.run_reclassification_workflow()["scanned"] == 0
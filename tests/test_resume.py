@@ -0,0 +1,116 @@
+import mongomock
+import pysam
+import pytest
+
+import annotate_vcf_advanced as pipeline
+
+RECORD_COUNT = 50
+FAILING_POS = 1270  # 第 27 筆記錄 (第 3 個 chunk)
+
+
+def write_vcf(path):
+    lines = ["##fileformat=VCFv4.2\n", "##contig=<ID=1>\n",
+             "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\n"]
+    for i in range(RECORD_COUNT):
+        lines.append(f"1\t{1000 + i * 10}\t.\tA\tG\t50\tPASS\tDP=10\tGT\t0/1\n")
+    with open(path, "w") as f:
+        f.writelines(lines)
+
+
+@pytest.fixture(params=["text", "bgzf"])
+def vcf_path(request, tmp_path):
+    path = tmp_path / "resume.vcf"
+    write_vcf(path)
+    if request.param == "bgzf":
+        pysam.tabix_compress(str(path), str(path) + ".gz")
+        return str(path) + ".gz"
+    return str(path)
+
+
+@pytest.fixture
+def workflow(make_server, monkeypatch, tmp_path, vcf_path):
+    failing = {"enabled": True}
+
+    def annotation_factory(variant_id):
+        if failing["enabled"] and variant_id == f"chr1:g.{FAILING_POS}A>G":
+            raise RuntimeError("模擬的伺服器錯誤")
+        return {"_id": variant_id, "ensembl": {"gene": {"symbol": "EGFR"}}}
+
+    server = make_server(annotations={}, annotation_factory=annotation_factory)
+    client = pipeline.MyVariantInfoClient(api_url=server.base_url, rate_per_second=0, max_retries=0)
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(pipeline, "_default_myvariant_client", client)
+    monkeypatch.setattr(pipeline, "get_mongo_collection", lambda: database.variants)
+    monkeypatch.setattr(pipeline, "VCF_FILE_PATH", vcf_path)
+    monkeypatch.setattr(pipeline, "VCF_CHUNK_SIZE", 10)
+    monkeypatch.setattr(pipeline, "REPORT_OUTPUT_PATH", str(tmp_path / "report.html"))
+    monkeypatch.setattr(pipeline, "PROGRESS_COUNT_RECORDS", False)
+    yield database, failing
+    client.close()
+
+
+def checkpoint(database):
+    return database[pipeline.CHECKPOINT_COLLECTION_NAME].find_one()
+
+
+def test_api_errors_keep_checkpoint_before_failed_chunk(workflow):
+    database, _ = workflow
+
+    pipeline.run_annotation_workflow()
+
+    state = checkpoint(database)
+    assert state["records_done"] == 20
+    assert state["completed"] is False
+    assert state["resume_offset"] is not None
+    assert database.variants.count_documents({}) == RECORD_COUNT - 10
+
+
+def test_resume_seeks_to_checkpoint_offset_and_retries_failed_chunk(workflow, monkeypatch):
+    database, failing = workflow
+    pipeline.run_annotation_workflow()
+    failing["enabled"] = False
+    resume_offset = checkpoint(database)["resume_offset"]
+
+    start_offsets = []
+    parse_vcf_in_chunks = pipeline.parse_vcf_in_chunks
+
+    def recording_parse(file_path, chunk_size, start_offset=None):
+        start_offsets.append(start_offset)
+        first = True
+        for chunk in parse_vcf_in_chunks(file_path, chunk_size, start_offset):
+            if first:
+                assert chunk[0].POS == 1200  # 第 21 筆記錄: 已完成的 20 筆沒有重新解析
+                first = False
+            yield chunk
+
+    monkeypatch.setattr(pipeline, "parse_vcf_in_chunks", recording_parse)
+    monkeypatch.setattr(pipeline, "RESUME_RUN", True)
+    pipeline.run_annotation_workflow()
+
+    assert start_offsets == [resume_offset]
+    state = checkpoint(database)
+    assert state["completed"] is True
+    assert state["records_done"] == RECORD_COUNT
+    assert database.variants.count_documents({}) == RECORD_COUNT
+
+
+def test_resume_falls_back_to_counting_when_file_changed(workflow, monkeypatch, vcf_path):
+    database, failing = workflow
+    pipeline.run_annotation_workflow()
+    failing["enabled"] = False
+    database[pipeline.CHECKPOINT_COLLECTION_NAME].update_one({}, {"$set": {"vcf_file_size": -1}})
+
+    start_offsets = []
+    parse_vcf_in_chunks = pipeline.parse_vcf_in_chunks
+
+    def recording_parse(file_path, chunk_size, start_offset=None):
+        start_offsets.append(start_offset)
+        yield from parse_vcf_in_chunks(file_path, chunk_size, start_offset)
+
+    monkeypatch.setattr(pipeline, "parse_vcf_in_chunks", recording_parse)
+    monkeypatch.setattr(pipeline, "RESUME_RUN", True)
+    pipeline.run_annotation_workflow()
+
+    assert start_offsets == [None]
+    assert checkpoint(database)["completed"] is True
+    assert database.variants.count_documents({}) == RECORD_COUNT
@@ -0,0 +1,171 @@
+import random
+import threading
+import time
+
+import pytest
+
+from annotate_vcf_advanced import PipelineStage, StagedPipeline
+
+RUN_TIMEOUT_SECONDS = 10
+
+
+def run_with_timeout(pipeline):
+    # 在背景執行緒執行，逾時代表管線死結
+    thread = threading.Thread(target=pipeline.run, daemon=True)
+    thread.start()
+    thread.join(RUN_TIMEOUT_SECONDS)
+    assert not thread.is_alive(), "管線沒有結束 (死結)"
+
+
+def wait_until(predicate, timeout=RUN_TIMEOUT_SECONDS):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待條件逾時"
+        time.sleep(0.01)
+
+
+def test_ordered_stage_restores_source_order_when_workers_finish_out_of_order():
+    rng = random.Random(0)
+    delays = [rng.uniform(0, 0.01) for _ in range(60)]
+    finished, written = [], []
+    lock = threading.Lock()
+
+    def annotate(item):
+        time.sleep(delays[item])
+        with lock:
+            finished.append(item)
+        return item * 10
+
+    stages = [
+        PipelineStage("annotate", annotate, concurrency=6),
+        PipelineStage("write", written.append, ordered=True),
+    ]
+    run_with_timeout(StagedPipeline(iter(range(60)), stages, queue_size=4, report_interval=0))
+
+    assert finished != sorted(finished) # 工作執行緒確實亂序完成
+    assert written == [item * 10 for item in range(60)]
+    assert [stage.items for stage in stages] == [60, 60]
+
+
+def test_ordered_stage_requires_single_worker():
+    with pytest.raises(ValueError):
+        PipelineStage("write", print, concurrency=2, ordered=True)
+
+
+def test_stuck_chunk_bounds_source_by_reorder_window():
+    release = threading.Event()
+    produced = []
+    written = []
+
+    def source():
+        for item in range(100):
+            produced.append(item)
+            yield item
+
+    def annotate(item):
+        if item == 0:
+            release.wait(RUN_TIMEOUT_SECONDS) # 第一個 chunk 卡住 (例如重試中)
+        return item
+
+    queue_size, workers = 3, 4
+    stages = [
+        PipelineStage("annotate", annotate, concurrency=workers),
+        PipelineStage("write", written.append, ordered=True),
+    ]
+    pipeline = StagedPipeline(source(), stages, queue_size=queue_size, report_interval=0)
+    thread = threading.Thread(target=pipeline.run, daemon=True)
+    thread.start()
+
+    window = queue_size + workers
+    wait_until(lambda: pipeline.source_items == window)
+    time.sleep(0.2) # 給來源機會超出視窗
+    assert pipeline.source_items == window
+    assert len(produced) <= window + 1 # 最多多產生一個正在等待視窗的 chunk
+    assert written == []
+    assert all(stage.input_queue.qsize() <= queue_size for stage in stages)
+
+    release.set()
+    thread.join(RUN_TIMEOUT_SECONDS)
+    assert not thread.is_alive()
+    assert written == list(range(100))
+
+
+def test_backpressure_bounds_queue_depth():
+    release = threading.Event()
+    depths = []
+    stages = []
+
+    def annotate(item):
+        depths.append(stages[1].input_queue.qsize())
+        return item
+
+    def write(item):
+        release.wait(RUN_TIMEOUT_SECONDS)
+
+    stages.extend([PipelineStage("annotate", annotate, concurrency=2), PipelineStage("write", write)])
+    pipeline = StagedPipeline(iter(range(50)), stages, queue_size=2, report_interval=0)
+    thread = threading.Thread(target=pipeline.run, daemon=True)
+    thread.start()
+
+    # 寫入階段停住時，來源只能領先到各佇列與工作執行緒都塞滿為止
+    wait_until(lambda: stages[1].input_queue.full() and stages[0].input_queue.full())
+    time.sleep(0.2)
+    assert pipeline.source_items <= 2 + 2 + 2 + 1 # 兩個佇列、兩個 annotate 執行緒、一個 write 執行緒
+    release.set()
+    thread.join(RUN_TIMEOUT_SECONDS)
+    assert not thread.is_alive()
+    assert max(depths) <= 2
+    assert stages[1].items == 50
+
+
+def test_stage_exception_reaches_caller_without_deadlock():
+    missing = []
+    written = []
+
+    def annotate(item):
+        if item in (3, 7):
+            raise RuntimeError(f"chunk {item} 失敗")
+        return item
+
+    stages = [
+        PipelineStage("annotate", annotate, concurrency=3),
+        PipelineStage("assess", lambda item: item),
+        PipelineStage("write", written.append, ordered=True, on_missing=lambda: missing.append(True)),
+    ]
+    pipeline = StagedPipeline(iter(range(20)), stages, queue_size=2, report_interval=0)
+    run_with_timeout(pipeline)
+
+    assert [stage.errors for stage in stages] == [2, 0, 0]
+    assert len(missing) == 2 # 失敗的 chunk 以 None 往下傳，寫入階段得知有缺漏
+    assert written == [item for item in range(20) if item not in (3, 7)]
+    assert pipeline.source_error is None
+
+
+def test_exception_in_ordered_stage_keeps_window_moving():
+    written = []
+
+    def write(item):
+        if item % 5 == 0:
+            raise ValueError("寫入失敗")
+        written.append(item)
+
+    stages = [PipelineStage("annotate", lambda item: item, concurrency=2), PipelineStage("write", write, ordered=True)]
+    run_with_timeout(StagedPipeline(iter(range(40)), stages, queue_size=1, report_interval=0))
+
+    assert stages[1].errors == 8
+    assert written == [item for item in range(40) if item % 5]
+
+
+def test_source_exception_is_recorded_and_processed_chunks_finish():
+    written = []
+
+    def source():
+        yield from range(5)
+        raise OSError("VCF 檔案截斷")
+
+    stages = [PipelineStage("annotate", lambda item: item, concurrency=2), PipelineStage("write", written.append, ordered=True)]
+    pipeline = StagedPipeline(source(), stages, queue_size=2, report_interval=0)
+    run_with_timeout(pipeline)
+
+    assert isinstance(pipeline.source_error, OSError)
+    assert written == list(range(5))
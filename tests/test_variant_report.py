@@ -0,0 +1,71 @@
+import io
+import json
+import re
+
+import mongomock
+import pytest
+
+import annotate_vcf_advanced as pipeline
+
+VARIANTS = [
+    ("KRAS", "12", 25398284, "Pathogenic (致病性)"),
+    ("EGFR", "7", 55249071, "Pathogenic (致病性)"),
+    ("EGFR", "chr7", 55242465, "Likely Pathogenic (可能致病性)"),
+    ("TP53", "17", 7674903, "VUS (意義不明變異)"), # 不列入報告
+    ("ALK", "2", 29443695, "Likely Pathogenic (可能致病性)"),
+]
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient().db.variants
+    collection.insert_many([
+        {"chrom": chrom, "pos": pos, "id": ".", "ref": "C", "alt": "T", "gene_symbol": gene,
+         "pathogenicity_assessment": label, "pathogenicity_evidence": [f"{gene} evidence"]}
+        for gene, chrom, pos, label in VARIANTS
+    ])
+    return collection
+
+
+def render(collection, report_format, group_by_gene, **options):
+    stream = io.StringIO()
+    count = pipeline.write_variant_report(collection, stream, "sample.vcf", ["HP:0030358"], report_format,
+                                          group_by_gene=group_by_gene, page_size=options.pop("page_size", 100), **options)
+    return count, stream.getvalue()
+
+
+def test_html_report_groups_variants_in_gene_sections(collection):
+    count, body = render(collection, "html", True)
+
+    assert count == 4
+    assert "Variants are grouped by gene." in body
+    sections = re.findall(r'<section class="gene-group" id="gene-(\w+)">\n<h4>\1</h4>(.*?)</section>', body, re.S)
+    assert [gene for gene, _ in sections] == ["ALK", "EGFR", "KRAS"]
+    assert [section.count("<strong>Variant ") for _, section in sections] == [1, 2, 1]
+    assert "EGFR evidence" in dict(sections)["EGFR"]
+    assert "TP53" not in body
+
+
+def test_html_report_without_grouping_has_no_sections(collection):
+    count, body = render(collection, "html", False, sort_by="position")
+
+    assert count == 4
+    assert "<section" not in body and "grouped by gene" not in body
+    assert body.index("ALK evidence") < body.index("EGFR evidence") < body.index("KRAS evidence")
+
+
+def test_json_report_groups_match_html(collection):
+    _, body = render(collection, "json", True)
+    report = json.loads(body)
+
+    assert [(group["gene_symbol"], len(group["variants"])) for group in report["genes"]] == [("ALK", 1), ("EGFR", 2), ("KRAS", 1)]
+    assert report["count"] == 4
+
+
+def test_grouped_page_splits_a_gene_across_pages(collection):
+    _, first = render(collection, "html", True, page=1, page_size=2)
+    _, second = render(collection, "html", True, page=2, page_size=2)
+
+    assert re.findall(r'id="gene-(\w+)"', first) == ["ALK", "EGFR"]
+    assert re.findall(r'id="gene-(\w+)"', second) == ["EGFR", "KRAS"]
+    assert first.count("<section") == first.count("</section>")